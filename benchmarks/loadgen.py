@@ -0,0 +1,78 @@
+"""Minimal async load generator used by the benchmark runner."""
+from __future__ import annotations
+import asyncio
+import math
+import time
+from typing import Callable, Dict, List, Optional
+
+import httpx
+
+
+def percentile(samples: List[float], pct: float) -> float:
+    """Nearest-rank percentile of ``samples`` (0 for no samples)."""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    rank = max(math.ceil(pct / 100.0 * len(ordered)) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+def summarize(latencies: List[float], errors: int, elapsed: float) -> Dict[str, float]:
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": round(len(latencies) / elapsed, 1) if elapsed > 0 else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+    }
+
+
+async def run_load(
+    base_url: str,
+    path_for: Callable[[int], str],
+    total: int,
+    concurrency: int,
+    method: str = "GET",
+    body: Optional[bytes] = None,
+    batch: int = 0,
+) -> Dict[str, float]:
+    """Send ``total`` requests with ``concurrency`` workers.
+
+    ``path_for(i)`` gives the path of the ``i``-th request. With ``batch``
+    set, requests are released in waves of that many at once (a stampede on
+    whatever ``path_for`` returns for the wave).
+    """
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    latencies: List[float] = []
+    errors = 0
+    counter = iter(range(total))
+
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60.0) as client:
+
+        async def one(i: int) -> None:
+            nonlocal errors
+            started = time.perf_counter()
+            try:
+                response = await client.request(method, path_for(i), content=body)
+                await response.aread()
+                if response.status_code >= 400:
+                    errors += 1
+                    return
+            except httpx.HTTPError:
+                errors += 1
+                return
+            latencies.append(time.perf_counter() - started)
+
+        async def worker() -> None:
+            for i in counter:
+                await one(i)
+
+        started = time.perf_counter()
+        if batch:
+            for wave in range(0, total, batch):
+                await asyncio.gather(*(one(i) for i in range(wave, min(wave + batch, total))))
+        else:
+            await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    return summarize(latencies, errors, elapsed)
@@ -0,0 +1,83 @@
+"""Local stand-in origin for benchmarks.
+
+Payloads are generated deterministically from the query string and memoized,
+so the origin costs next to nothing per request:
+
+* ``/page.html?size=N&density=D`` - HTML of ``N`` bytes with ``D`` rewritable
+  tokens (``word0``..., matched by the benchmark's replacement rules) and one
+  absolute link back to the origin per KiB.
+* ``/app.js?size=N`` - JavaScript text.
+* ``/blob.bin?size=N`` - opaque binary payload.
+* ``POST /echo`` - reads the request body and returns its length.
+"""
+from __future__ import annotations
+import os
+from functools import lru_cache
+
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import Response
+from starlette.routing import Route
+
+# Absolute URL the origin is reachable at (set by the benchmark runner)
+ORIGIN = os.getenv("BENCH_ORIGIN", "http://127.0.0.1:9000")
+RULE_TOKEN = "word"
+
+
+@lru_cache(maxsize=64)
+def html_payload(size: int, density: int) -> bytes:
+    block = f'<p>Lorem ipsum dolor sit amet <a href="{ORIGIN}/page.html">link</a></p>\n'
+    filler = (block * (1024 // len(block) + 1))[:1024]
+    kib = []
+    for i in range(max(size // 1024, 1)):
+        tokens = " ".join(f"{RULE_TOKEN}{(i + j) % 64}" for j in range(density))
+        kib.append(f"<div>{tokens}</div>" + filler[: max(1024 - len(tokens) - 11, 0)])
+    body = "<html><head><title>bench</title></head><body>" + "".join(kib) + "</body></html>"
+    return body.encode("utf-8")
+
+
+@lru_cache(maxsize=64)
+def js_payload(size: int) -> bytes:
+    line = "function f(a, b) { return a + b; } // padding padding padding\n"
+    return (line * (size // len(line) + 1))[:size].encode("utf-8")
+
+
+@lru_cache(maxsize=16)
+def binary_payload(size: int) -> bytes:
+    seed = bytes(range(256))
+    return (seed * (size // 256 + 1))[:size]
+
+
+def _int(request: Request, name: str, default: int) -> int:
+    try:
+        return int(request.query_params.get(name, default))
+    except ValueError:
+        return default
+
+
+async def page(request: Request) -> Response:
+    body = html_payload(_int(request, "size", 16384), _int(request, "density", 4))
+    return Response(body, media_type="text/html; charset=utf-8")
+
+
+async def script(request: Request) -> Response:
+    return Response(js_payload(_int(request, "size", 65536)), media_type="application/javascript")
+
+
+async def blob(request: Request) -> Response:
+    return Response(binary_payload(_int(request, "size", 1048576)), media_type="application/octet-stream")
+
+
+async def echo(request: Request) -> Response:
+    body = await request.body()
+    return Response(str(len(body)), media_type="text/plain")
+
+
+app = Starlette(
+    routes=[
+        Route("/page.html", page),
+        Route("/app.js", script),
+        Route("/blob.bin", blob),
+        Route("/echo", echo, methods=["POST"]),
+    ]
+)
@@ -0,0 +1,185 @@
+"""Benchmark Replica against a local stand-in origin.
+
+Starts ``benchmarks.origin`` and Replica (each under uvicorn, in their own
+process) on free localhost ports, drives every scenario with the async load
+generator and prints the results as JSON. Replica is restarted for each
+scenario so its peak RSS is measured per scenario. Runs fully offline.
+
+    python -m benchmarks.run [--requests N] [--concurrency C] [--rules R]
+                             [--scenario NAME ...] [--output FILE]
+
+Other Replica settings are passed through the environment as usual, e.g.
+``REWRITE_MODE=buffer python -m benchmarks.run``.
+"""
+from __future__ import annotations
+import argparse
+import asyncio
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional
+
+from .loadgen import run_load
+from .origin import RULE_TOKEN
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class Scenario:
+    __slots__ = ("name", "path_for", "method", "body", "warmup", "batch", "scale")
+
+    def __init__(
+        self,
+        name: str,
+        path_for: Callable[[int, int], str],
+        method: str = "GET",
+        body: Optional[bytes] = None,
+        warmup: bool = False,
+        batch: bool = False,
+        scale: float = 1.0,
+    ) -> None:
+        self.name = name
+        # path_for(i, concurrency) -> request path
+        self.path_for = path_for
+        self.method = method
+        self.body = body
+        # Issue one request before measuring (to fill the cache)
+        self.warmup = warmup
+        # Release requests in waves of `concurrency` on the same path
+        self.batch = batch
+        # Fraction of --requests to send (for expensive scenarios)
+        self.scale = scale
+
+
+SCENARIOS: List[Scenario] = [
+    Scenario("static_hit", lambda i, c: "/app.js?size=65536", warmup=True),
+    Scenario("html_hit", lambda i, c: "/page.html?size=65536&density=8", warmup=True),
+    Scenario("html_miss", lambda i, c: f"/page.html?size=65536&density=8&n={i}"),
+    Scenario("binary_passthrough", lambda i, c: f"/blob.bin?size=16777216&n={i}", scale=0.05),
+    Scenario("post_body", lambda i, c: "/echo", method="POST", body=b"x" * 65536),
+    Scenario("stampede", lambda i, c: f"/page.html?size=65536&density=8&wave={i // c}", batch=True),
+]
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port: int, timeout: float = 15.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError(f"Nothing listening on port {port} after {timeout}s")
+
+
+def peak_rss_kb(pid: int) -> Optional[int]:
+    """Peak resident set size of ``pid`` in KiB (Linux only)."""
+    try:
+        with open(f"/proc/{pid}/status", "r", encoding="ascii") as fh:
+            for line in fh:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+@contextmanager
+def serve(app: str, port: int, env: Dict[str, str]) -> Iterator[subprocess.Popen]:
+    cmd = [sys.executable, "-m", "uvicorn", app, "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"]
+    proc = subprocess.Popen(
+        cmd, cwd=ROOT, env={**os.environ, **env}, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        wait_for_port(port)
+        yield proc
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            proc.wait()
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def replacement_rules(count: int) -> Dict[str, str]:
+    return {f"{RULE_TOKEN}{i}": f"{RULE_TOKEN.upper()}{i}" for i in range(count)}
+
+
+async def _drive(scenario: Scenario, base_url: str, total: int, concurrency: int) -> Dict[str, float]:
+    path_for = lambda i: scenario.path_for(i, concurrency)  # noqa: E731
+    if scenario.warmup:
+        await run_load(base_url, path_for, 1, 1, scenario.method, scenario.body)
+    return await run_load(
+        base_url,
+        path_for,
+        total,
+        concurrency,
+        scenario.method,
+        scenario.body,
+        batch=concurrency if scenario.batch else 0,
+    )
+
+
+def run(scenarios: List[Scenario], total: int, concurrency: int, rules: int) -> Dict[str, object]:
+    origin_port = free_port()
+    origin = f"http://127.0.0.1:{origin_port}"
+    results: Dict[str, object] = {}
+    with serve("benchmarks.origin:app", origin_port, {"BENCH_ORIGIN": origin}):
+        for scenario in scenarios:
+            port = free_port()
+            env = {"TARGET_ORIGIN": origin, "REPLACEMENTS": json.dumps(replacement_rules(rules))}
+            with serve("replica.main:app", port, env) as proc:
+                count = max(int(total * scenario.scale), concurrency)
+                stats = asyncio.run(_drive(scenario, f"http://127.0.0.1:{port}", count, concurrency))
+                stats["peak_rss_kb"] = peak_rss_kb(proc.pid)
+            results[scenario.name] = stats
+    return {
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "requests": total,
+        "concurrency": concurrency,
+        "rules": rules,
+        "scenarios": results,
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=2000, help="requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--rules", type=int, default=16, help="number of REPLACEMENTS rules")
+    parser.add_argument("--scenario", action="append", choices=[s.name for s in SCENARIOS], help="run only these")
+    parser.add_argument("--output", help="write the JSON report to this file instead of stdout")
+    args = parser.parse_args(argv)
+
+    selected = [s for s in SCENARIOS if not args.scenario or s.name in args.scenario]
+    report = json.dumps(run(selected, args.requests, args.concurrency, args.rules), indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as fh:
+            fh.write(report + "\n")
+    else:
+        print(report)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,23 +1,433 @@
 from __future__ import annotations
+import asyncio
+import hashlib
+import logging
 import time
-from typing import Any, Dict, Optional
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
+from .compression import compress, decompress
+
+logger = logging.getLogger("replica.cache")
+
+
+class _Entry:
+    __slots__ = ("value", "expires", "stale_until", "size", "digests")
+
+    def __init__(
+        self, value: Any, expires: float, stale_until: float, size: int, digests: Tuple[bytes, ...] = ()
+    ) -> None:
+        self.value = value
+        self.expires = expires
+        self.stale_until = stale_until
+        self.size = size
+        # References held on a BodyStore (see Cache.bodies)
+        self.digests = digests
+
+
+class BodyStore:
+    """Content-addressed, reference-counted store of cached bodies.
+
+    Identical bodies cached under several keys (cache-busting query strings,
+    aliases, per-locale copies...) are held once: ``acquire`` returns the
+    stored copy of a body and takes a reference on it, ``release`` drops one
+    and forgets the body with the last reference.
+    """
 
-class Cache:
     def __init__(self) -> None:
-        self._store: Dict[str, Dict[str, Any]] = {}
+        self._bodies: Dict[bytes, List[Any]] = {}
+        # Unique body bytes held, and what they would take without sharing
+        self.current_bytes = 0
+        self.referenced_bytes = 0
+
+    def acquire(self, body: bytes) -> Tuple[bytes, bytes, int]:
+        """Return ``(digest, stored_body, added_bytes)`` for ``body``.
+
+        ``added_bytes`` is 0 when an identical body was already held.
+        """
+        digest = hashlib.blake2b(body, digest_size=16).digest()
+        self.referenced_bytes += len(body)
+        held = self._bodies.get(digest)
+        if held is not None:
+            held[1] += 1
+            return digest, held[0], 0
+        body = bytes(body)
+        self._bodies[digest] = [body, 1]
+        self.current_bytes += len(body)
+        return digest, body, len(body)
+
+    def release(self, digest: bytes) -> int:
+        """Drop a reference; return the bytes freed (0 while still shared)."""
+        held = self._bodies.get(digest)
+        if held is None:
+            return 0
+        size = len(held[0])
+        self.referenced_bytes -= size
+        held[1] -= 1
+        if held[1] > 0:
+            return 0
+        del self._bodies[digest]
+        self.current_bytes -= size
+        return size
+
+    @property
+    def saved_bytes(self) -> int:
+        """Bytes not held thanks to sharing."""
+        return self.referenced_bytes - self.current_bytes
+
+    def __len__(self) -> int:
+        return len(self._bodies)
+
+
+class CachedResponse:
+    """A cached response body plus what is needed to serve and revalidate it.
+
+    ``validators`` holds the upstream ``etag``/``last-modified`` values used for
+    conditional requests to the origin; ``headers`` are the (sanitized) headers
+    served to clients. ``shared`` entries instead hold the raw upstream headers
+    and are shared by every incoming origin, so their headers are sanitized for
+    the requesting origin each time they are served.
+
+    ``body`` is stored in the content coding ``encoding`` ("" for identity);
+    ``variants`` holds the same body in other codings.
+
+    ``date`` is when the response was generated and ``expires`` when it stops
+    being fresh (wall clock, see ``policy.Freshness``); they drive the
+    ``Cache-Control``/``Age`` headers it is served with.
+    """
+
+    __slots__ = ("body", "headers", "status", "validators", "shared", "encoding", "variants", "date", "expires")
+
+    def __init__(
+        self,
+        body: bytes,
+        headers: Dict[str, str],
+        status: int,
+        validators: Optional[Dict[str, str]] = None,
+        shared: bool = False,
+        encoding: str = "",
+        variants: Optional[Dict[str, bytes]] = None,
+        date: Optional[float] = None,
+        expires: Optional[float] = None,
+    ) -> None:
+        self.body = body
+        self.headers = headers
+        self.status = status
+        self.validators = validators or {}
+        self.shared = shared
+        self.encoding = encoding
+        self.variants = variants or {}
+        self.date = time.time() if date is None else date
+        self.expires = self.date if expires is None else expires
+
+    def bodies(self) -> List[bytes]:
+        """The body followed by its ``variants`` (in ``to_dict`` order)."""
+        return [self.body, *self.variants.values()]
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Everything but the bodies, e.g. to persist the entry (see ``from_dict``)."""
+        return {
+            "headers": self.headers,
+            "status": self.status,
+            "validators": self.validators,
+            "shared": self.shared,
+            "encoding": self.encoding,
+            "variants": list(self.variants),
+            "sizes": [len(body) for body in self.bodies()],
+            "date": self.date,
+            "expires": self.expires,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any], bodies: List[bytes]) -> "CachedResponse":
+        return cls(
+            bodies[0],
+            data["headers"],
+            data["status"],
+            data["validators"],
+            data["shared"],
+            data["encoding"],
+            dict(zip(data["variants"], bodies[1:])),
+            data["date"],
+            data["expires"],
+        )
+
+    def encoded(self, encoding: Optional[str]) -> bytes:
+        """Return the body in ``encoding``, decompressing for identity (``None``).
+
+        Codings that are neither the stored one nor a variant are produced from
+        the decompressed body.
+        """
+        if encoding == self.encoding:
+            return self.body
+        if encoding in self.variants:
+            return self.variants[encoding]
+        identity = decompress(self.body, self.encoding)
+        return compress(identity, encoding) if encoding else identity
+
+
+def _value_size(value: Any) -> int:
+    """Return the body size (in bytes) accounted against the cache budget.
+
+    For ``CachedResponse`` values and ``(body, headers, status)`` tuples only the
+    body (in every stored coding) is counted. Plain bytes values are counted as-is and anything else is
+    free.
+    """
+    if isinstance(value, CachedResponse):
+        return len(value.body) + sum(len(body) for body in value.variants.values())
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return len(value)
+    if isinstance(value, tuple) and value and isinstance(value[0], (bytes, bytearray, memoryview)):
+        return len(value[0])
+    return 0
+
+
+class Cache:
+    """In-memory TTL cache with LRU eviction under a byte budget.
+
+    ``max_bytes`` bounds the total body bytes held (0 disables the limit).
+    Entries may be kept for a ``grace`` period past their TTL so they can still
+    be served stale (see ``lookup``). Entries past their grace period are
+    dropped on read and by ``sweep``, which the application runs periodically
+    via ``run_sweeper``. ``on_evict(key, value, ttl, grace)`` is called for
+    entries pushed out by the byte budget (e.g. to demote them to disk).
 
-    def get(self, key: str) -> Optional[Dict[str, Any]]:
+    With a ``bodies`` store, the bodies of ``CachedResponse`` values are
+    deduplicated by content: ``current_bytes`` counts every shared body once,
+    so evicting an entry whose body is still referenced frees nothing and the
+    budget keeps evicting until memory is actually released.
+    """
+
+    def __init__(
+        self,
+        max_bytes: int = 0,
+        on_evict: Optional[Callable[[str, Any, float, float], None]] = None,
+        bodies: Optional[BodyStore] = None,
+    ) -> None:
+        self._store: "OrderedDict[str, _Entry]" = OrderedDict()
+        self.max_bytes = max_bytes
+        self.on_evict = on_evict
+        self.bodies = bodies
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: str) -> Optional[Any]:
+        """Return the value for ``key`` if it is still fresh."""
+        found = self.lookup(key)
+        if found is None or found[1] > 0:
+            return None
+        return found[0]
+
+    def lookup(self, key: str, keep_expired: bool = False) -> Optional[Tuple[Any, float]]:
+        """Return ``(value, staleness)`` for ``key``, fresh or within grace.
+
+        ``staleness`` is how many seconds the entry is past its TTL (0 when
+        fresh). With ``keep_expired``, entries past their grace period that
+        were not swept yet are returned too (e.g. while the origin is down).
+        """
         entry = self._store.get(key)
-        if not entry:
+        if entry is None:
+            self.misses += 1
+            return None
+        now = time.monotonic()
+        if now > entry.stale_until and not keep_expired:
+            self._remove(key)
+            self.expirations += 1
+            self.misses += 1
             return None
-        if time.time() > entry["expires"]:
-            del self._store[key]
+        self._store.move_to_end(key)
+        self.hits += 1
+        return entry.value, max(0.0, now - entry.expires)
+
+    def put(self, key: str, value: Any, ttl: int, grace: float = 0) -> None:
+        size = _value_size(value)
+        if self.max_bytes and size > self.max_bytes:
+            # Never let a single object flush the whole cache
+            self._remove(key)
+            return
+        self._remove(key)
+        digests: Tuple[bytes, ...] = ()
+        if self.bodies is not None and isinstance(value, CachedResponse):
+            digests, size = self._share_bodies(value)
+        expires = time.monotonic() + ttl
+        self._store[key] = _Entry(value, expires, expires + max(grace, 0), size, digests)
+        self.current_bytes += size
+        if self.max_bytes:
+            while self.current_bytes > self.max_bytes and self._store:
+                oldest = next(iter(self._store))
+                evicted = self._store[oldest]
+                self._remove(oldest)
+                self.evictions += 1
+                if self.on_evict is not None:
+                    now = time.monotonic()
+                    try:
+                        self.on_evict(oldest, evicted.value, evicted.expires - now, evicted.stale_until - evicted.expires)
+                    except Exception as exc:  # pragma: no cover - defensive
+                        logger.warning("Cache eviction callback failed: %s", exc)
+
+    def peek(self, key: str) -> Optional[Any]:
+        """Return the value for ``key`` (even if stale) without counting a lookup."""
+        entry = self._store.get(key)
+        return None if entry is None else entry.value
+
+    def entries(self) -> List[Tuple[str, Any, float, float]]:
+        """Return ``(key, value, ttl, grace)`` for every entry within its grace
+        period, least recently used first (e.g. to snapshot the cache)."""
+        now = time.monotonic()
+        return [
+            (key, entry.value, entry.expires - now, entry.stale_until - entry.expires)
+            for key, entry in self._store.items()
+            if entry.stale_until > now
+        ]
+
+    def expiry(self, key: str) -> Optional[Tuple[float, float]]:
+        """Return ``(ttl, grace)`` left for ``key``; ``ttl`` is negative once stale."""
+        entry = self._store.get(key)
+        if entry is None:
             return None
-        return entry["value"]
+        return entry.expires - time.monotonic(), entry.stale_until - entry.expires
+
+    def touch(self, key: str, ttl: int, grace: float = 0) -> bool:
+        """Give an existing entry a fresh TTL (e.g. after revalidation)."""
+        entry = self._store.get(key)
+        if entry is None:
+            return False
+        entry.expires = time.monotonic() + ttl
+        entry.stale_until = entry.expires + max(grace, 0)
+        self._store.move_to_end(key)
+        return True
+
+    def delete(self, key: str) -> None:
+        self._remove(key)
+
+    def sweep(self) -> int:
+        """Drop every entry past its grace period and return how many were removed."""
+        now = time.monotonic()
+        expired = [key for key, entry in self._store.items() if now > entry.stale_until]
+        for key in expired:
+            self._remove(key)
+        self.expirations += len(expired)
+        return len(expired)
 
-    def put(self, key: str, value: Any, ttl: int) -> None:
-        self._store[key] = {"value": value, "expires": time.time() + ttl}
+    async def run_sweeper(self, interval: float, paused: Optional[Callable[[], bool]] = None) -> None:
+        """Periodically sweep expired entries until cancelled (skipped while ``paused()``)."""
+        while True:
+            await asyncio.sleep(interval)
+            if paused is not None and paused():
+                continue
+            try:
+                removed = self.sweep()
+            except Exception as exc:  # pragma: no cover - defensive
+                logger.warning("Cache sweep failed: %s", exc)
+                continue
+            if removed:
+                logger.debug("Swept %d expired cache entries", removed)
 
     def clear(self) -> None:
-        self._store.clear()
+        for key in list(self._store):
+            self._remove(key)
+        self.current_bytes = 0
+
+    def _share_bodies(self, value: CachedResponse) -> Tuple[Tuple[bytes, ...], int]:
+        """Point ``value`` at the shared copies of its bodies.
+
+        Returns the digests referenced and the bytes newly held.
+        """
+        digest, value.body, added = self.bodies.acquire(value.body)
+        digests = [digest]
+        for encoding, body in value.variants.items():
+            digest, value.variants[encoding], size = self.bodies.acquire(body)
+            digests.append(digest)
+            added += size
+        return tuple(digests), added
+
+    def _remove(self, key: str) -> None:
+        entry = self._store.pop(key, None)
+        if entry is None:
+            return
+        if entry.digests:
+            self.current_bytes -= sum(self.bodies.release(digest) for digest in entry.digests)
+        else:
+            self.current_bytes -= entry.size
+
+    def __len__(self) -> int:
+        return len(self._store)
+
+    def __contains__(self, key: object) -> bool:
+        return key in self._store
+
+
+class SingleFlight:
+    """Coalesce concurrent work (e.g. upstream fetches) for the same key.
+
+    The first caller to ``join`` a key becomes the leader and must
+    ``release`` the returned event when done; later callers get the same event
+    to ``wait`` on. A flight older than its timeout is considered abandoned and
+    the next caller takes over as leader.
+
+    Keys whose result could not be shared (e.g. an uncacheable response) can
+    be marked as passes with ``mark_pass``: callers check ``is_pass`` and do
+    their work without coalescing until the mark expires (at most
+    ``max_passes`` keys are remembered).
+    """
+
+    def __init__(self, max_passes: int = 10000) -> None:
+        self._flights: Dict[str, Tuple[asyncio.Event, float]] = {}
+        self._passes: "OrderedDict[str, float]" = OrderedDict()
+        self.max_passes = max_passes
+        self.leaders = 0
+        self.coalesced = 0
+        self.timeouts = 0
+
+    def join(self, key: str, timeout: float) -> Tuple[bool, asyncio.Event]:
+        """Return ``(is_leader, event)`` for ``key``."""
+        flight = self._flights.get(key)
+        now = time.monotonic()
+        if flight is None or now - flight[1] > timeout:
+            event = asyncio.Event()
+            self._flights[key] = (event, now)
+            self.leaders += 1
+            return True, event
+        self.coalesced += 1
+        return False, flight[0]
+
+    def release(self, key: str, event: asyncio.Event) -> None:
+        flight = self._flights.get(key)
+        # An abandoned leader must not end a flight that was taken over
+        if flight is not None and flight[0] is event:
+            del self._flights[key]
+        event.set()
+
+    async def wait(self, event: asyncio.Event, timeout: float) -> bool:
+        """Wait for the leader to finish; return False on timeout."""
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            return False
+        return True
+
+    def mark_pass(self, key: str, ttl: float) -> None:
+        """Skip coalescing ``key`` for ``ttl`` seconds (0 forgets the mark)."""
+        if ttl <= 0:
+            self._passes.pop(key, None)
+            return
+        self._passes[key] = time.monotonic() + ttl
+        self._passes.move_to_end(key)
+        while len(self._passes) > self.max_passes:
+            self._passes.popitem(last=False)
+
+    def is_pass(self, key: str) -> bool:
+        until = self._passes.get(key)
+        if until is None:
+            return False
+        if time.monotonic() > until:
+            del self._passes[key]
+            return False
+        return True
+
+    def __len__(self) -> int:
+        return len(self._flights)
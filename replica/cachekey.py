@@ -0,0 +1,128 @@
+from __future__ import annotations
+import re
+from collections import OrderedDict
+from fnmatch import translate
+from functools import lru_cache
+from typing import List, Mapping, Optional, Sequence, Tuple
+from urllib.parse import parse_qsl, urlencode
+
+# Vary'd request headers that do not split cache entries: the proxy never
+# forwards Accept-Encoding and negotiates the coding of cached bodies itself.
+_IGNORED_VARY = frozenset(("accept-encoding",))
+
+
+def _glob_matcher(patterns: Sequence[str]) -> Optional[re.Pattern[str]]:
+    if not patterns:
+        return None
+    return re.compile("|".join(translate(p.lower()) for p in patterns))
+
+
+class CacheKeyBuilder:
+    """Build normalized cache keys.
+
+    Query parameters are sorted by name; parameters matching ``ignore_params``
+    (shell-style globs such as ``utm_*``) are dropped and, when
+    ``allow_params`` is given, only matching ones are kept. The values of
+    ``key_headers``, the impersonation profile (``include_profile``) and the
+    request headers named by an upstream ``Vary`` are folded into a suffix.
+    """
+
+    __slots__ = ("_ignore", "_allow", "_headers", "_profile")
+
+    def __init__(
+        self,
+        ignore_params: Sequence[str] = (),
+        allow_params: Sequence[str] = (),
+        key_headers: Sequence[str] = (),
+        include_profile: bool = False,
+    ) -> None:
+        self._ignore = _glob_matcher(ignore_params)
+        self._allow = _glob_matcher(allow_params)
+        self._headers = tuple(name.lower() for name in key_headers)
+        self._profile = include_profile
+
+    def normalize_query(self, query: str) -> str:
+        if not query:
+            return ""
+        params = []
+        for name, value in parse_qsl(query, keep_blank_values=True):
+            lowered = name.lower()
+            if self._ignore is not None and self._ignore.match(lowered):
+                continue
+            if self._allow is not None and not self._allow.match(lowered):
+                continue
+            params.append((name, value))
+        # sorted() is stable, so repeated parameters keep their relative order
+        params.sort(key=lambda param: param[0])
+        return urlencode(params)
+
+    def url(self, url: str, query: str) -> str:
+        """Return ``url`` with its normalized ``query`` appended (if any)."""
+        query = self.normalize_query(query)
+        return f"{url}?{query}" if query else url
+
+    def variant(self, headers: Mapping[str, str], profile: str, vary: Sequence[str] = ()) -> str:
+        """Return the key suffix for a request (empty when nothing is folded)."""
+        parts = [f"{name}={headers.get(name, '')}" for name in self._headers]
+        if self._profile:
+            parts.append(f"profile={profile}")
+        parts.extend(f"{name}={headers.get(name, '')}" for name in vary if name not in self._headers)
+        return "|" + "|".join(parts) if parts else ""
+
+
+@lru_cache(maxsize=8)
+def get_key_builder(
+    ignore_params: Tuple[str, ...],
+    allow_params: Tuple[str, ...],
+    key_headers: Tuple[str, ...],
+    include_profile: bool,
+) -> CacheKeyBuilder:
+    return CacheKeyBuilder(ignore_params, allow_params, key_headers, include_profile)
+
+
+def parse_vary(value: Optional[str]) -> Optional[Tuple[str, ...]]:
+    """Return the request headers a response varies on.
+
+    ``None`` means the response must not be cached (``Vary: *``).
+    """
+    if not value:
+        return ()
+    names = []
+    for name in value.split(","):
+        name = name.strip().lower()
+        if name == "*":
+            return None
+        if name and name not in _IGNORED_VARY and name not in names:
+            names.append(name)
+    return tuple(sorted(names))
+
+
+class VaryIndex:
+    """Remember, per base key, which request headers the cached responses
+    vary on (bounded, least recently used forgotten first)."""
+
+    def __init__(self, max_entries: int = 10000) -> None:
+        self.max_entries = max_entries
+        self._index: "OrderedDict[str, Tuple[str, ...]]" = OrderedDict()
+
+    def get(self, key: str) -> Tuple[str, ...]:
+        names = self._index.get(key)
+        if names is None:
+            return ()
+        self._index.move_to_end(key)
+        return names
+
+    def set(self, key: str, names: Tuple[str, ...]) -> None:
+        if not names:
+            self._index.pop(key, None)
+            return
+        self._index[key] = names
+        self._index.move_to_end(key)
+        while len(self._index) > self.max_entries:
+            self._index.popitem(last=False)
+
+    def items(self) -> List[Tuple[str, Tuple[str, ...]]]:
+        return list(self._index.items())
+
+    def __len__(self) -> int:
+        return len(self._index)
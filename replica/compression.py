@@ -0,0 +1,107 @@
+from __future__ import annotations
+import gzip
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+try:  # optional
+    import brotli
+except ImportError:  # pragma: no cover - depends on the environment
+    brotli = None
+
+try:  # optional
+    import zstandard
+except ImportError:  # pragma: no cover - depends on the environment
+    zstandard = None
+
+# Content codings this process can produce and decode.
+SUPPORTED_ENCODINGS = tuple(
+    name for name, module in (("br", brotli), ("zstd", zstandard), ("gzip", gzip)) if module is not None
+)
+
+# Media types worth compressing; images, video and fonts are already compressed.
+_COMPRESSIBLE_TYPES = ("text/", "json", "javascript", "xml", "svg")
+
+
+def usable_encodings(encodings: Iterable[str]) -> List[str]:
+    """Return the configured ``encodings`` that are supported, in order."""
+    return [name for name in encodings if name in SUPPORTED_ENCODINGS]
+
+
+def is_compressible(content_type: str) -> bool:
+    content_type = content_type.lower()
+    return any(t in content_type for t in _COMPRESSIBLE_TYPES)
+
+
+def compress(data: bytes, encoding: str) -> bytes:
+    if encoding == "gzip":
+        # mtime=0 keeps the output (and so the content digest) deterministic
+        return gzip.compress(data, compresslevel=6, mtime=0)
+    if encoding == "br" and brotli is not None:
+        return brotli.compress(data, quality=5)
+    if encoding == "zstd" and zstandard is not None:
+        return zstandard.ZstdCompressor(level=3).compress(data)
+    raise ValueError(f"Unsupported content coding: {encoding}")
+
+
+def decompress(data: bytes, encoding: str) -> bytes:
+    if not encoding:
+        return data
+    if encoding == "gzip":
+        return gzip.decompress(data)
+    if encoding == "br" and brotli is not None:
+        return brotli.decompress(data)
+    if encoding == "zstd" and zstandard is not None:
+        return zstandard.ZstdDecompressor().decompress(data)
+    raise ValueError(f"Unsupported content coding: {encoding}")
+
+
+def encode_for_cache(
+    data: bytes, content_type: str, encodings: Sequence[str], min_size: int = 0
+) -> Tuple[bytes, str, Dict[str, bytes]]:
+    """Compress ``data`` for storage.
+
+    Returns ``(body, encoding, variants)``: ``body`` in the first usable coding
+    of ``encodings`` that shrinks it. Only that coding is produced; the others
+    are encoded on demand when a client asks for them, so ``variants`` is
+    empty. Small, incompressible or already compressed payloads are returned
+    unchanged with an empty ``encoding``.
+    """
+    encodings = usable_encodings(encodings)
+    if not encodings or len(data) < min_size or not is_compressible(content_type):
+        return data, "", {}
+    encoding = encodings[0]
+    body = compress(data, encoding)
+    if len(body) >= len(data):
+        return data, "", {}
+    return body, encoding, {}
+
+
+def negotiate(accept_encoding: str, offered: Sequence[str]) -> Optional[str]:
+    """Pick the coding of ``offered`` to answer ``accept_encoding`` with.
+
+    Highest client q-value wins, ties go to the order of ``offered``. Returns
+    ``None`` when the client should get the identity representation.
+    """
+    if not accept_encoding or not offered:
+        return None
+    prefs: Dict[str, float] = {}
+    for item in accept_encoding.split(","):
+        name, _, params = item.strip().partition(";")
+        name = name.strip().lower()
+        if not name:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        prefs[name] = q
+
+    best: Optional[str] = None
+    best_q = 0.0
+    for name in offered:
+        q = prefs.get(name, prefs.get("*", 0.0))
+        if q > best_q:
+            best, best_q = name, q
+    return best
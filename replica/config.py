@@ -14,6 +14,82 @@ def _is_valid_url(value: str) -> bool:
     return p.scheme in ("http", "https") and bool(p.netloc)
 
 
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, str(default)))
+    except ValueError:
+        return default
+
+
+def _env_bool(name: str, default: bool) -> bool:
+    raw = os.getenv(name)
+    if raw is None or raw == "":
+        return default
+    return raw.strip().lower() in ("1", "true", "yes", "on")
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, str(default)))
+    except ValueError:
+        return default
+
+
+def _env_list(name: str, default: str) -> List[str]:
+    return [item.strip() for item in os.getenv(name, default).split(",") if item.strip()]
+
+
+# Integer settings that are validated generically on startup.
+_INT_SETTINGS = (
+    "CACHE_TTL_TEXT",
+    "UPSTREAM_MAX_CONNECTIONS",
+    "UPSTREAM_MAX_HOST_CONNECTIONS",
+    "UPSTREAM_MAX_INFLIGHT",
+    "UPSTREAM_MAX_INFLIGHT_PER_PROFILE",
+    "UPSTREAM_QUEUE_SIZE",
+    "UPSTREAM_RETRY_AFTER",
+    "REQUEST_MAX_BODY_BYTES",
+    "REQUEST_BUFFER_MAX_BYTES",
+    "CACHE_MAX_BYTES_STATIC",
+    "CACHE_MAX_BYTES_HTML",
+    "CACHE_MAX_BYTES_RAW",
+    "STREAM_CACHE_MAX_BYTES",
+    "DISK_CACHE_MAX_BYTES",
+    "DISK_CACHE_PROMOTE_HITS",
+    "SHARED_CACHE_MAX_BYTES",
+    "SHARED_CACHE_LOCAL_BYTES",
+    "CACHE_COMPRESS_MIN_BYTES",
+    "REWRITE_PLAN_CACHE_SIZE",
+    "WARMUP_CONCURRENCY",
+    "WARMUP_MAX_URLS",
+    "PREFETCH_CONCURRENCY",
+    "PREFETCH_MAX_ASSETS",
+    "CIRCUIT_MIN_REQUESTS",
+    "CIRCUIT_HALF_OPEN_PROBES",
+)
+
+# Float settings that are validated generically on startup.
+_FLOAT_SETTINGS = (
+    "UPSTREAM_KEEPALIVE_EXPIRY",
+    "CACHE_SWEEP_INTERVAL",
+    "COALESCE_TIMEOUT",
+    "COALESCE_PASS_TTL",
+    "UPSTREAM_TIMEOUT",
+    "UPSTREAM_QUEUE_TIMEOUT",
+    "UPSTREAM_CONNECT_TIMEOUT",
+    "UPSTREAM_READ_TIMEOUT",
+    "CIRCUIT_FAILURE_RATE",
+    "CIRCUIT_WINDOW",
+    "CIRCUIT_OPEN_SECONDS",
+    "CACHE_STALE_WHILE_REVALIDATE",
+    "CACHE_STALE_IF_ERROR",
+    "WARMUP_TIMEOUT",
+    "CACHE_SNAPSHOT_INTERVAL",
+    "PEER_TIMEOUT",
+    "PEER_HOT_TTL",
+)
+
+
 class Settings:
     """Lightweight settings object populated from environment variables.
 
@@ -26,9 +102,74 @@ class Settings:
     STATIC_EXTENSIONS: List[str]
     CACHE_TTL_STATIC: int
     CACHE_TTL_HTML: int
+    CACHE_TTL_TEXT: int
+    CACHE_TTL_TYPES: dict[str, int]
     INJECT_JS: str
     INJECT_JS_FILE: str
     INJECT_JS_LOCATION: str  # "head" or "body"
+    UPSTREAM_MAX_CONNECTIONS: int
+    UPSTREAM_MAX_HOST_CONNECTIONS: int
+    UPSTREAM_KEEPALIVE_EXPIRY: float
+    UPSTREAM_TIMEOUT: float
+    UPSTREAM_CONNECT_TIMEOUT: float
+    UPSTREAM_READ_TIMEOUT: float
+    UPSTREAM_MAX_INFLIGHT: int
+    UPSTREAM_MAX_INFLIGHT_PER_PROFILE: int
+    UPSTREAM_QUEUE_SIZE: int
+    UPSTREAM_QUEUE_TIMEOUT: float
+    UPSTREAM_RETRY_AFTER: int
+    REQUEST_MAX_BODY_BYTES: int
+    REQUEST_BUFFER_MAX_BYTES: int
+    CIRCUIT_FAILURE_RATE: float
+    CIRCUIT_MIN_REQUESTS: int
+    CIRCUIT_WINDOW: float
+    CIRCUIT_OPEN_SECONDS: float
+    CIRCUIT_HALF_OPEN_PROBES: int
+    CACHE_MAX_BYTES_STATIC: int
+    CACHE_DEDUPE_STATIC: bool
+    CACHE_MAX_BYTES_HTML: int
+    CACHE_MAX_BYTES_RAW: int
+    CACHE_SWEEP_INTERVAL: float
+    CACHE_COMPRESSION: List[str]
+    CACHE_COMPRESS_MIN_BYTES: int
+    CACHE_KEY_IGNORE_PARAMS: List[str]
+    CACHE_KEY_ALLOW_PARAMS: List[str]
+    CACHE_KEY_HEADERS: List[str]
+    CACHE_KEY_PROFILE: bool
+    STREAM_STATIC: bool
+    STREAM_CACHE_MAX_BYTES: int
+    REWRITE_MODE: str  # "stream" or "buffer"
+    REWRITE_PLAN_CACHE_SIZE: int
+    DISK_CACHE_DIR: str
+    SHARED_CACHE_PATH: str
+    SHARED_CACHE_MAX_BYTES: int
+    SHARED_CACHE_LOCAL_BYTES: int
+    PEERS: List[str]
+    PEER_SELF: str
+    PEER_PATH: str
+    PEER_TOKEN: str
+    PEER_TIMEOUT: float
+    PEER_HOT_TTL: float
+    CACHE_SNAPSHOT_PATH: str
+    CACHE_SNAPSHOT_INTERVAL: float
+    DISK_CACHE_MAX_BYTES: int
+    DISK_CACHE_PROMOTE_HITS: int
+    COALESCE_TIMEOUT: float
+    COALESCE_PASS_TTL: float
+    CACHE_STALE_WHILE_REVALIDATE: float
+    CACHE_STALE_IF_ERROR: float
+    METRICS_ENABLED: bool
+    METRICS_PATH: str
+    WARMUP_URLS: List[str]
+    WARMUP_SITEMAP: str
+    WARMUP_ORIGIN: str
+    WARMUP_CONCURRENCY: int
+    WARMUP_MAX_URLS: int
+    WARMUP_TIMEOUT: float
+    PREFETCH_ASSETS: bool
+    PREFETCH_CONCURRENCY: int
+    PREFETCH_MAX_ASSETS: int
+    RANGE_FETCH_FULL: bool
 
     # Default origin used only as an internal fallback when a request does not provide
     # a Host header. This is not configurable via environment variables anymore.
@@ -67,6 +208,18 @@ class Settings:
         except ValueError:
             self.CACHE_TTL_HTML = 300
 
+        # Default TTLs apply when the origin sends no max-age/s-maxage/Expires:
+        # CACHE_TTL_TEXT for rewritten non-HTML text (JSON, XML, JS, CSS without
+        # a static extension) and CACHE_TTL_TYPES, a JSON object of media types
+        # (or "type/*") to TTLs, overriding any of them. A TTL of 0 disables
+        # caching.
+        self.CACHE_TTL_TEXT = _env_int("CACHE_TTL_TEXT", 60)
+        try:
+            raw_types = json.loads(os.getenv("CACHE_TTL_TYPES", "") or "{}")
+            self.CACHE_TTL_TYPES = {str(k).lower(): int(v) for k, v in raw_types.items()}
+        except (ValueError, TypeError, AttributeError):
+            self.CACHE_TTL_TYPES = {}
+
         # Optional inline JavaScript to inject into HTML responses (string).
         # If provided, this string will be wrapped in <script>...</script> and
         # inserted before the closing </body> tag (or appended if no closing tag).
@@ -86,6 +239,181 @@ class Settings:
         if self.INJECT_JS_LOCATION not in ("head", "body"):
             self.INJECT_JS_LOCATION = "body"
 
+        # Pooled upstream clients (one per impersonation profile). MAX_CONNECTIONS
+        # bounds concurrent transfers per profile, MAX_HOST_CONNECTIONS caps open
+        # connections to a single host (0 = unlimited) and KEEPALIVE_EXPIRY is the
+        # idle time in seconds after which a pooled connection is not reused.
+        self.UPSTREAM_MAX_CONNECTIONS = _env_int("UPSTREAM_MAX_CONNECTIONS", 100)
+        self.UPSTREAM_MAX_HOST_CONNECTIONS = _env_int("UPSTREAM_MAX_HOST_CONNECTIONS", 0)
+        self.UPSTREAM_KEEPALIVE_EXPIRY = _env_float("UPSTREAM_KEEPALIVE_EXPIRY", 60.0)
+        # UPSTREAM_CONNECT_TIMEOUT bounds connecting to the origin. The curl
+        # transport has no pool or write timeouts: it aborts a transfer that
+        # stalls (no bytes received) for UPSTREAM_CONNECT_TIMEOUT +
+        # UPSTREAM_READ_TIMEOUT seconds. UPSTREAM_TIMEOUT bounds how long
+        # coalesced requests wait for the one fetching, and the pool waits and
+        # writes of the plain client that streams request bodies.
+        self.UPSTREAM_TIMEOUT = _env_float("UPSTREAM_TIMEOUT", 30.0)
+        self.UPSTREAM_CONNECT_TIMEOUT = _env_float("UPSTREAM_CONNECT_TIMEOUT", 5.0)
+        self.UPSTREAM_READ_TIMEOUT = _env_float("UPSTREAM_READ_TIMEOUT", self.UPSTREAM_TIMEOUT)
+
+        # Cap on upstream requests in flight, overall and per impersonation
+        # profile (0 = unlimited). Excess requests wait in a queue of
+        # UPSTREAM_QUEUE_SIZE for at most UPSTREAM_QUEUE_TIMEOUT seconds and are
+        # otherwise answered 503 with Retry-After: UPSTREAM_RETRY_AFTER.
+        self.UPSTREAM_MAX_INFLIGHT = _env_int("UPSTREAM_MAX_INFLIGHT", 256)
+        self.UPSTREAM_MAX_INFLIGHT_PER_PROFILE = _env_int("UPSTREAM_MAX_INFLIGHT_PER_PROFILE", 0)
+        self.UPSTREAM_QUEUE_SIZE = _env_int("UPSTREAM_QUEUE_SIZE", 1024)
+        self.UPSTREAM_QUEUE_TIMEOUT = _env_float("UPSTREAM_QUEUE_TIMEOUT", 10.0)
+        self.UPSTREAM_RETRY_AFTER = _env_int("UPSTREAM_RETRY_AFTER", 5)
+
+        # Request bodies (POST, PUT...) larger than REQUEST_MAX_BODY_BYTES are
+        # refused with 413 (0 = unlimited). Bodies up to
+        # REQUEST_BUFFER_MAX_BYTES (by Content-Length) are read before being
+        # sent upstream; larger or chunked ones are streamed to the origin as
+        # they arrive (over plain httpx, without browser impersonation).
+        self.REQUEST_MAX_BODY_BYTES = _env_int("REQUEST_MAX_BODY_BYTES", 0)
+        self.REQUEST_BUFFER_MAX_BYTES = _env_int("REQUEST_BUFFER_MAX_BYTES", 1024 * 1024)
+
+        # Circuit breaker: once CIRCUIT_FAILURE_RATE of at least
+        # CIRCUIT_MIN_REQUESTS upstream requests in the last CIRCUIT_WINDOW
+        # seconds failed (errors, timeouts, 5xx), requests fail fast (or get a
+        # cached copy, even an expired one) for CIRCUIT_OPEN_SECONDS; then
+        # CIRCUIT_HALF_OPEN_PROBES requests probe the origin. A rate of 0
+        # disables the breaker.
+        self.CIRCUIT_FAILURE_RATE = _env_float("CIRCUIT_FAILURE_RATE", 0.5)
+        self.CIRCUIT_MIN_REQUESTS = _env_int("CIRCUIT_MIN_REQUESTS", 20)
+        self.CIRCUIT_WINDOW = _env_float("CIRCUIT_WINDOW", 30.0)
+        self.CIRCUIT_OPEN_SECONDS = _env_float("CIRCUIT_OPEN_SECONDS", 15.0)
+        self.CIRCUIT_HALF_OPEN_PROBES = _env_int("CIRCUIT_HALF_OPEN_PROBES", 1)
+
+        # Memory budgets (body bytes) for the static cache, the rewritten HTML
+        # renderings (one per incoming origin) and the raw HTML documents they
+        # are rendered from; 0 disables the limit. Expired entries are swept
+        # every CACHE_SWEEP_INTERVAL seconds.
+        self.CACHE_MAX_BYTES_STATIC = _env_int("CACHE_MAX_BYTES_STATIC", 256 * 1024 * 1024)
+        self.CACHE_MAX_BYTES_HTML = _env_int("CACHE_MAX_BYTES_HTML", 64 * 1024 * 1024)
+        self.CACHE_MAX_BYTES_RAW = _env_int("CACHE_MAX_BYTES_RAW", 64 * 1024 * 1024)
+        self.CACHE_SWEEP_INTERVAL = _env_float("CACHE_SWEEP_INTERVAL", 30.0)
+
+        # Hold identical static bodies cached under several URLs (cache-busting
+        # query strings, aliases...) once, by content digest.
+        self.CACHE_DEDUPE_STATIC = _env_bool("CACHE_DEDUPE_STATIC", True)
+
+        # Content codings served for cached text bodies, most preferred first
+        # (codings whose library is not installed are skipped; empty disables
+        # compression). Bodies are stored in the first one only; the others are
+        # encoded off the event loop when a client asks for them. Bodies
+        # smaller than CACHE_COMPRESS_MIN_BYTES are stored as-is.
+        raw_encodings = os.getenv("CACHE_COMPRESSION", "br,zstd,gzip")
+        self.CACHE_COMPRESSION = [name.strip().lower() for name in raw_encodings.split(",") if name.strip()]
+        self.CACHE_COMPRESS_MIN_BYTES = _env_int("CACHE_COMPRESS_MIN_BYTES", 1024)
+
+        # Cache key composition. Query parameters are sorted by name; those
+        # matching CACHE_KEY_IGNORE_PARAMS (comma-separated globs) are left out
+        # of the key and, if CACHE_KEY_ALLOW_PARAMS is set, only matching ones
+        # are kept (the upstream request always gets the original query).
+        # CACHE_KEY_HEADERS and, with CACHE_KEY_PROFILE, the impersonation
+        # profile split entries further, as do headers named by upstream Vary.
+        self.CACHE_KEY_IGNORE_PARAMS = _env_list(
+            "CACHE_KEY_IGNORE_PARAMS", "utm_*,fbclid,gclid,dclid,msclkid,mc_cid,mc_eid,_ga,yclid"
+        )
+        self.CACHE_KEY_ALLOW_PARAMS = _env_list("CACHE_KEY_ALLOW_PARAMS", "")
+        self.CACHE_KEY_HEADERS = [name.lower() for name in _env_list("CACHE_KEY_HEADERS", "")]
+        self.CACHE_KEY_PROFILE = _env_bool("CACHE_KEY_PROFILE", False)
+
+        # Stream static/binary responses to the client as they arrive instead of
+        # buffering them. Streamed bodies are also stored in the static cache
+        # when they are no larger than STREAM_CACHE_MAX_BYTES.
+        self.STREAM_STATIC = _env_bool("STREAM_STATIC", True)
+        self.STREAM_CACHE_MAX_BYTES = _env_int("STREAM_CACHE_MAX_BYTES", 10 * 1024 * 1024)
+
+        # How text responses are rewritten: "stream" rewrites chunks as they
+        # arrive, "buffer" reads the whole body first (default: "stream").
+        self.REWRITE_MODE = os.getenv("REWRITE_MODE", "stream").lower()
+        if self.REWRITE_MODE not in ("stream", "buffer"):
+            self.REWRITE_MODE = "stream"
+
+        # Compiled rewrite plans (body and header rewriters) are kept for this
+        # many distinct incoming origins.
+        self.REWRITE_PLAN_CACHE_SIZE = _env_int("REWRITE_PLAN_CACHE_SIZE", 256)
+
+        # Concurrent cache misses for the same key wait up to this many seconds
+        # for the first one to fill the cache instead of all going upstream
+        # (0 disables coalescing).
+        self.COALESCE_TIMEOUT = _env_float("COALESCE_TIMEOUT", 10.0)
+        # URLs whose last response could not be stored (hit-for-pass) skip
+        # coalescing for this many seconds: waiting would gain nothing.
+        self.COALESCE_PASS_TTL = _env_float("COALESCE_PASS_TTL", 60.0)
+
+        # Grace windows (seconds past the TTL) during which an expired cache
+        # entry is still served: immediately while it is refreshed in the
+        # background, or when the origin fails.
+        self.CACHE_STALE_WHILE_REVALIDATE = _env_float("CACHE_STALE_WHILE_REVALIDATE", 60.0)
+        self.CACHE_STALE_IF_ERROR = _env_float("CACHE_STALE_IF_ERROR", 600.0)
+
+        # Optional on-disk tier for static assets (disabled when DISK_CACHE_DIR
+        # is empty). Entries hit DISK_CACHE_PROMOTE_HITS times are moved back
+        # into memory.
+        self.DISK_CACHE_DIR = os.getenv("DISK_CACHE_DIR", "")
+        self.DISK_CACHE_MAX_BYTES = _env_int("DISK_CACHE_MAX_BYTES", 1024 * 1024 * 1024)
+        self.DISK_CACHE_PROMOTE_HITS = _env_int("DISK_CACHE_PROMOTE_HITS", 3)
+
+        # Optional cache shared by all worker processes of a host, in an SQLite
+        # file (disabled when SHARED_CACHE_PATH is empty). Concurrent misses
+        # for a URL are coalesced across processes too.
+        self.SHARED_CACHE_PATH = os.getenv("SHARED_CACHE_PATH", "")
+        self.SHARED_CACHE_MAX_BYTES = _env_int("SHARED_CACHE_MAX_BYTES", 1024 * 1024 * 1024)
+        # Meanwhile each process keeps only this many bytes of static bodies and
+        # raw documents in memory (hot copies; 0 keeps CACHE_MAX_BYTES_*).
+        self.SHARED_CACHE_LOCAL_BYTES = _env_int("SHARED_CACHE_LOCAL_BYTES", 64 * 1024 * 1024)
+
+        # Peer mode: the nodes of a cluster (PEERS, including this one as
+        # PEER_SELF) split the cache keys between them by rendezvous hashing.
+        # A miss is requested from the owning node at PEER_PATH (authenticated
+        # with PEER_TOKEN, required), which fetches and caches it for the cluster;
+        # other nodes keep copies for at most PEER_HOT_TTL seconds.
+        self.PEERS = [peer.rstrip("/") for peer in _env_list("PEERS", "")]
+        self.PEER_SELF = os.getenv("PEER_SELF", "").rstrip("/")
+        self.PEER_PATH = os.getenv("PEER_PATH", "/__replica/peer")
+        self.PEER_TOKEN = os.getenv("PEER_TOKEN", "")
+        self.PEER_TIMEOUT = _env_float("PEER_TIMEOUT", 2.0)
+        self.PEER_HOT_TTL = _env_float("PEER_HOT_TTL", 10.0)
+
+        # Snapshot of the memory caches, written on shutdown (and every
+        # CACHE_SNAPSHOT_INTERVAL seconds when non-zero) and loaded in the
+        # background on startup; disabled when CACHE_SNAPSHOT_PATH is empty.
+        self.CACHE_SNAPSHOT_PATH = os.getenv("CACHE_SNAPSHOT_PATH", "")
+        self.CACHE_SNAPSHOT_INTERVAL = _env_float("CACHE_SNAPSHOT_INTERVAL", 0.0)
+
+        # Opt-in Prometheus metrics, served at METRICS_PATH ahead of the proxy
+        # route (choose a path the origin does not use).
+        self.METRICS_ENABLED = _env_bool("METRICS_ENABLED", False)
+        self.METRICS_PATH = os.getenv("METRICS_PATH", "/__replica/metrics")
+
+        # Cache warm-up on startup: the paths in WARMUP_URLS and the pages of
+        # the WARMUP_SITEMAP (a path on the target, e.g. "/sitemap.xml") are
+        # requested through the proxy, as if for WARMUP_ORIGIN, before the
+        # server accepts traffic (at most WARMUP_CONCURRENCY at a time, giving
+        # up after WARMUP_TIMEOUT seconds).
+        self.WARMUP_URLS = _env_list("WARMUP_URLS", "")
+        self.WARMUP_SITEMAP = os.getenv("WARMUP_SITEMAP", "")
+        self.WARMUP_ORIGIN = os.getenv("WARMUP_ORIGIN", "")
+        self.WARMUP_CONCURRENCY = _env_int("WARMUP_CONCURRENCY", 8)
+        self.WARMUP_MAX_URLS = _env_int("WARMUP_MAX_URLS", 1000)
+        self.WARMUP_TIMEOUT = _env_float("WARMUP_TIMEOUT", 120.0)
+
+        # Prefetch the same-origin stylesheets, scripts and images referenced
+        # by HTML pages into the cache in the background (at most
+        # PREFETCH_MAX_ASSETS per page, PREFETCH_CONCURRENCY at a time).
+        self.PREFETCH_ASSETS = _env_bool("PREFETCH_ASSETS", False)
+        self.PREFETCH_CONCURRENCY = _env_int("PREFETCH_CONCURRENCY", 4)
+        self.PREFETCH_MAX_ASSETS = _env_int("PREFETCH_MAX_ASSETS", 32)
+
+        # Range requests are served from cached bodies; on a miss they are
+        # forwarded upstream and, when enabled, the whole object (up to
+        # STREAM_CACHE_MAX_BYTES) is fetched into the cache in the background.
+        self.RANGE_FETCH_FULL = _env_bool("RANGE_FETCH_FULL", True)
+
     def validate(self) -> List[str]:
         errors: List[str] = []
 
@@ -118,6 +446,51 @@ class Settings:
         except Exception:
             errors.append("CACHE_TTL_HTML must be an integer")
 
+        raw_types = os.getenv("CACHE_TTL_TYPES", "")
+        if raw_types:
+            try:
+                parsed_types = json.loads(raw_types)
+                if not isinstance(parsed_types, dict) or not all(
+                    isinstance(v, int) and not isinstance(v, bool) for v in parsed_types.values()
+                ):
+                    errors.append("CACHE_TTL_TYPES must be a JSON object of media types to integer TTLs")
+            except json.JSONDecodeError:
+                errors.append("CACHE_TTL_TYPES must be valid JSON")
+
+        for name in self.CACHE_COMPRESSION:
+            if name not in ("br", "zstd", "gzip"):
+                errors.append(f"CACHE_COMPRESSION: unknown content coding {name!r}")
+
+        if not 0 <= self.CIRCUIT_FAILURE_RATE <= 1:
+            errors.append("CIRCUIT_FAILURE_RATE must be between 0 and 1")
+
+        if self.WARMUP_ORIGIN and not _is_valid_url(self.WARMUP_ORIGIN):
+            errors.append("WARMUP_ORIGIN must be a valid http(s) URL")
+
+        if self.PEERS:
+            for peer in self.PEERS:
+                if not _is_valid_url(peer):
+                    errors.append(f"PEERS: {peer!r} is not a valid http(s) URL")
+            if self.PEER_SELF not in self.PEERS:
+                errors.append("PEER_SELF must be set to this node's entry in PEERS")
+            if not self.PEER_TOKEN:
+                errors.append("PEER_TOKEN must be set when PEERS is set")
+
+        if not self.METRICS_PATH.startswith("/"):
+            errors.append("METRICS_PATH must start with '/'")
+
+        for name in _INT_SETTINGS:
+            try:
+                int(os.getenv(name, "0"))
+            except ValueError:
+                errors.append(f"{name} must be an integer")
+
+        for name in _FLOAT_SETTINGS:
+            try:
+                float(os.getenv(name, "0"))
+            except ValueError:
+                errors.append(f"{name} must be a number")
+
         return errors
 
     def print_diagnostics(self) -> None:
@@ -127,6 +500,83 @@ class Settings:
         logger.info("STATIC_EXTENSIONS=%s", ",".join(self.STATIC_EXTENSIONS))
         logger.info("CACHE_TTL_STATIC=%d", self.CACHE_TTL_STATIC)
         logger.info("CACHE_TTL_HTML=%d", self.CACHE_TTL_HTML)
+        logger.info("CACHE_TTL_TEXT=%d", self.CACHE_TTL_TEXT)
+        if self.CACHE_TTL_TYPES:
+            logger.info("CACHE_TTL_TYPES=%s", json.dumps(self.CACHE_TTL_TYPES, sort_keys=True))
+        logger.info(
+            "CACHE_MAX_BYTES_STATIC=%d CACHE_MAX_BYTES_HTML=%d CACHE_MAX_BYTES_RAW=%d",
+            self.CACHE_MAX_BYTES_STATIC,
+            self.CACHE_MAX_BYTES_HTML,
+            self.CACHE_MAX_BYTES_RAW,
+        )
+        logger.info("CACHE_DEDUPE_STATIC=%s", self.CACHE_DEDUPE_STATIC)
+        logger.info("CACHE_COMPRESSION=%s", ",".join(self.CACHE_COMPRESSION) or "off")
+        logger.info(
+            "CACHE_KEY_IGNORE_PARAMS=%s CACHE_KEY_ALLOW_PARAMS=%s CACHE_KEY_HEADERS=%s CACHE_KEY_PROFILE=%s",
+            ",".join(self.CACHE_KEY_IGNORE_PARAMS) or "-",
+            ",".join(self.CACHE_KEY_ALLOW_PARAMS) or "-",
+            ",".join(self.CACHE_KEY_HEADERS) or "-",
+            self.CACHE_KEY_PROFILE,
+        )
+        if self.DISK_CACHE_DIR:
+            logger.info("DISK_CACHE_DIR=%s DISK_CACHE_MAX_BYTES=%d", self.DISK_CACHE_DIR, self.DISK_CACHE_MAX_BYTES)
+        if self.SHARED_CACHE_PATH:
+            logger.info(
+                "SHARED_CACHE_PATH=%s SHARED_CACHE_MAX_BYTES=%d SHARED_CACHE_LOCAL_BYTES=%d",
+                self.SHARED_CACHE_PATH,
+                self.SHARED_CACHE_MAX_BYTES,
+                self.SHARED_CACHE_LOCAL_BYTES,
+            )
+        if self.PEERS:
+            logger.info(
+                "PEERS=%s PEER_SELF=%s PEER_PATH=%s PEER_TIMEOUT=%s PEER_HOT_TTL=%s",
+                ",".join(self.PEERS),
+                self.PEER_SELF,
+                self.PEER_PATH,
+                self.PEER_TIMEOUT,
+                self.PEER_HOT_TTL,
+            )
+        if self.CACHE_SNAPSHOT_PATH:
+            logger.info(
+                "CACHE_SNAPSHOT_PATH=%s CACHE_SNAPSHOT_INTERVAL=%s", self.CACHE_SNAPSHOT_PATH, self.CACHE_SNAPSHOT_INTERVAL
+            )
+        if self.METRICS_ENABLED:
+            logger.info("METRICS_PATH=%s", self.METRICS_PATH)
+        if self.WARMUP_URLS or self.WARMUP_SITEMAP:
+            logger.info(
+                "WARMUP_URLS=%d WARMUP_SITEMAP=%s WARMUP_CONCURRENCY=%d",
+                len(self.WARMUP_URLS),
+                self.WARMUP_SITEMAP or "-",
+                self.WARMUP_CONCURRENCY,
+            )
+        if self.PREFETCH_ASSETS:
+            logger.info("PREFETCH_CONCURRENCY=%d PREFETCH_MAX_ASSETS=%d", self.PREFETCH_CONCURRENCY, self.PREFETCH_MAX_ASSETS)
+        logger.info("RANGE_FETCH_FULL=%s", self.RANGE_FETCH_FULL)
+        logger.info(
+            "UPSTREAM_MAX_CONNECTIONS=%d UPSTREAM_MAX_HOST_CONNECTIONS=%d UPSTREAM_KEEPALIVE_EXPIRY=%s",
+            self.UPSTREAM_MAX_CONNECTIONS,
+            self.UPSTREAM_MAX_HOST_CONNECTIONS,
+            self.UPSTREAM_KEEPALIVE_EXPIRY,
+        )
+        logger.info(
+            "UPSTREAM_MAX_INFLIGHT=%d UPSTREAM_MAX_INFLIGHT_PER_PROFILE=%d UPSTREAM_QUEUE_SIZE=%d UPSTREAM_QUEUE_TIMEOUT=%s",
+            self.UPSTREAM_MAX_INFLIGHT,
+            self.UPSTREAM_MAX_INFLIGHT_PER_PROFILE,
+            self.UPSTREAM_QUEUE_SIZE,
+            self.UPSTREAM_QUEUE_TIMEOUT,
+        )
+        logger.info(
+            "REQUEST_MAX_BODY_BYTES=%d REQUEST_BUFFER_MAX_BYTES=%d",
+            self.REQUEST_MAX_BODY_BYTES,
+            self.REQUEST_BUFFER_MAX_BYTES,
+        )
+        logger.info(
+            "UPSTREAM_CONNECT_TIMEOUT=%s UPSTREAM_READ_TIMEOUT=%s CIRCUIT_FAILURE_RATE=%s CIRCUIT_OPEN_SECONDS=%s",
+            self.UPSTREAM_CONNECT_TIMEOUT,
+            self.UPSTREAM_READ_TIMEOUT,
+            self.CIRCUIT_FAILURE_RATE,
+            self.CIRCUIT_OPEN_SECONDS,
+        )
 
     @property
     def target_host(self) -> str:
@@ -0,0 +1,418 @@
+from __future__ import annotations
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from .cache import CachedResponse
+
+logger = logging.getLogger("replica.disk")
+
+_INDEX_VERSION = 1
+
+
+def _unlink(path: str) -> None:
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
+
+
+class DiskEntry:
+    """Index record of a cached response whose body lives in a file."""
+
+    __slots__ = (
+        "digest",
+        "path",
+        "size",
+        "headers",
+        "status",
+        "validators",
+        "expires",
+        "stale_until",
+        "hits",
+        "encoding",
+        "date",
+    )
+
+    # Disk entries keep the raw upstream headers (see ``CachedResponse.shared``)
+    shared = True
+
+    def __init__(
+        self,
+        digest: str,
+        path: str,
+        size: int,
+        headers: Dict[str, str],
+        status: int,
+        validators: Dict[str, str],
+        expires: float,
+        stale_until: float,
+        encoding: str = "",
+        date: Optional[float] = None,
+    ) -> None:
+        self.digest = digest
+        self.path = path
+        self.size = size
+        self.headers = headers
+        self.status = status
+        self.validators = validators
+        self.expires = expires
+        self.stale_until = stale_until
+        self.hits = 0
+        # Content coding of the stored file ("" for identity)
+        self.encoding = encoding
+        # When the response was generated (wall clock, see ``CachedResponse.date``)
+        self.date = expires if date is None else date
+
+    def to_dict(self) -> Dict[str, object]:
+        return {
+            "digest": self.digest,
+            "size": self.size,
+            "headers": self.headers,
+            "status": self.status,
+            "validators": self.validators,
+            "expires": self.expires,
+            "stale_until": self.stale_until,
+            "encoding": self.encoding,
+            "date": self.date,
+        }
+
+
+class DiskCache:
+    """Content-addressed on-disk cache tier with LRU eviction under a byte budget.
+
+    Bodies are stored once per SHA-256 digest under ``<directory>/objects``
+    and shared by every key with the same payload; a JSON index maps keys to
+    headers, status, validators and expiry. Expiry uses the wall clock so the
+    index stays meaningful across restarts. Hits are served from the file
+    (see ``DiskEntry.path``) instead of being read into memory. Compressed
+    responses keep only their primary coding on disk.
+
+    Inside the event loop, objects are written and unlinked and the index is
+    saved on the cache's own thread, in order (see ``run``); the index itself
+    is only ever changed on the loop.
+    """
+
+    def __init__(self, directory: str, max_bytes: int = 0) -> None:
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._objects_dir = os.path.join(directory, "objects")
+        self._index_path = os.path.join(directory, "index.json")
+        self._index: "OrderedDict[str, DiskEntry]" = OrderedDict()
+        self._refs: Dict[str, int] = {}
+        # Objects being written by ``aput``, by digest
+        self._pending: Dict[str, int] = {}
+        self._dirty = False
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._executor_pid = 0
+        os.makedirs(self._objects_dir, exist_ok=True)
+        self._load()
+
+    def _pool(self) -> ThreadPoolExecutor:
+        # Threads do not survive a fork
+        if self._executor is None or self._executor_pid != os.getpid():
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="replica-disk")
+            self._executor_pid = os.getpid()
+        return self._executor
+
+    async def run(self, method: Callable[..., Any], *args: Any) -> Any:
+        """Await ``method(*args)`` on the cache's thread, after the calls queued before it."""
+        return await asyncio.get_running_loop().run_in_executor(self._pool(), partial(method, *args))
+
+    def _blob_path(self, digest: str) -> str:
+        return os.path.join(self._objects_dir, digest[:2], digest)
+
+    def put(self, key: str, value: CachedResponse, ttl: float, grace: float = 0) -> None:
+        body = value.body
+        size = len(body)
+        if self.max_bytes and size > self.max_bytes:
+            self.delete(key)
+            return
+        digest = hashlib.sha256(body).hexdigest()
+        path = self._blob_path(digest)
+        if self._refs.get(digest, 0) == 0:
+            try:
+                self._write_blob(path, body)
+            except OSError as exc:
+                logger.warning("Failed to write disk cache object for %s: %s", key, exc)
+                return
+        self._commit(key, value, digest, path, size, ttl, grace)
+
+    async def aput(self, key: str, value: CachedResponse, ttl: float, grace: float = 0) -> None:
+        """``put`` with the hashing and the file write done in a worker thread.
+
+        The index entry is only committed once the object is in place; until
+        then the object is pending, so a concurrent ``delete`` of another key
+        with the same body does not unlink it.
+        """
+        body = value.body
+        size = len(body)
+        if self.max_bytes and size > self.max_bytes:
+            self.delete(key)
+            return
+        digest = await asyncio.to_thread(lambda: hashlib.sha256(body).hexdigest())
+        path = self._blob_path(digest)
+        self._pending[digest] = self._pending.get(digest, 0) + 1
+        try:
+            if self._refs.get(digest, 0) == 0:
+                # Queued after any unlink of the same object (see ``delete``)
+                await self.run(self._write_blob, path, body)
+        except OSError as exc:
+            logger.warning("Failed to write disk cache object for %s: %s", key, exc)
+            return
+        finally:
+            pending = self._pending.pop(digest) - 1
+            if pending:
+                self._pending[digest] = pending
+        self._commit(key, value, digest, path, size, ttl, grace)
+
+    def _commit(self, key: str, value: CachedResponse, digest: str, path: str, size: int, ttl: float, grace: float) -> None:
+        # Take the new reference before dropping the old entry so a key that is
+        # re-stored with the same body never unlinks its own blob.
+        if self._refs.get(digest, 0) == 0:
+            self.current_bytes += size
+        self._refs[digest] = self._refs.get(digest, 0) + 1
+        self.delete(key)
+
+        expires = time.time() + ttl
+        self._index[key] = DiskEntry(
+            digest,
+            path,
+            size,
+            dict(value.headers),
+            value.status,
+            dict(value.validators),
+            expires,
+            expires + max(grace, 0),
+            value.encoding,
+            value.date,
+        )
+        self._dirty = True
+        if self.max_bytes:
+            while self.current_bytes > self.max_bytes and self._index:
+                oldest = next(iter(self._index))
+                self.delete(oldest)
+                self.evictions += 1
+
+    def lookup(self, key: str, keep_expired: bool = False) -> Optional[Tuple[DiskEntry, float]]:
+        """Return ``(entry, staleness)`` for ``key``, fresh or within grace
+        (or past it, with ``keep_expired``; see ``Cache.lookup``)."""
+        entry = self._index.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        now = time.time()
+        # A missing object is noticed when it is opened (see ``astat``)
+        if now > entry.stale_until and not keep_expired:
+            self.delete(key)
+            self.expirations += 1
+            self.misses += 1
+            return None
+        self.hits += 1
+        entry.hits += 1
+        self._index.move_to_end(key)
+        return entry, max(0.0, now - entry.expires)
+
+    def get(self, key: str) -> Optional[DiskEntry]:
+        found = self.lookup(key)
+        if found is None or found[1] > 0:
+            return None
+        return found[0]
+
+    def read(self, entry: DiskEntry) -> Optional[bytes]:
+        try:
+            with open(entry.path, "rb") as fh:
+                return fh.read()
+        except OSError:
+            return None
+
+    async def aread(self, entry: DiskEntry) -> Optional[bytes]:
+        """``read`` in a worker thread."""
+        body = await asyncio.to_thread(self.read, entry)
+        if body is None:
+            self._drop_missing(entry)
+        return body
+
+    async def astat(self, entry: DiskEntry) -> Optional[os.stat_result]:
+        """Return the ``os.stat`` of the entry's object (read in a worker
+        thread), or ``None`` when it is gone."""
+        try:
+            return await asyncio.to_thread(os.stat, entry.path)
+        except OSError:
+            self._drop_missing(entry)
+            return None
+
+    def _drop_missing(self, entry: DiskEntry) -> None:
+        # The object was removed behind our back: forget every key sharing it
+        if entry.digest in self._pending:
+            return
+        for key in [key for key, other in self._index.items() if other.digest == entry.digest]:
+            self.delete(key)
+            self.expirations += 1
+
+    def touch(self, key: str, ttl: float, grace: float = 0, date: Optional[float] = None) -> bool:
+        entry = self._index.get(key)
+        if entry is None:
+            return False
+        if date is not None:
+            entry.date = date
+        entry.expires = time.time() + ttl
+        entry.stale_until = entry.expires + max(grace, 0)
+        self._index.move_to_end(key)
+        self._dirty = True
+        return True
+
+    def delete(self, key: str) -> None:
+        entry = self._index.pop(key, None)
+        if entry is None:
+            return
+        self._dirty = True
+        refs = self._refs.get(entry.digest, 0) - 1
+        if refs > 0:
+            self._refs[entry.digest] = refs
+            return
+        self._refs.pop(entry.digest, None)
+        self.current_bytes -= entry.size
+        if entry.digest in self._pending:
+            return  # being written again for another key (see ``aput``)
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            _unlink(entry.path)
+            return
+        self._pool().submit(_unlink, entry.path)
+
+    def _expire(self) -> int:
+        now = time.time()
+        expired = [key for key, entry in self._index.items() if now > entry.stale_until]
+        for key in expired:
+            self.delete(key)
+        self.expirations += len(expired)
+        return len(expired)
+
+    def sweep(self) -> int:
+        """Drop entries past their grace period and persist the index."""
+        expired = self._expire()
+        if self._dirty:
+            self.save_index()
+        return expired
+
+    async def run_sweeper(self, interval: float, paused: Optional[Callable[[], bool]] = None) -> None:
+        """Periodically sweep expired entries until cancelled (skipped while ``paused()``)."""
+        while True:
+            await asyncio.sleep(interval)
+            if paused is not None and paused():
+                continue
+            try:
+                self._expire()
+                if self._dirty:
+                    await self.asave_index()
+            except Exception as exc:  # pragma: no cover - defensive
+                logger.warning("Disk cache sweep failed: %s", exc)
+
+    def save_index(self) -> None:
+        self._write_index(self._snapshot())
+
+    async def asave_index(self) -> None:
+        """``save_index`` with the index written on the cache's thread."""
+        await self.run(self._write_index, self._snapshot())
+
+    def close(self) -> None:
+        """Finish the queued writes and unlinks."""
+        if self._executor is not None and self._executor_pid == os.getpid():
+            self._executor.shutdown(wait=True)
+        self._executor = None
+
+    def _snapshot(self) -> Dict[str, object]:
+        # Taken on the loop; the copies are serialized on the cache's thread
+        self._dirty = False
+        return {
+            "version": _INDEX_VERSION,
+            "entries": {key: entry.to_dict() for key, entry in self._index.items()},
+        }
+
+    def _write_index(self, data: Dict[str, object]) -> None:
+        fd, tmp = tempfile.mkstemp(dir=self.directory, prefix=".index-")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as fh:
+                json.dump(data, fh)
+            os.replace(tmp, self._index_path)
+        except OSError as exc:
+            logger.warning("Failed to save disk cache index: %s", exc)
+            _unlink(tmp)
+            self._dirty = True
+
+    def _write_blob(self, path: str, body: bytes) -> None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as fh:
+                fh.write(body)
+            os.replace(tmp, path)
+        except OSError:
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+            raise
+
+    def _load(self) -> None:
+        try:
+            with open(self._index_path, "r", encoding="utf-8") as fh:
+                data = json.load(fh)
+        except FileNotFoundError:
+            data = {}
+        except (OSError, ValueError) as exc:
+            logger.warning("Ignoring unreadable disk cache index: %s", exc)
+            data = {}
+
+        now = time.time()
+        if data.get("version") == _INDEX_VERSION:
+            for key, raw in data.get("entries", {}).items():
+                try:
+                    digest = raw["digest"]
+                    path = self._blob_path(digest)
+                    if now > raw["stale_until"] or not os.path.exists(path):
+                        continue
+                    self._index[key] = DiskEntry(
+                        digest,
+                        path,
+                        int(raw["size"]),
+                        raw["headers"],
+                        int(raw["status"]),
+                        raw.get("validators", {}),
+                        float(raw["expires"]),
+                        float(raw["stale_until"]),
+                        raw.get("encoding", ""),
+                        raw.get("date"),
+                    )
+                except (KeyError, TypeError, ValueError):
+                    continue
+                if digest not in self._refs:
+                    self.current_bytes += self._index[key].size
+                self._refs[digest] = self._refs.get(digest, 0) + 1
+
+        # Remove objects no longer referenced by the index (e.g. after a crash)
+        for root, _dirs, files in os.walk(self._objects_dir):
+            for name in files:
+                if name not in self._refs:
+                    _unlink(os.path.join(root, name))
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def __contains__(self, key: object) -> bool:
+        return key in self._index
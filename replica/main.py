@@ -1,14 +1,53 @@
+import asyncio
 import logging
 import sys
+import time
 from contextlib import asynccontextmanager
-from fastapi import FastAPI, Request
-from .proxy import proxy_request
+from fastapi import FastAPI, Request, Response
+from .metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, REGISTRY, MetricsMiddleware
+from .proxy import peer_request, proxy_request, resources
 from .config import settings
+from .snapshot import load_snapshot, run_snapshots, save_snapshot
+from .warmup import warm_up
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format="[%(levelname)s] %(message)s")
 logger = logging.getLogger("replica.main")
 
+
+async def _restore_snapshot(caches, vary, loaded: asyncio.Event) -> None:
+    """Load the cache snapshot (setting ``loaded`` once done), then write one
+    every CACHE_SNAPSHOT_INTERVAL seconds if set."""
+    path = settings.CACHE_SNAPSHOT_PATH
+    started = time.monotonic()
+    try:
+        restored = await load_snapshot(path, caches, vary)
+    except FileNotFoundError:
+        logger.info("No cache snapshot at %s", path)
+    except Exception as exc:
+        logger.warning("Ignoring unreadable cache snapshot %s: %s", path, exc)
+    else:
+        logger.info("Cache snapshot: %d entries restored in %.1fs", restored, time.monotonic() - started)
+    loaded.set()
+    if settings.CACHE_SNAPSHOT_INTERVAL > 0:
+        await run_snapshots(path, settings.CACHE_SNAPSHOT_INTERVAL, caches, vary)
+
+
+async def _write_snapshot(caches, vary, loaded: asyncio.Event) -> None:
+    # Overwriting a snapshot that was not fully loaded yet would lose the
+    # entries not restored
+    if not loaded.is_set():
+        logger.warning("Cache snapshot not written: the previous one was still loading")
+        return
+    started = time.monotonic()
+    try:
+        written = await save_snapshot(settings.CACHE_SNAPSHOT_PATH, caches, vary)
+    except Exception as exc:
+        logger.warning("Cache snapshot to %s failed: %s", settings.CACHE_SNAPSHOT_PATH, exc)
+        return
+    logger.info("Cache snapshot: %d records written in %.1fs", written, time.monotonic() - started)
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup validation
@@ -20,7 +59,60 @@ async def lifespan(app: FastAPI):
         sys.exit(2)
 
     settings.print_diagnostics()
-    yield
+    proxy = resources()
+
+    # Open one long-lived upstream client per impersonation profile
+    proxy.client_pool.start()
+
+    # Background sweepers drop expired entries that are never read again,
+    # except while the origin is down and expired copies are all we can serve
+    caches = [proxy.static_cache, proxy.raw_cache, proxy.html_cache]
+    if proxy.disk_cache is not None:
+        caches.append(proxy.disk_cache)
+    if proxy.shared_cache is not None:
+        caches.append(proxy.shared_cache)
+    sweepers = [
+        asyncio.create_task(cache.run_sweeper(settings.CACHE_SWEEP_INTERVAL, paused=lambda: proxy.breaker.is_open))
+        for cache in caches
+    ]
+
+    # Restore the previous process' caches in the background; requests are
+    # served (and cached) meanwhile
+    snapshot_caches = {"static": proxy.static_cache, "raw": proxy.raw_cache, "html": proxy.html_cache}
+    snapshot_loaded = asyncio.Event()
+    snapshot_tasks = []
+    if settings.CACHE_SNAPSHOT_PATH:
+        snapshot_tasks.append(asyncio.create_task(_restore_snapshot(snapshot_caches, proxy.vary, snapshot_loaded)))
+
+    # Fill the caches before accepting traffic
+    if settings.WARMUP_URLS or settings.WARMUP_SITEMAP:
+        started = time.monotonic()
+        try:
+            warmed, failed = await asyncio.wait_for(warm_up(app), settings.WARMUP_TIMEOUT)
+            logger.info("Cache warm-up: %d URLs warmed, %d failed in %.1fs", warmed, failed, time.monotonic() - started)
+        except asyncio.TimeoutError:
+            logger.warning("Cache warm-up did not finish within %ss; starting anyway", settings.WARMUP_TIMEOUT)
+        except Exception as exc:
+            logger.warning("Cache warm-up failed: %s", exc)
+
+    try:
+        yield
+    finally:
+        pending = sweepers + snapshot_tasks + list(proxy.background_tasks)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        if settings.CACHE_SNAPSHOT_PATH:
+            await _write_snapshot(snapshot_caches, proxy.vary, snapshot_loaded)
+        await proxy.client_pool.aclose()
+        await proxy.upload_pool.aclose()
+        if proxy.peers is not None:
+            await proxy.peers.aclose()
+        if proxy.disk_cache is not None:
+            await proxy.disk_cache.asave_index()
+            proxy.disk_cache.close()
+        if proxy.shared_cache is not None:
+            proxy.shared_cache.close()
 
 app = FastAPI(
     title="Replica - Reverse Proxy",
@@ -30,6 +122,27 @@ app = FastAPI(
     lifespan=lifespan
 )
 
+app.add_middleware(MetricsMiddleware, enabled=lambda: settings.METRICS_ENABLED)
+
+
+# Registered before the catch-all route so it takes precedence; while metrics
+# are disabled the path is proxied like any other.
+@app.get(settings.METRICS_PATH, include_in_schema=False)
+async def metrics(request: Request):
+    if not settings.METRICS_ENABLED:
+        return await proxy_request(request, request.url.path.lstrip("/"))
+    return Response(content=REGISTRY.render(), media_type=METRICS_CONTENT_TYPE)
+
+
+# Internal endpoint other nodes of the cluster fetch owned cache entries from
+# (see PEERS); while peer mode is off the path is proxied like any other.
+@app.post(settings.PEER_PATH, include_in_schema=False)
+async def peer(request: Request):
+    if not settings.PEERS:
+        return await proxy_request(request, request.url.path.lstrip("/"))
+    return await peer_request(request)
+
+
 @app.api_route("/{path:path}", methods=["GET", "POST", "PUT", "DELETE", "PATCH", "HEAD", "OPTIONS"])
 async def handle(request: Request, path: str):
     return await proxy_request(request, path)
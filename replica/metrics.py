@@ -0,0 +1,229 @@
+from __future__ import annotations
+import os
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple
+
+# Prometheus text exposition (format 0.0.4) without external dependencies.
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+REWRITE_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25)
+SIZE_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _CounterValue:
+    __slots__ = ("value",)
+
+    def __init__(self) -> None:
+        self.value = 0
+
+    def inc(self, amount: float = 1) -> None:
+        self.value += amount
+
+
+class _HistogramValue:
+    __slots__ = ("_bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds: Tuple[float, ...]) -> None:
+        self._bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self._bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+        if not self.labelnames:
+            self._default = self._new_child()
+            self._children[()] = self._default
+
+    def _new_child(self):  # pragma: no cover - overridden
+        raise NotImplementedError
+
+    def labels(self, *values: str):
+        """Return the child for ``values``; bind it once and keep it on hot paths."""
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}")
+            child = self._children[values] = self._new_child()
+        return child
+
+    def collect(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for values, child in sorted(self._children.items()):
+            lines.extend(self._sample_lines(values, child))
+        return lines
+
+    def _sample_lines(self, values: Tuple[str, ...], child) -> List[str]:  # pragma: no cover - overridden
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self) -> _CounterValue:
+        return _CounterValue()
+
+    def inc(self, amount: float = 1) -> None:
+        self._default.inc(amount)
+
+    def _sample_lines(self, values: Tuple[str, ...], child: _CounterValue) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labelnames, values)} {_format_value(child.value)}"]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, buckets: Sequence[float], labelnames: Sequence[str] = ()) -> None:
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self) -> _HistogramValue:
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value: float) -> None:
+        self._default.observe(value)
+
+    def _sample_lines(self, values: Tuple[str, ...], child: _HistogramValue) -> List[str]:
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), child.counts):
+            cumulative += count
+            le = f'le="{_format_value(float(bound))}"'
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, values, le)} {cumulative}")
+        labels = _format_labels(self.labelnames, values)
+        lines.append(f"{self.name}_sum{labels} {_format_value(child.sum)}")
+        lines.append(f"{self.name}_count{labels} {child.count}")
+        return lines
+
+
+# A collector returns ``(name, kind, documentation, samples)`` families where
+# samples are ``(labels, value)`` pairs; it runs at scrape time only.
+Collector = Callable[[], Iterable[Tuple[str, str, str, Iterable[Tuple[Dict[str, str], float]]]]]
+
+
+class Registry:
+    def __init__(self) -> None:
+        self._metrics: List[_Metric] = []
+        self._collectors: Dict[str, Collector] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, name: str, collector: Collector) -> None:
+        """Register ``collector`` under ``name`` (replacing any previous one)."""
+        self._collectors[name] = collector
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.collect())
+        for collector in self._collectors.values():
+            for name, kind, documentation, samples in collector():
+                lines.append(f"# HELP {name} {documentation}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    lines.append(f"{name}{_format_labels(list(labels), list(labels.values()))} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+# Request methods counted under their own label; any other (clients may send
+# arbitrary tokens) is counted as "other" so the label values stay bounded
+_METHODS = frozenset(("GET", "HEAD", "POST", "PUT", "DELETE", "PATCH", "OPTIONS", "CONNECT", "TRACE"))
+
+REQUESTS = REGISTRY.register(
+    Counter("replica_requests_total", "Requests handled, by method, status and cache result.", ("method", "status", "cache"))
+)
+RESPONSE_SIZE = REGISTRY.register(
+    Histogram("replica_response_size_bytes", "Response body bytes sent to clients.", SIZE_BUCKETS)
+)
+UPSTREAM_CONNECT = REGISTRY.register(
+    Histogram("replica_upstream_connect_seconds", "Time to connect to the origin (0 on a reused connection).", LATENCY_BUCKETS)
+)
+UPSTREAM_TTFB = REGISTRY.register(
+    Histogram("replica_upstream_ttfb_seconds", "Time until the origin's response headers arrived.", LATENCY_BUCKETS)
+)
+UPSTREAM_TOTAL = REGISTRY.register(
+    Histogram("replica_upstream_total_seconds", "Time until the origin's response body was fully read.", LATENCY_BUCKETS)
+)
+REWRITE_DURATION = REGISTRY.register(
+    Histogram("replica_rewrite_seconds", "Time spent rewriting a text body.", REWRITE_BUCKETS)
+)
+INJECT_DURATION = REGISTRY.register(
+    Histogram("replica_inject_seconds", "Time spent injecting the JS snippet into an HTML body.", REWRITE_BUCKETS)
+)
+
+
+class MetricsMiddleware:
+    """ASGI middleware counting requests and response bytes.
+
+    ``enabled`` is consulted per request, so the middleware costs one call
+    while metrics are off.
+    """
+
+    def __init__(self, app, enabled: Callable[[], bool]) -> None:
+        self.app = app
+        self.enabled = enabled
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http" or not self.enabled():
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"] if scope["method"] in _METHODS else "other"
+        state = {"status": 0, "cache": "", "size": 0}
+
+        async def send_wrapper(message) -> None:
+            if message["type"] == "http.response.start":
+                state["status"] = message["status"]
+                for name, value in message.get("headers", ()):
+                    if name == b"x-cache":
+                        state["cache"] = value.decode("latin-1")
+                        break
+            elif message["type"] == "http.response.body":
+                state["size"] += len(message.get("body", b""))
+                if not message.get("more_body", False):
+                    REQUESTS.labels(method, str(state["status"]), state["cache"] or "NONE").inc()
+                    RESPONSE_SIZE.observe(state["size"])
+            elif message["type"] == "http.response.pathsend":
+                # File sent by the server itself (see FileResponse)
+                REQUESTS.labels(method, str(state["status"]), state["cache"] or "NONE").inc()
+                try:
+                    RESPONSE_SIZE.observe(os.path.getsize(message["path"]))
+                except OSError:
+                    pass
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
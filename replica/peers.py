@@ -0,0 +1,87 @@
+from __future__ import annotations
+import hashlib
+import time
+from collections import OrderedDict
+from typing import Optional, Sequence
+
+import httpx
+
+# Request header carrying PEER_TOKEN on internal peer requests
+TOKEN_HEADER = "x-replica-peer-token"
+
+
+def _score(peer: str, key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(f"{peer}\n{key}".encode("utf-8"), digest_size=8).digest(), "big")
+
+
+def rendezvous_owner(key: str, peers: Sequence[str]) -> str:
+    """Return the peer owning ``key`` (highest random weight hashing).
+
+    Adding or removing a peer only moves the keys that peer owns (or gets).
+    """
+    return max(peers, key=lambda peer: _score(peer, key))
+
+
+class PeerGroup:
+    """The other Replica nodes of a cluster and the keep-alive client to them.
+
+    Every cache key has one owner among ``peers`` (which includes ``self_url``);
+    ``owner`` returns it, or ``None`` when this node owns the key. Keys an
+    owner reported as not cacheable are remembered for ``pass_ttl`` seconds
+    (at most ``max_passes`` of them) so they go straight to the origin.
+    """
+
+    def __init__(
+        self,
+        peers: Sequence[str],
+        self_url: str,
+        timeout: float = 2.0,
+        pass_ttl: float = 60.0,
+        max_passes: int = 10000,
+    ) -> None:
+        self.peers = tuple(dict.fromkeys(peer.rstrip("/") for peer in peers))
+        self.self_url = self_url.rstrip("/")
+        self.timeout = timeout
+        self.pass_ttl = pass_ttl
+        self.max_passes = max_passes
+        self._passes: "OrderedDict[str, float]" = OrderedDict()
+        self._client: Optional[httpx.AsyncClient] = None
+        self.hits = 0
+        self.passes = 0
+        self.errors = 0
+
+    def owner(self, key: str) -> Optional[str]:
+        if len(self.peers) < 2:
+            return None
+        owner = rendezvous_owner(key, self.peers)
+        return None if owner == self.self_url else owner
+
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(timeout=self.timeout)
+            # Peer requests carry the client's headers (sent on to the origin);
+            # httpx must not fill in its own where the client sent none
+            for name in ("accept", "accept-encoding", "user-agent"):
+                del self._client.headers[name]
+        return self._client
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def mark_pass(self, key: str) -> None:
+        """Remember that ``key`` is not cacheable (fetch it from the origin)."""
+        self._passes[key] = time.monotonic() + self.pass_ttl
+        self._passes.move_to_end(key)
+        while len(self._passes) > self.max_passes:
+            self._passes.popitem(last=False)
+
+    def is_pass(self, key: str) -> bool:
+        until = self._passes.get(key)
+        if until is None:
+            return False
+        if time.monotonic() > until:
+            del self._passes[key]
+            return False
+        return True
@@ -0,0 +1,100 @@
+from __future__ import annotations
+from functools import lru_cache
+from typing import Dict, Mapping, Optional, Tuple
+from urllib.parse import urlparse
+
+from .config import settings
+from .rewrite import Rewriter
+from .utils import HeaderRewriter, filter_cookies, request_header_rewriter, response_header_rewriter
+
+
+class RewritePlan:
+    """Everything needed to rewrite traffic for one incoming origin, compiled once.
+
+    Holds the body rewriter (user replacements plus the mandatory target ->
+    incoming origin/host mappings) and the request/response header rewriters.
+    Plans are memoized per incoming origin by ``get_plan``, so per-request work
+    is only applying them.
+    """
+
+    __slots__ = ("rewriter", "request_rewriter", "response_rewriter", "target_host")
+
+    def __init__(
+        self,
+        target_origin: str,
+        replacements: Mapping[str, str],
+        incoming_origin: str,
+        incoming_host: str,
+        req_port: Optional[str],
+        my_origin_for_headers: str,
+    ) -> None:
+        target_host = urlparse(target_origin).netloc
+        self.target_host = target_host
+
+        # Ensure target origin/host -> incoming origin/host replacement is always applied and overrides
+        # any user-specified replacement for the target. We filter out user-supplied replacements that
+        # reference the configured target to avoid them overriding the mandatory mapping, then append
+        # the mandatory mappings so they are applied last.
+        filtered_replacements: Dict[str, str] = {}
+        for from_str, to_str in replacements.items():
+            # If the user tries to target the configured target host/origin, ignore it so we enforce
+            # replacement unconditionally.
+            if target_host.lower() in from_str.lower() or target_origin.lower() in from_str.lower():
+                continue
+            filtered_replacements[from_str] = to_str
+
+        # Add mandatory mappings: replace full origin first, then fallback to host-only for cases
+        # where the content references just the hostname without scheme.
+        filtered_replacements[target_origin.rstrip("/")] = incoming_origin.rstrip("/")
+        filtered_replacements[target_host] = f"{incoming_host}:{req_port}" if req_port else incoming_host
+
+        self.rewriter = Rewriter(filtered_replacements, incoming_host)
+        self.request_rewriter: HeaderRewriter = request_header_rewriter(my_origin_for_headers, incoming_host, target_origin)
+        self.response_rewriter: HeaderRewriter = response_header_rewriter(
+            target_origin, target_host, my_origin_for_headers, incoming_host
+        )
+
+    def request_headers(self, headers: Mapping[str, str]) -> Dict[str, str]:
+        """Return the headers to send upstream for an incoming request."""
+        request_headers = dict(headers)
+        request_headers["host"] = self.target_host
+        request_headers.pop("accept-encoding", None)
+
+        # Filter out Cloudflare-specific cookies that should not be forwarded
+        if "cookie" in request_headers:
+            cookie = filter_cookies(request_headers["cookie"])
+            if cookie:
+                request_headers["cookie"] = cookie
+            else:
+                request_headers.pop("cookie", None)
+
+        return self.request_rewriter.apply(request_headers)
+
+    def response_headers(self, headers: Mapping[str, str]) -> Dict[str, str]:
+        """Return upstream response headers sanitized for the incoming origin."""
+        return self.response_rewriter.apply(headers)
+
+
+@lru_cache(maxsize=settings.REWRITE_PLAN_CACHE_SIZE)
+def _compile(
+    target_origin: str,
+    replacements: Tuple[Tuple[str, str], ...],
+    incoming_origin: str,
+    incoming_host: str,
+    req_port: Optional[str],
+    my_origin_for_headers: str,
+) -> RewritePlan:
+    return RewritePlan(target_origin, dict(replacements), incoming_origin, incoming_host, req_port, my_origin_for_headers)
+
+
+def get_plan(incoming_origin: str, incoming_host: str, req_port: Optional[str], my_origin_for_headers: str) -> RewritePlan:
+    """Return the (memoized) rewrite plan for an incoming origin."""
+    replacements = getattr(settings, "REPLACEMENTS", {}) or {}
+    return _compile(
+        settings.TARGET_ORIGIN,
+        tuple(replacements.items()),
+        incoming_origin,
+        incoming_host,
+        req_port,
+        my_origin_for_headers,
+    )
@@ -0,0 +1,114 @@
+from __future__ import annotations
+import time
+from email.utils import parsedate_to_datetime
+from typing import Dict, Mapping, Optional
+
+from .compression import is_compressible
+from .config import settings
+
+
+class Freshness:
+    """When a response was generated and until when it is fresh (wall clock).
+
+    ``date`` is backdated by the upstream ``Age`` so the age of a response
+    keeps counting from when the origin produced it.
+    """
+
+    __slots__ = ("date", "expires")
+
+    def __init__(self, lifetime: float, age: float = 0.0, now: Optional[float] = None) -> None:
+        now = time.time() if now is None else now
+        self.date = now - age
+        self.expires = self.date + lifetime
+
+    @property
+    def ttl(self) -> float:
+        """Seconds the response is still fresh for (negative once stale)."""
+        return self.expires - time.time()
+
+
+def parse_cache_control(value: Optional[str]) -> Dict[str, str]:
+    """Return the directives of a ``Cache-Control`` header (lower-cased names)."""
+    directives: Dict[str, str] = {}
+    if not value:
+        return directives
+    for item in value.split(","):
+        name, _, arg = item.partition("=")
+        name = name.strip().lower()
+        if name:
+            directives[name] = arg.strip().strip('"')
+    return directives
+
+
+def _seconds(value: Optional[str]) -> Optional[int]:
+    if value is None:
+        return None
+    try:
+        return max(int(value), 0)
+    except ValueError:
+        return None
+
+
+def _http_date(value: Optional[str]) -> Optional[float]:
+    if not value:
+        return None
+    try:
+        return parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError, IndexError, OverflowError):
+        return None
+
+
+def default_ttl(content_type: str, static: bool) -> int:
+    """TTL for responses without upstream freshness information.
+
+    CACHE_TTL_TYPES entries (exact media types or ``type/*``) win over the
+    HTML, other text and static/binary defaults.
+    """
+    media_type = content_type.split(";", 1)[0].strip().lower()
+    types = settings.CACHE_TTL_TYPES
+    if media_type in types:
+        return types[media_type]
+    wildcard = media_type.split("/", 1)[0] + "/*"
+    if wildcard in types:
+        return types[wildcard]
+    if "html" in media_type:
+        return settings.CACHE_TTL_HTML
+    if not static and is_compressible(media_type):
+        return settings.CACHE_TTL_TEXT
+    return settings.CACHE_TTL_STATIC
+
+
+def freshness(headers: Mapping[str, str], default: float, authorized: bool = False) -> Optional[Freshness]:
+    """Decide whether a response may be stored and for how long.
+
+    Returns ``None`` for responses that must not be cached: ``no-store``,
+    ``private`` and ``no-cache`` ones, those already expired by their
+    ``max-age``/``s-maxage``/``Expires``, responses to requests with
+    credentials unless explicitly shareable, and those whose ``default``
+    TTL is 0. ``s-maxage`` wins over ``max-age``, which wins over
+    ``Expires``; without any of them ``default`` applies.
+    """
+    directives = parse_cache_control(headers.get("cache-control"))
+    if "no-store" in directives or "private" in directives or "no-cache" in directives:
+        return None
+    if authorized and not ("public" in directives or "s-maxage" in directives or "must-revalidate" in directives):
+        return None
+
+    age = float(_seconds(headers.get("age")) or 0)
+    lifetime = _seconds(directives.get("s-maxage"))
+    if lifetime is None:
+        lifetime = _seconds(directives.get("max-age"))
+    if lifetime is None and "expires" in headers:
+        expires = _http_date(headers["expires"])
+        if expires is None:
+            # Invalid dates (e.g. "0") mean already expired
+            return None
+        date = _http_date(headers.get("date"))
+        lifetime = max(expires - (date if date is not None else time.time()), 0)
+    if lifetime is None:
+        if default == 0:
+            return None
+        return Freshness(default, age)
+    if lifetime <= age:
+        return None
+    return Freshness(lifetime, age)
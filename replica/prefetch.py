@@ -0,0 +1,44 @@
+from __future__ import annotations
+import re
+from typing import List
+from urllib.parse import urldefrag, urljoin, urlparse
+
+# Tags whose subresources are worth prefetching, and the attribute naming them
+_TAG_RE = re.compile(r"<(link|script|img)\b([^>]*)>", re.IGNORECASE)
+_ATTR_RE = re.compile(r"""([a-zA-Z:-]+)\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s"'>]+))""")
+_URL_ATTR = {"link": "href", "script": "src", "img": "src"}
+# <link rel=...> values that name a subresource (not e.g. canonical/alternate pages)
+_ASSET_RELS = frozenset(("stylesheet", "preload", "modulepreload", "icon", "shortcut", "apple-touch-icon"))
+
+
+def _attributes(attrs: str) -> dict:
+    return {
+        match.group(1).lower(): next(value for value in match.group(2, 3, 4) if value is not None)
+        for match in _ATTR_RE.finditer(attrs)
+    }
+
+
+def extract_assets(html: str, base_url: str, limit: int = 0) -> List[str]:
+    """Return the same-origin ``<link>``, ``<script src>`` and ``<img src>``
+    URLs referenced by ``html`` (resolved against ``base_url``, in document
+    order, without duplicates; at most ``limit`` when non-zero)."""
+    origin = urlparse(base_url)
+    assets: List[str] = []
+    seen = {base_url}
+    for match in _TAG_RE.finditer(html):
+        tag = match.group(1).lower()
+        attrs = _attributes(match.group(2))
+        ref = attrs.get(_URL_ATTR[tag], "").strip()
+        if not ref or ref.startswith(("data:", "javascript:", "#")):
+            continue
+        if tag == "link" and not _ASSET_RELS.intersection(attrs.get("rel", "").lower().split()):
+            continue
+        url = urldefrag(urljoin(base_url, ref))[0]
+        parsed = urlparse(url)
+        if parsed.scheme not in ("http", "https") or parsed.netloc != origin.netloc or url in seen:
+            continue
+        seen.add(url)
+        assets.append(url)
+        if limit and len(assets) >= limit:
+            break
+    return assets
@@ -1,31 +1,1258 @@
 from __future__ import annotations
-from typing import Optional
-from urllib.parse import urljoin
-import re
+import asyncio
+import hmac
+import json
+import logging
+import math
+import mimetypes
+import struct
+import time
+from functools import partial
+from collections import deque
+from typing import AsyncIterator, Callable, Deque, Dict, List, Mapping, Optional, Set, Tuple, Union
+from urllib.parse import urljoin, urlparse
 
 from fastapi import Request, Response
+from fastapi.responses import FileResponse, StreamingResponse
+from starlette.types import Receive, Scope, Send
 import httpx
-from httpx_curl_cffi import AsyncCurlTransport, CurlOpt
+from curl_cffi import AsyncCurl, CurlMOpt
+from httpx_curl_cffi import AsyncCurlTransport, CurlInfo, CurlOpt
+
+
+class _PooledCurlTransport(AsyncCurlTransport):
+    """AsyncCurlTransport that optionally owns a curl multi handle so a
+    per-host connection limit can be applied to the pooled client."""
+
+    def __init__(self, *, max_host_connections: int = 0, **kwargs) -> None:
+        async_curl = None
+        if max_host_connections > 0:
+            async_curl = AsyncCurl()
+            async_curl.setopt(CurlMOpt.MAX_HOST_CONNECTIONS, max_host_connections)
+        super().__init__(async_curl=async_curl, **kwargs)
+        self._owned_async_curl = async_curl
+
+    async def aclose(self) -> None:
+        await super().aclose()
+        if self._owned_async_curl is not None:
+            await self._owned_async_curl.close()
 
 
 def _create_async_client(impersonate: str) -> httpx.AsyncClient:
-    # Use curl options recommended for parallel requests
-    curl_options = {CurlOpt.FRESH_CONNECT: True}
-    transport = AsyncCurlTransport(impersonate=impersonate, default_headers=True, curl_options=curl_options)
-    return httpx.AsyncClient(transport=transport, follow_redirects=True, timeout=30.0)
+    # Long-lived client: connections are kept alive and reused across requests,
+    # idle connections older than UPSTREAM_KEEPALIVE_EXPIRY are not reused.
+    curl_options = {CurlOpt.MAXAGE_CONN: int(settings.UPSTREAM_KEEPALIVE_EXPIRY)}
+    transport = _PooledCurlTransport(
+        impersonate=impersonate,
+        default_headers=True,
+        curl_options=curl_options,
+        max_connections=settings.UPSTREAM_MAX_CONNECTIONS,
+        max_host_connections=settings.UPSTREAM_MAX_HOST_CONNECTIONS,
+        curl_infos=[CurlInfo.CONNECT_TIME],
+    )
+    timeout = httpx.Timeout(
+        settings.UPSTREAM_TIMEOUT, connect=settings.UPSTREAM_CONNECT_TIMEOUT, read=settings.UPSTREAM_READ_TIMEOUT
+    )
+    return httpx.AsyncClient(transport=transport, follow_redirects=True, timeout=timeout)
+
+
+def _create_upload_client(impersonate: str) -> httpx.AsyncClient:
+    # Requests with streamed bodies: the curl transport reads the whole body
+    # before sending, httpx's own sends each chunk as it is received. There is
+    # no browser impersonation, and redirects are passed on to the client,
+    # which still has the body to send again.
+    limits = httpx.Limits(
+        max_connections=settings.UPSTREAM_MAX_CONNECTIONS or None,
+        keepalive_expiry=settings.UPSTREAM_KEEPALIVE_EXPIRY,
+    )
+    timeout = httpx.Timeout(
+        settings.UPSTREAM_TIMEOUT, connect=settings.UPSTREAM_CONNECT_TIMEOUT, read=settings.UPSTREAM_READ_TIMEOUT
+    )
+    return httpx.AsyncClient(limits=limits, timeout=timeout)
 
 from .config import settings
-from .cache import Cache
-from .utils import (
-    is_static_file,
-    perform_text_replacements,
-    sanitize_request_headers,
-    sanitize_response_headers,
+from .cache import BodyStore, Cache, CachedResponse, SingleFlight
+from .cachekey import CacheKeyBuilder, VaryIndex, get_key_builder, parse_vary
+from .compression import encode_for_cache, negotiate, usable_encodings
+from . import metrics
+from .disk import DiskCache, DiskEntry
+from .peers import TOKEN_HEADER, PeerGroup
+from .shared import SharedCache
+from .plan import get_plan
+from .prefetch import extract_assets
+from .policy import Freshness, default_ttl, freshness
+from .ranges import RangeNotSatisfiable, content_range, if_range_matches, parse_range, total_size
+from .rewrite import Rewriter, ScriptInjector, StreamRewriter, inject_script
+from .upstream import CircuitBreaker, ClientPool, Overloaded, UpstreamLimiter, release_on_close
+from .utils import compute_etag, filter_cookies, is_not_modified, is_static_file
+
+logger = logging.getLogger("replica.proxy")
+
+# Request headers carrying client validators
+_CONDITIONAL_HEADERS = ("if-none-match", "if-modified-since")
+# Request headers asking for part of a representation
+_RANGE_HEADERS = ("range", "if-range")
+# Upstream response headers kept for conditional revalidation
+_VALIDATOR_HEADERS = ("etag", "last-modified")
+# Headers sent along with a 304 Not Modified
+_NOT_MODIFIED_HEADERS = ("etag", "last-modified", "cache-control", "expires", "vary", "date", "age", "x-cache")
+
+# module-level caches. Static/binary bodies and raw (not yet rewritten) text
+# documents are keyed by target URL and shared by every incoming origin;
+# rewritten renderings of a document are keyed by incoming URL. Static bodies
+# are deduplicated by content (see CACHE_DEDUPE_STATIC).
+def _local_budget(max_bytes: int) -> int:
+    # With the shared cache on, every worker holds only its hot entries in
+    # memory (SHARED_CACHE_LOCAL_BYTES): the full copy lives in the shared file
+    local = settings.SHARED_CACHE_LOCAL_BYTES if settings.SHARED_CACHE_PATH else 0
+    if not local:
+        return max_bytes
+    return min(max_bytes, local) if max_bytes else local
+
+
+_static_cache = Cache(
+    max_bytes=_local_budget(settings.CACHE_MAX_BYTES_STATIC),
+    bodies=BodyStore() if settings.CACHE_DEDUPE_STATIC else None,
 )
+_raw_cache = Cache(max_bytes=_local_budget(settings.CACHE_MAX_BYTES_RAW))
+_html_cache = Cache(max_bytes=settings.CACHE_MAX_BYTES_HTML)
+
+# Optional on-disk second tier for static assets: entries evicted from the
+# static memory cache are demoted to it and hot entries are promoted back.
+_disk_cache: Optional[DiskCache] = None
+if settings.DISK_CACHE_DIR:
+    _disk_cache = DiskCache(settings.DISK_CACHE_DIR, max_bytes=settings.DISK_CACHE_MAX_BYTES)
+
+
+def _demote_to_disk(key: str, value, ttl: float, grace: float) -> None:
+    if _disk_cache is None or not isinstance(value, CachedResponse) or ttl + grace <= 0:
+        return
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:  # outside the event loop nothing else is waiting
+        _disk_cache.put(key, value, ttl, grace)
+        return
+    # The object is written in a worker thread, off the event loop
+    task = loop.create_task(_disk_cache.aput(key, value, ttl, grace))
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+
+_static_cache.on_evict = _demote_to_disk
+
+# Optional cache shared by the worker processes of a host (uvicorn --workers):
+# static bodies and raw documents are written through to it, and entries
+# missing from this process' memory are looked up there before going upstream.
+_shared_cache: Optional[SharedCache] = None
+if settings.SHARED_CACHE_PATH:
+    _shared_cache = SharedCache(settings.SHARED_CACHE_PATH, max_bytes=settings.SHARED_CACHE_MAX_BYTES)
+
+# Other nodes of the cluster (see PEERS): every cache key is owned by one node,
+# which the others ask before going to the origin
+_peers: Optional[PeerGroup] = None
+if settings.PEERS:
+    _peers = PeerGroup(settings.PEERS, settings.PEER_SELF, settings.PEER_TIMEOUT)
+
+# Request headers each cached URL varies on (from upstream Vary), by base key
+_vary = VaryIndex()
+
+# In-flight upstream fetches, used to coalesce concurrent misses per target URL
+_flights = SingleFlight()
+# In-flight background refreshes of stale entries, one per target URL
+_refreshes = SingleFlight()
+# Strong references to background tasks so they are not garbage collected
+_background_tasks: set = set()
+# Keys of disk entries being promoted back into memory
+_promotions: Set[str] = set()
+
+# Assets waiting to be prefetched (see PREFETCH_ASSETS), their raw keys and
+# the number of prefetches in progress
+_prefetch_queue: Deque["_ProxyContext"] = deque()
+_prefetch_pending: Set[str] = set()
+_prefetch_active = 0
+
+# Bound on in-flight upstream requests (cache hits never wait for it)
+_limiter = UpstreamLimiter(
+    settings.UPSTREAM_MAX_INFLIGHT,
+    settings.UPSTREAM_MAX_INFLIGHT_PER_PROFILE,
+    settings.UPSTREAM_QUEUE_SIZE,
+    settings.UPSTREAM_QUEUE_TIMEOUT,
+)
+
+# Fails upstream requests fast while the origin keeps erroring or timing out
+_breaker = CircuitBreaker(
+    settings.CIRCUIT_FAILURE_RATE,
+    settings.CIRCUIT_MIN_REQUESTS,
+    settings.CIRCUIT_WINDOW,
+    settings.CIRCUIT_OPEN_SECONDS,
+    settings.CIRCUIT_HALF_OPEN_PROBES,
+)
+
+# Pooled upstream clients, one per impersonation profile. The factory is looked
+# up at call time so it can be swapped (e.g. in tests).
+_client_pool = ClientPool(lambda impersonate: _create_async_client(impersonate))
+# Clients for requests whose bodies are streamed (see _request_body)
+_upload_pool = ClientPool(lambda impersonate: _create_upload_client(impersonate))
+
+
+class Resources:
+    """The long-lived objects of the proxy the application starts, sweeps,
+    snapshots and closes (see ``resources``)."""
+
+    __slots__ = (
+        "static_cache",
+        "raw_cache",
+        "html_cache",
+        "disk_cache",
+        "shared_cache",
+        "vary",
+        "breaker",
+        "client_pool",
+        "upload_pool",
+        "peers",
+        "background_tasks",
+    )
+
+    def __init__(self) -> None:
+        self.static_cache = _static_cache
+        self.raw_cache = _raw_cache
+        self.html_cache = _html_cache
+        self.disk_cache = _disk_cache
+        self.shared_cache = _shared_cache
+        self.vary = _vary
+        self.breaker = _breaker
+        self.client_pool = _client_pool
+        self.upload_pool = _upload_pool
+        self.peers = _peers
+        self.background_tasks = _background_tasks
+
+
+def resources() -> Resources:
+    """Return the proxy's current long-lived objects (read at call time, so
+    replaced ones, e.g. in tests, are picked up)."""
+    return Resources()
+
+
+def _collect_cache_metrics():
+    """Cache and coalescing statistics, read at scrape time."""
+    caches = {"static": _static_cache, "raw": _raw_cache, "html": _html_cache}
+    if _disk_cache is not None:
+        caches["disk"] = _disk_cache
+    if _shared_cache is not None:
+        caches["shared"] = _shared_cache
+    labels = {name: {"cache": name} for name in caches}
+
+    def samples(value: Callable[[object], float]):
+        return [(labels[name], value(cache)) for name, cache in caches.items()]
+
+    yield "replica_cache_entries", "gauge", "Entries held per cache.", samples(len)
+    yield "replica_cache_bytes", "gauge", "Body bytes held per cache.", samples(lambda c: c.current_bytes)
+    yield "replica_cache_hits_total", "counter", "Cache lookups that found an entry.", samples(lambda c: c.hits)
+    yield "replica_cache_misses_total", "counter", "Cache lookups that found nothing.", samples(lambda c: c.misses)
+    yield "replica_cache_hit_ratio", "gauge", "Hits over lookups per cache.", samples(
+        lambda c: c.hits / (c.hits + c.misses) if c.hits + c.misses else 0.0
+    )
+    yield "replica_cache_evictions_total", "counter", "Entries evicted by the byte budget.", samples(lambda c: c.evictions)
+    yield "replica_cache_expirations_total", "counter", "Entries dropped past their grace period.", samples(
+        lambda c: c.expirations
+    )
+    if _static_cache.bodies is not None:
+        yield "replica_cache_dedup_saved_bytes", "gauge", "Body bytes not held twice thanks to deduplication.", [
+            ({"cache": "static"}, _static_cache.bodies.saved_bytes)
+        ]
+    yield "replica_coalesced_requests_total", "counter", "Cache misses that waited for a concurrent fetch.", [
+        ({}, _flights.coalesced)
+    ]
+
+
+metrics.REGISTRY.add_collector("cache", _collect_cache_metrics)
+
+
+def _collect_upstream_metrics():
+    """Upstream limiter state, read at scrape time."""
+    limiter = _limiter
+    yield "replica_upstream_inflight", "gauge", "Upstream requests in flight, by impersonation profile.", [
+        ({"profile": profile}, count) for profile, count in sorted(limiter.active_by_profile.items())
+    ]
+    yield "replica_upstream_queue_depth", "gauge", "Requests waiting for an upstream slot.", [({}, limiter.queue_depth)]
+    yield "replica_upstream_queued_total", "counter", "Requests that had to wait for an upstream slot.", [
+        ({}, limiter.queued)
+    ]
+    yield "replica_upstream_shed_total", "counter", "Requests answered 503 instead of going upstream.", [
+        ({"reason": "queue_full"}, limiter.shed_queue_full),
+        ({"reason": "timeout"}, limiter.shed_timeout),
+        ({"reason": "circuit_open"}, _breaker.rejected),
+    ]
+    yield "replica_upstream_circuit_open", "gauge", "1 while the circuit breaker is open or half-open.", [
+        ({}, int(_breaker.is_open))
+    ]
+    yield "replica_upstream_circuit_opened_total", "counter", "Times the circuit breaker opened.", [({}, _breaker.opened)]
+
+
+metrics.REGISTRY.add_collector("upstream", _collect_upstream_metrics)
+
+
+def _collect_peer_metrics():
+    """Requests to the owning peers of cache keys, read at scrape time."""
+    if _peers is None:
+        return
+    yield "replica_peer_requests_total", "counter", "Cache misses sent to the peer owning the key, by outcome.", [
+        ({"result": "hit"}, _peers.hits),
+        ({"result": "pass"}, _peers.passes),
+        ({"result": "error"}, _peers.errors),
+    ]
+
+
+metrics.REGISTRY.add_collector("peers", _collect_peer_metrics)
+
+
+class _BodyBuffer:
+    """Copy of a streamed body that is dropped once it grows past
+    STREAM_CACHE_MAX_BYTES."""
+
+    __slots__ = ("_parts", "_size")
+
+    def __init__(self) -> None:
+        self._parts: Optional[List[bytes]] = []
+        self._size = 0
+
+    def add(self, chunk: bytes) -> None:
+        if self._parts is None:
+            return
+        self._size += len(chunk)
+        if self._size > settings.STREAM_CACHE_MAX_BYTES:
+            self._parts = None
+        else:
+            self._parts.append(chunk)
+
+    def getvalue(self) -> Optional[bytes]:
+        return None if self._parts is None else b"".join(self._parts)
+
+
+async def _tee_stream(
+    chunks: AsyncIterator[bytes],
+    upstream: httpx.Response,
+    store: Optional[Callable[[bytes], None]],
+) -> AsyncIterator[bytes]:
+    """Forward ``chunks`` to the client while optionally buffering a copy.
+
+    When ``store`` is given, the forwarded bytes are collected and handed to it
+    once the stream completes, unless they grow past STREAM_CACHE_MAX_BYTES
+    (the copy is then dropped and the response is only streamed). The upstream
+    response is closed as soon as the stream ends.
+    """
+    buffered = _BodyBuffer() if store is not None else None
+    try:
+        async for chunk in chunks:
+            if buffered is not None:
+                buffered.add(chunk)
+            yield chunk
+        if buffered is not None and store is not None:
+            data = buffered.getvalue()
+            if data is not None:
+                store(data)
+    finally:
+        await _close_upstream(upstream)
+
+
+class _UpstreamStreamingResponse(StreamingResponse):
+    """Streaming response relaying an upstream body.
+
+    Once the response is over, the upstream response (and with it the
+    limiter slot) is closed and ``on_done`` is called. This also happens when
+    the client goes away before the body iterator is started.
+    """
+
+    def __init__(
+        self,
+        content: AsyncIterator[bytes],
+        upstream: httpx.Response,
+        on_done: Optional[Callable[[], None]] = None,
+        **kwargs,
+    ) -> None:
+        super().__init__(content, **kwargs)
+        self._upstream = upstream
+        self._on_done = on_done
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            await self.finish()
+
+    async def finish(self) -> None:
+        """Close the upstream response and call ``on_done`` (only the first time)."""
+        on_done, self._on_done = self._on_done, None
+        try:
+            await _close_upstream(self._upstream)
+        finally:
+            if on_done is not None:
+                on_done()
+
+
+async def _rewrite_stream(
+    upstream: httpx.Response,
+    rewriter: Rewriter,
+    injector: Optional[ScriptInjector],
+    raw: Optional[_BodyBuffer] = None,
+) -> AsyncIterator[bytes]:
+    """Decode, rewrite and re-encode an upstream text body chunk by chunk.
+
+    The decoded (not yet rewritten) text is also copied into ``raw`` if given.
+    """
+    stream = StreamRewriter(rewriter)
+    clock = time.perf_counter
+    rewrite_time = inject_time = 0.0
+    async for text in upstream.aiter_text():
+        if raw is not None:
+            raw.add(text.encode("utf-8"))
+        started = clock()
+        out = stream.feed(text)
+        rewritten = clock()
+        rewrite_time += rewritten - started
+        if injector is not None:
+            out = injector.feed(out)
+            inject_time += clock() - rewritten
+        if out:
+            yield out.encode("utf-8")
+    started = clock()
+    out = stream.flush()
+    rewritten = clock()
+    if injector is not None:
+        out = injector.feed(out) + injector.flush()
+        metrics.INJECT_DURATION.observe(inject_time + clock() - rewritten)
+    metrics.REWRITE_DURATION.observe(rewrite_time + rewritten - started)
+    if out:
+        yield out.encode("utf-8")
+
+
+async def _close_upstream(upstream: httpx.Response) -> None:
+    if upstream.is_closed:
+        return
+    await upstream.aclose()
+    # httpx sets ``elapsed`` to the full exchange time once the stream is closed
+    metrics.UPSTREAM_TOTAL.observe(upstream.elapsed.total_seconds())
+
+
+def _observe_upstream_headers(upstream: httpx.Response, started: float) -> None:
+    metrics.UPSTREAM_TTFB.observe(time.perf_counter() - started)
+    infos = upstream.extensions.get("curl", {}).get("infos")
+    if infos and CurlInfo.CONNECT_TIME in infos:
+        metrics.UPSTREAM_CONNECT.observe(infos[CurlInfo.CONNECT_TIME])
+
+
+def _cache_grace() -> float:
+    # Keep entries past their TTL for as long as they may still be served stale
+    return max(settings.CACHE_STALE_WHILE_REVALIDATE, settings.CACHE_STALE_IF_ERROR)
+
+
+def _store_response(
+    cache: Cache,
+    key: str,
+    headers: dict,
+    status: int,
+    fresh: Freshness,
+    validators: Dict[str, str],
+    data: bytes,
+    shared: bool = False,
+) -> None:
+    headers = dict(headers)
+    headers.pop("x-cache", None)
+    if "etag" not in headers:
+        # Rewritten bodies get a validator computed over what clients receive
+        headers["etag"] = compute_etag(data)
+    value = _cache_value(data, headers, status, validators, shared, fresh.date, fresh.expires)
+    cache.put(key, value, fresh.ttl, _cache_grace())
+    if cache is _static_cache:
+        _share("static", key, value, fresh)
+
+
+def _share(tier: str, key: str, value: CachedResponse, fresh: Freshness) -> None:
+    """Write an entry of the ``tier`` cache through to the shared cache."""
+    if _shared_cache is not None:
+        _shared_cache.submit(_shared_cache.put, f"{tier}:{key}", value, fresh.ttl, _cache_grace())
+
+
+async def _lookup_shared(tier: str, cache: Cache, key: str, keep_expired: bool = False):
+    """Return ``(value, staleness)`` from the shared cache, keeping a copy in
+    this process' ``cache`` (small while the shared cache is on), or ``None``."""
+    if _shared_cache is None:
+        return None
+    found = await _shared_cache.run(_shared_cache.lookup, f"{tier}:{key}", keep_expired)
+    if found is None:
+        return None
+    value, staleness, ttl, grace = found
+    cache.put(key, value, ttl, grace)
+    return value, staleness
+
+
+def _cache_value(
+    data: bytes,
+    headers: Dict[str, str],
+    status: int,
+    validators: Dict[str, str],
+    shared: bool = False,
+    date: Optional[float] = None,
+    expires: Optional[float] = None,
+) -> CachedResponse:
+    """Build a cache entry, compressed (see CACHE_COMPRESSION) when worthwhile."""
+    body, encoding, variants = encode_for_cache(
+        data, headers.get("content-type", ""), settings.CACHE_COMPRESSION, settings.CACHE_COMPRESS_MIN_BYTES
+    )
+    return CachedResponse(body, headers, status, validators, shared, encoding, variants, date, expires)
+
+
+def _encoded_etag(etag: str, encoding: str) -> str:
+    # Each content coding is a distinct representation with its own validator
+    if etag.endswith('"'):
+        return f'{etag[:-1]}-{encoding}"'
+    return etag
+
+
+def _upstream_validators(upstream: httpx.Response) -> Dict[str, str]:
+    return {name: upstream.headers[name] for name in _VALIDATOR_HEADERS if name in upstream.headers}
+
+
+def _fits_stream_cache(upstream: httpx.Response) -> bool:
+    """Cheap pre-check on the upstream Content-Length before teeing a stream."""
+    length = upstream.headers.get("content-length", "")
+    if not length.isdigit() or upstream.headers.get("content-encoding"):
+        return True
+    return int(length) <= settings.STREAM_CACHE_MAX_BYTES
+
+
+class _ProxyContext:
+    """Request-scoped values needed to fetch and rewrite an upstream response.
+
+    ``cache_key`` identifies the incoming URL (per-origin renderings) and
+    ``raw_key`` the target URL (entries shared by every incoming origin); both
+    are ``render_key``/``base_key`` (method and normalized URL) plus the
+    variant suffix of the request (see ``_set_cache_keys``).
+    """
+
+    __slots__ = (
+        "method",
+        "target_path",
+        "target_url",
+        "base_key",
+        "render_key",
+        "cache_key",
+        "raw_key",
+        "key_headers",
+        "vary",
+        "incoming_origin",
+        "incoming_host",
+        "req_port",
+        "my_origin_for_headers",
+        "plan",
+        "request_headers",
+        "conditionals",
+        "accept_encoding",
+        "impersonate",
+        "range",
+        "if_range",
+    )
+
+    def __init__(self, **values) -> None:
+        for name in self.__slots__:
+            setattr(self, name, values.get(name))
+
+    def replace(self, **values) -> "_ProxyContext":
+        """Return a copy of the context with ``values`` changed."""
+        current = {name: getattr(self, name) for name in self.__slots__}
+        current.update(values)
+        return _ProxyContext(**current)
+
+
+def _key_builder() -> CacheKeyBuilder:
+    return get_key_builder(
+        tuple(settings.CACHE_KEY_IGNORE_PARAMS),
+        tuple(settings.CACHE_KEY_ALLOW_PARAMS),
+        tuple(settings.CACHE_KEY_HEADERS),
+        settings.CACHE_KEY_PROFILE,
+    )
+
+
+def _base_keys(keys: CacheKeyBuilder, method: str, target_base: str, incoming_base: str, query: str) -> Tuple[str, str]:
+    """Return the ``(base_key, render_key)`` of a request before its variant suffix."""
+    query = keys.normalize_query(query)
+    suffix = f"?{query}" if query else ""
+    return f"{method}:{target_base}{suffix}", f"{method}:{incoming_base}{suffix}"
+
+
+def _set_cache_keys(ctx: _ProxyContext, keys: Optional[CacheKeyBuilder] = None) -> None:
+    suffix = (keys or _key_builder()).variant(ctx.key_headers, ctx.impersonate, ctx.vary)
+    ctx.raw_key = ctx.base_key + suffix
+    ctx.cache_key = ctx.render_key + suffix
+
+
+def _apply_vary(ctx: _ProxyContext, upstream: httpx.Response) -> bool:
+    """Track the upstream ``Vary`` of a response; return False if it must not be cached."""
+    vary = parse_vary(upstream.headers.get("vary"))
+    if vary is None:
+        return False
+    if vary != ctx.vary:
+        # The variant this response is stored under depends on the headers it varies on
+        _vary.set(ctx.base_key, vary)
+        ctx.vary = vary
+        _set_cache_keys(ctx)
+    return True
+
+
+def _is_text(content_type: str) -> bool:
+    return any(t in content_type.lower() for t in ("text", "json", "javascript", "xml", "html"))
+
+
+def _may_be_rewritten(path: str) -> bool:
+    """Whether the response for ``path`` is probably a text document (rewritten),
+    judging by its extension: media such as video keeps its Range requests."""
+    if is_static_file(path, settings.STATIC_EXTENSIONS):
+        return False
+    guessed, _ = mimetypes.guess_type(urlparse(path).path)
+    return guessed is None or _is_text(guessed)
+
+
+def _default_ttl(ctx: _ProxyContext, content_type: str) -> int:
+    static = is_static_file(ctx.target_path, settings.STATIC_EXTENSIONS) or not _is_text(content_type)
+    return default_ttl(content_type, static)
+
+
+def _response_freshness(ctx: _ProxyContext, headers: Mapping[str, str], content_type: str) -> Optional[Freshness]:
+    """Apply the caching policy (see ``policy.freshness``) to upstream ``headers``."""
+    return freshness(headers, _default_ttl(ctx, content_type), "authorization" in ctx.key_headers)
+
+
+def _filter_set_cookie(resp_headers: Dict[str, str]) -> None:
+    # Filter out Cloudflare cookies from set-cookie header
+    if "set-cookie" in resp_headers:
+        cookies = filter_cookies(resp_headers["set-cookie"], set_cookie=True)
+        if cookies:
+            resp_headers["set-cookie"] = cookies
+        else:
+            resp_headers.pop("set-cookie", None)
+
+
+def _freshness_headers(resp_headers: Dict[str, str], date: float, expires: float) -> None:
+    """Advertise how long a cached response stays fresh.
+
+    ``max-age`` is the freshness lifetime and ``Age`` how much of it is used
+    up, so downstream caches keep the response exactly for our remaining TTL.
+    """
+    resp_headers["cache-control"] = f"public, max-age={max(0, round(expires - date))}"
+    resp_headers["age"] = str(max(0, int(time.time() - date)))
+    resp_headers.pop("pragma", None)
+    resp_headers.pop("expires", None)
+
+
+def _prepare_cacheable_headers(resp_headers: Dict[str, str], date: float, expires: float) -> None:
+    """Set the caching headers of a cacheable response and drop Cloudflare cookies."""
+    _freshness_headers(resp_headers, date, expires)
+    _filter_set_cookie(resp_headers)
+
+
+def _whole_object(ctx: _ProxyContext, drop: Tuple[str, ...] = _RANGE_HEADERS) -> _ProxyContext:
+    """Return a copy of ``ctx`` asking for the complete representation."""
+    request_headers = ctx.request_headers
+    if request_headers is not None:
+        request_headers = {k: v for k, v in request_headers.items() if k not in drop}
+    return ctx.replace(range=None, if_range=None, request_headers=request_headers)
+
+
+def _ranged_response(body: bytes, status: int, headers: Dict[str, str], ctx: _ProxyContext) -> Optional[Response]:
+    """Answer a Range request from a cached body (``None`` to send all of it).
+
+    Single byte ranges are served as 206 slices of the cached buffer without
+    copying it; several ranges, a stale ``If-Range`` or anything but a 200
+    get the whole body.
+    """
+    if not ctx.range or status != 200:
+        return None
+    if ctx.if_range and not if_range_matches(ctx.if_range, headers.get("etag"), headers.get("last-modified")):
+        return None
+    try:
+        span = parse_range(ctx.range, len(body))
+    except RangeNotSatisfiable:
+        headers["content-range"] = f"bytes */{len(body)}"
+        return Response(status_code=416, headers=headers)
+    if span is None:
+        return None
+    start, end = span
+    headers["content-range"] = content_range(start, end, len(body))
+    return Response(content=memoryview(body)[start:end], status_code=206, headers=headers)
+
+
+def _rewrite_text(rewriter: Rewriter, text: str, js_snippet: str) -> str:
+    """Rewrite a complete document and inject ``js_snippet`` (if any)."""
+    started = time.perf_counter()
+    text = rewriter.rewrite(text)
+    rewritten = time.perf_counter()
+    metrics.REWRITE_DURATION.observe(rewritten - started)
+    if js_snippet:
+        text = inject_script(text, js_snippet, getattr(settings, "INJECT_JS_LOCATION", "body").lower())
+        metrics.INJECT_DURATION.observe(time.perf_counter() - rewritten)
+    return text
+
+
+def _js_snippet() -> str:
+    # Optional inline JS injected into HTML <head> or <body> (see INJECT_JS_LOCATION)
+    if getattr(settings, "INJECT_JS", ""):
+        return f"<script>{settings.INJECT_JS}</script>"
+    return ""
+
+
+def _render_document(raw: CachedResponse, ctx: _ProxyContext) -> CachedResponse:
+    """Rewrite a raw cached document for ``ctx``'s incoming origin."""
+    headers = ctx.plan.response_headers(raw.headers)
+    _prepare_cacheable_headers(headers, raw.date, raw.expires)
+    js_snippet = _js_snippet() if "html" in headers.get("content-type", "").lower() else ""
+    text = _rewrite_text(ctx.plan.rewriter, raw.encoded(None).decode("utf-8"), js_snippet)
+    body = text.encode("utf-8")
+    headers["etag"] = compute_etag(body)
+    return _cache_value(body, headers, raw.status, raw.validators, date=raw.date, expires=raw.expires)
+
+
+def _store_document(
+    ctx: _ProxyContext,
+    raw_headers: Dict[str, str],
+    resp_headers: Dict[str, str],
+    status: int,
+    validators: Dict[str, str],
+    fresh: Freshness,
+    raw: Optional[bytes],
+    data: bytes,
+) -> None:
+    """Cache a rewritten document together with the raw copy it came from."""
+    if raw is not None:
+        value = _cache_value(raw, raw_headers, status, validators, True, fresh.date, fresh.expires)
+        _raw_cache.put(ctx.raw_key, value, fresh.ttl, _cache_grace())
+        _share("raw", ctx.raw_key, value, fresh)
+        if settings.PREFETCH_ASSETS and "html" in raw_headers.get("content-type", "").lower():
+            _prefetch_assets(ctx, raw)
+    _store_response(_html_cache, ctx.cache_key, resp_headers, status, fresh, validators, data)
+
 
-# module-level caches
-_static_cache = Cache()
-_html_cache = Cache()
+def _store_streamed_document(
+    ctx: _ProxyContext,
+    raw_headers: Dict[str, str],
+    resp_headers: Dict[str, str],
+    status: int,
+    validators: Dict[str, str],
+    fresh: Freshness,
+    raw: _BodyBuffer,
+    data: bytes,
+) -> None:
+    _store_document(ctx, raw_headers, resp_headers, status, validators, fresh, raw.getvalue(), data)
+
+
+async def _lookup_cache(ctx: _ProxyContext):
+    """Return ``(value, staleness)`` for ``ctx`` from the caches, or ``None``.
+
+    A document without a rendering for the incoming origin (or with one older
+    than the raw copy) is rendered from the raw document cached for the target
+    URL, so a new hostname costs a rewrite pass instead of an upstream fetch.
+    While the circuit breaker is open, entries past their grace period are
+    returned as well.
+    """
+    keep = _breaker.is_open
+    if is_static_file(ctx.target_path, settings.STATIC_EXTENSIONS):
+        return await _lookup_static(ctx.raw_key, keep)
+
+    found = _html_cache.lookup(ctx.cache_key, keep)
+    if found is None or found[1]:
+        raw = _raw_cache.lookup(ctx.raw_key, keep) or await _lookup_shared("raw", _raw_cache, ctx.raw_key, keep)
+        if raw is not None and (found is None or raw[1] < found[1]):
+            found = _render_from_raw(ctx, raw[0]), raw[1]
+    if found is None:
+        # Binary responses without a static extension live in the static cache too
+        found = await _lookup_static(ctx.raw_key, keep)
+    return found
+
+
+async def _lookup_static(key: str, keep_expired: bool = False):
+    return (
+        _static_cache.lookup(key, keep_expired)
+        or await _lookup_shared("static", _static_cache, key, keep_expired)
+        or _lookup_disk(key, keep_expired)
+    )
+
+
+def _render_from_raw(ctx: _ProxyContext, raw: CachedResponse) -> CachedResponse:
+    rendered = _render_document(raw, ctx)
+    expiry = _raw_cache.expiry(ctx.raw_key)
+    if expiry is not None:
+        # The rendering expires together with the raw copy
+        _html_cache.put(ctx.cache_key, rendered, *expiry)
+    return rendered
+
+
+def _lookup_disk(key: str, keep_expired: bool = False):
+    if _disk_cache is None:
+        return None
+    found = _disk_cache.lookup(key, keep_expired)
+    if found is None:
+        return None
+    entry = found[0]
+    if (
+        entry.hits >= settings.DISK_CACHE_PROMOTE_HITS
+        and entry.size <= settings.STREAM_CACHE_MAX_BYTES
+        and key not in _promotions
+    ):
+        # Hot entry: promote it back into the memory tier. The file is read in
+        # a worker thread; this request is served from it meanwhile.
+        _promotions.add(key)
+        task = asyncio.create_task(_promote(key, entry))
+        _background_tasks.add(task)
+        task.add_done_callback(_background_tasks.discard)
+    return found
+
+
+async def _promote(key: str, entry: DiskEntry) -> None:
+    try:
+        body = await _disk_cache.aread(entry)
+    finally:
+        _promotions.discard(key)
+    if body is None or key not in _disk_cache or key in _static_cache:
+        return
+    value = CachedResponse(
+        body, entry.headers, entry.status, entry.validators, True, entry.encoding, date=entry.date, expires=entry.expires
+    )
+    now = time.time()
+    _static_cache.put(key, value, entry.expires - now, entry.stale_until - entry.expires)
+
+
+async def _cached_response(cached: Union[CachedResponse, DiskEntry], x_cache: str, ctx: _ProxyContext) -> Response:
+    if cached.shared:
+        headers = ctx.plan.response_headers(cached.headers)
+        _prepare_cacheable_headers(headers, cached.date, cached.expires)
+    else:
+        headers = dict(cached.headers)
+        _freshness_headers(headers, cached.date, cached.expires)
+    headers["accept-ranges"] = "bytes"
+    headers["x-cache"] = x_cache
+
+    # Compressed entries are served as stored to clients accepting the coding.
+    # Other configured codings are produced on demand, and clients accepting
+    # none of them get a decompressed copy.
+    encoding = None
+    if cached.encoding:
+        offered = [cached.encoding]
+        if isinstance(cached, CachedResponse):
+            offered.extend(cached.variants)
+        offered.extend(name for name in usable_encodings(settings.CACHE_COMPRESSION) if name not in offered)
+        encoding = negotiate(ctx.accept_encoding, offered)
+        vary = headers.get("vary")
+        headers["vary"] = f"{vary}, Accept-Encoding" if vary else "Accept-Encoding"
+        if encoding:
+            headers["content-encoding"] = encoding
+            if "etag" in headers:
+                headers["etag"] = _encoded_etag(headers["etag"], encoding)
+
+    if ctx.conditionals and cached.status == 200 and is_not_modified(ctx.conditionals, headers):
+        headers = {name: value for name, value in headers.items() if name in _NOT_MODIFIED_HEADERS}
+        return Response(status_code=304, headers=headers)
+    if isinstance(cached, DiskEntry):
+        if encoding == (cached.encoding or None):
+            # Served straight from the file (sendfile/pathsend where the server
+            # supports it); FileResponse answers Range/If-Range requests itself
+            stat = await _disk_cache.astat(cached) if _disk_cache is not None else None
+            if stat is None:
+                return Response(content="Cached object is no longer available", status_code=502)
+            return FileResponse(cached.path, status_code=cached.status, headers=headers, stat_result=stat)
+        body = await _disk_cache.aread(cached) if _disk_cache is not None else None
+        if body is None:
+            return Response(content="Cached object is no longer available", status_code=502)
+        cached = CachedResponse(body, headers, cached.status, encoding=cached.encoding)
+    if encoding == (cached.encoding or None) or encoding in cached.variants:
+        body = cached.encoded(encoding)
+    else:
+        # (De)compression can take a while on large bodies; keep it off the loop
+        body = await asyncio.to_thread(cached.encoded, encoding)
+    ranged = _ranged_response(body, cached.status, headers, ctx)
+    if ranged is not None:
+        return ranged
+    return Response(content=body, status_code=cached.status, headers=headers)
+
+
+def _touch_cached(ctx: _ProxyContext, fresh: Freshness) -> None:
+    """Restart the TTL of cached entries after the origin confirmed them (304)."""
+    grace = _cache_grace()
+    ttl = fresh.ttl
+    for cache, key in ((_html_cache, ctx.cache_key), (_raw_cache, ctx.raw_key), (_static_cache, ctx.raw_key)):
+        if cache.touch(key, ttl, grace):
+            value = cache.peek(key)
+            if isinstance(value, CachedResponse):
+                value.date, value.expires = fresh.date, fresh.expires
+    if ctx.raw_key not in _static_cache and _disk_cache is not None:
+        _disk_cache.touch(ctx.raw_key, ttl, grace, fresh.date)
+    if _shared_cache is not None:
+        for tier in ("static", "raw"):
+            _shared_cache.submit(_shared_cache.touch, f"{tier}:{ctx.raw_key}", ttl, grace, fresh.date)
+
+
+def _drop_cached(ctx: _ProxyContext) -> None:
+    """Forget cached copies the origin no longer allows to be stored."""
+    _html_cache.delete(ctx.cache_key)
+    _raw_cache.delete(ctx.raw_key)
+    _static_cache.delete(ctx.raw_key)
+    if _disk_cache is not None:
+        _disk_cache.delete(ctx.raw_key)
+    if _shared_cache is not None:
+        for tier in ("static", "raw"):
+            _shared_cache.submit(_shared_cache.delete, f"{tier}:{ctx.raw_key}")
+
+
+async def _drain(response: Response) -> None:
+    """Consume a response body so streaming responses fill the cache."""
+    if isinstance(response, StreamingResponse):
+        try:
+            async for _ in response.body_iterator:
+                pass
+        finally:
+            if isinstance(response, _UpstreamStreamingResponse):
+                await response.finish()
+
+
+def _revalidate_in_background(ctx: _ProxyContext, stale: Union[CachedResponse, DiskEntry]) -> None:
+    """Refresh a stale cache entry without blocking the current request."""
+    leader, flight = _refreshes.join(ctx.raw_key, settings.UPSTREAM_TIMEOUT)
+    if not leader:
+        return
+    task = asyncio.create_task(_refresh(ctx, stale, partial(_refreshes.release, ctx.raw_key, flight)))
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+
+async def _refresh(
+    ctx: _ProxyContext, stale: Optional[Union[CachedResponse, DiskEntry]], on_done: Callable[[], None]
+) -> None:
+    try:
+        response = await _fetch_and_respond(ctx, None, on_done, stale)
+    except Exception as exc:
+        on_done()
+        logger.warning("Background fetch of %s failed: %s", ctx.target_url, exc)
+        return
+    if not isinstance(response, StreamingResponse):
+        on_done()
+    try:
+        await _drain(response)
+    except Exception as exc:
+        logger.warning("Background fetch of %s failed: %s", ctx.target_url, exc)
+
+
+def _asset_context(page: _ProxyContext, url: str) -> _ProxyContext:
+    """Return a context for fetching ``url`` (on the target) on behalf of ``page``."""
+    target_base, _, query = url.partition("?")
+    target_path = urlparse(target_base).path or "/"
+    keys = _key_builder()
+    base_key, render_key = _base_keys(keys, "GET", target_base, page.incoming_origin + target_path, query)
+    drop = _CONDITIONAL_HEADERS + _RANGE_HEADERS
+    request_headers = {k: v for k, v in page.request_headers.items() if k not in drop}
+    request_headers["accept"] = "*/*"
+    ctx = _ProxyContext(
+        method="GET",
+        target_path=target_path,
+        target_url=url,
+        base_key=base_key,
+        render_key=render_key,
+        key_headers=page.key_headers,
+        vary=_vary.get(base_key),
+        impersonate=page.impersonate,
+        incoming_origin=page.incoming_origin,
+        incoming_host=page.incoming_host,
+        req_port=page.req_port,
+        my_origin_for_headers=page.my_origin_for_headers,
+        plan=page.plan,
+        request_headers=request_headers,
+        conditionals={},
+        accept_encoding="",
+    )
+    _set_cache_keys(ctx, keys)
+    return ctx
+
+
+def _queue_prefetch(ctx: _ProxyContext) -> None:
+    """Queue a background fetch of ``ctx`` unless it is cached or queued already."""
+    key = ctx.raw_key
+    if key in _prefetch_pending or key in _static_cache or key in _raw_cache or (
+        _disk_cache is not None and key in _disk_cache
+    ):
+        return
+    _prefetch_pending.add(key)
+    _prefetch_queue.append(ctx)
+
+
+def _prefetch_assets(page: _ProxyContext, raw: bytes) -> None:
+    """Queue the same-origin assets referenced by a page for prefetching."""
+    if page.request_headers is None:
+        return
+    for url in extract_assets(raw.decode("utf-8", errors="replace"), page.target_url, settings.PREFETCH_MAX_ASSETS):
+        _queue_prefetch(_asset_context(page, url))
+    _start_prefetches()
+
+
+def _fetch_whole_in_background(ctx: _ProxyContext, upstream: httpx.Response) -> None:
+    """Fetch the complete object behind a ranged miss so later ranges are cut
+    from the cache (only objects up to STREAM_CACHE_MAX_BYTES)."""
+    size = total_size(upstream.headers.get("content-range"))
+    if size is None or size > settings.STREAM_CACHE_MAX_BYTES:
+        return
+    _queue_prefetch(_whole_object(ctx, _RANGE_HEADERS + _CONDITIONAL_HEADERS))
+    _start_prefetches()
+
+
+def _start_prefetches() -> None:
+    global _prefetch_active
+    while _prefetch_queue and _prefetch_active < settings.PREFETCH_CONCURRENCY:
+        ctx = _prefetch_queue.popleft()
+        _prefetch_active += 1
+        task = asyncio.create_task(_prefetch(ctx))
+        _background_tasks.add(task)
+        task.add_done_callback(_prefetch_done)
+
+
+def _prefetch_done(task: "asyncio.Task") -> None:
+    global _prefetch_active
+    _background_tasks.discard(task)
+    _prefetch_active -= 1
+    if not task.cancelled():
+        _start_prefetches()
+
+
+async def _prefetch(ctx: _ProxyContext) -> None:
+    try:
+        # Skip assets fetched meanwhile, by a client or a concurrent miss
+        if ctx.raw_key in _static_cache or ctx.raw_key in _raw_cache:
+            return
+        leader, flight = _flights.join(ctx.raw_key, settings.UPSTREAM_TIMEOUT)
+        if not leader:
+            return
+        await _refresh(ctx, None, partial(_flights.release, ctx.raw_key, flight))
+    finally:
+        _prefetch_pending.discard(ctx.raw_key)
+
+
+async def _lookup_entry(ctx: _ProxyContext) -> Optional[Tuple[str, CachedResponse, float]]:
+    """Return ``(tier, value, staleness)`` of the entry for ``ctx`` that every
+    incoming origin shares (a raw document or a static body), or ``None``."""
+    keep = _breaker.is_open
+    if not is_static_file(ctx.target_path, settings.STATIC_EXTENSIONS):
+        found = _raw_cache.lookup(ctx.raw_key, keep) or await _lookup_shared("raw", _raw_cache, ctx.raw_key, keep)
+        if found is not None:
+            return "raw", found[0], found[1]
+    found = await _lookup_static(ctx.raw_key, keep)
+    if found is None:
+        return None
+    value, staleness = found
+    if isinstance(value, DiskEntry):
+        body = await _disk_cache.aread(value) if _disk_cache is not None else None
+        if body is None:
+            return None
+        value = CachedResponse(
+            body, value.headers, value.status, value.validators, True, value.encoding, date=value.date, expires=value.expires
+        )
+    return "static", value, staleness
+
+
+# Request headers that are not forwarded to the owning peer (the transport
+# sets its own, and the owner fetches whole, unconditional objects)
+_PEER_SKIP_HEADERS = ("host", "content-length", "content-type", "transfer-encoding", "connection", TOKEN_HEADER)
+_PEER_SKIP_HEADERS += _CONDITIONAL_HEADERS + _RANGE_HEADERS
+
+
+def _peer_headers(headers: Mapping[str, str]) -> Dict[str, str]:
+    return {name.lower(): value for name, value in headers.items() if name.lower() not in _PEER_SKIP_HEADERS}
+
+
+def _peer_context(payload: Dict[str, object], headers: Mapping[str, str]) -> _ProxyContext:
+    """Return the context of a peer request for an entry this node owns.
+
+    Only the URL and the impersonation profile are taken from ``payload``;
+    the cache keys are derived here from the URL and the request ``headers``
+    (the asking node's upstream headers), exactly as for a client request.
+    Renderings are made for this node's own origin (PEER_SELF).
+    """
+    url = str(payload["url"])
+    target_base, _, query = url.partition("?")
+    target_path = urlparse(target_base).path or "/"
+    if target_base != urljoin(settings.TARGET_ORIGIN, target_path):
+        raise ValueError(f"{url} is not on the target origin")
+    self_url = urlparse(settings.PEER_SELF)
+    incoming_origin = f"{self_url.scheme}://{self_url.netloc}"
+    incoming_host = self_url.hostname or ""
+    req_port = str(self_url.port) if self_url.port else None
+    my_origin_for_headers = f"{self_url.scheme}://{incoming_host}"
+
+    keys = _key_builder()
+    base_key, render_key = _base_keys(keys, "GET", target_base, incoming_origin + target_path, query)
+    key_headers = _peer_headers(headers)
+    plan = get_plan(incoming_origin, incoming_host, req_port, my_origin_for_headers)
+    ctx = _ProxyContext(
+        method="GET",
+        target_path=target_path,
+        target_url=url,
+        base_key=base_key,
+        render_key=render_key,
+        key_headers=key_headers,
+        vary=_vary.get(base_key),
+        impersonate="firefox" if payload["profile"] == "firefox" else "chrome",
+        incoming_origin=incoming_origin,
+        incoming_host=incoming_host,
+        req_port=req_port,
+        my_origin_for_headers=my_origin_for_headers,
+        plan=plan,
+        request_headers=plan.request_headers(key_headers),
+        conditionals={},
+        accept_encoding="",
+    )
+    _set_cache_keys(ctx, keys)
+    return ctx
+
+
+async def peer_request(request: Request) -> Response:
+    """Serve an entry this node owns to another node of the cluster (see PEERS).
+
+    Misses are fetched from the origin (coalesced with concurrent ones) and
+    cached here. The answer is the shared entry: a 4-byte length, its JSON
+    metadata and its body; 204 means the URL is not cacheable.
+    """
+    if _peers is None:
+        return Response(status_code=404)
+    token = request.headers.get(TOKEN_HEADER, "")
+    if not settings.PEER_TOKEN or not hmac.compare_digest(token.encode(), settings.PEER_TOKEN.encode()):
+        return Response(status_code=403)
+    try:
+        ctx = _peer_context(json.loads(await request.body()), request.headers)
+    except (ValueError, KeyError, TypeError, AttributeError) as exc:
+        return Response(content=f"Invalid peer request: {exc}", status_code=400)
+    if _peers.is_pass(ctx.base_key):
+        return Response(status_code=204)
+
+    found = await _lookup_entry(ctx)
+    if found is None or found[2]:
+        leader, flight = _flights.join(ctx.raw_key, settings.UPSTREAM_TIMEOUT)
+        if leader:
+            stale = found[1] if found is not None else None
+            await _refresh(ctx, stale, partial(_flights.release, ctx.raw_key, flight))
+        else:
+            await _flights.wait(flight, settings.UPSTREAM_TIMEOUT)
+        found = await _lookup_entry(ctx)
+        if found is None:
+            _peers.mark_pass(ctx.base_key)
+            return Response(status_code=204)
+
+    tier, value, _ = found
+    meta = value.to_dict()
+    # Only the stored coding is sent; the requesting node serves other codings decompressed
+    meta.update(variants=[], sizes=[len(value.body)], tier=tier, key=ctx.raw_key, vary=list(ctx.vary or ()))
+    encoded = json.dumps(meta, separators=(",", ":")).encode("utf-8")
+    return Response(content=struct.pack(">I", len(encoded)) + encoded + value.body, media_type="application/octet-stream")
+
+
+async def _lookup_peer(ctx: _ProxyContext) -> Optional[Response]:
+    """Answer a miss from the peer owning its key; ``None`` to use the origin.
+
+    Entries are kept locally for at most PEER_HOT_TTL seconds, so the cluster
+    caches every object about once.
+    """
+    owner = _peers.owner(ctx.base_key)
+    if owner is None or _peers.is_pass(ctx.base_key):
+        return None
+    # The owner derives the cache keys from the URL and these headers itself
+    headers = _peer_headers(ctx.request_headers)
+    headers[TOKEN_HEADER] = settings.PEER_TOKEN
+    payload = {"url": ctx.target_url, "profile": ctx.impersonate}
+    try:
+        response = await _peers.client().post(owner + settings.PEER_PATH, content=json.dumps(payload), headers=headers)
+    except httpx.HTTPError as exc:
+        _peers.errors += 1
+        logger.debug("Peer %s failed for %s: %s", owner, ctx.target_url, exc)
+        return None
+    if response.status_code == 204:
+        _peers.passes += 1
+        _peers.mark_pass(ctx.base_key)
+        return None
+    try:
+        if response.status_code != 200:
+            raise ValueError(f"HTTP {response.status_code}")
+        data = response.content
+        (size,) = struct.unpack_from(">I", data)
+        meta = json.loads(data[4 : 4 + size])
+        value = CachedResponse.from_dict(meta, [data[4 + size :]])
+    except (ValueError, KeyError, TypeError, struct.error) as exc:
+        _peers.errors += 1
+        logger.warning("Invalid answer from peer %s for %s: %s", owner, ctx.target_url, exc)
+        return None
+    _peers.hits += 1
+
+    if meta["vary"]:
+        _vary.set(ctx.base_key, tuple(meta["vary"]))
+        ctx.vary = tuple(meta["vary"])
+        _set_cache_keys(ctx)
+    ttl = min(value.expires - time.time(), settings.PEER_HOT_TTL)
+    if meta["tier"] == "raw":
+        if ttl > 0:
+            _raw_cache.put(ctx.raw_key, value, ttl)
+            value = _render_from_raw(ctx, value)
+        else:
+            value = _render_document(value, ctx)
+    elif ttl > 0:
+        _static_cache.put(ctx.raw_key, value, ttl)
+    return await _cached_response(value, "PEER", ctx)
+
+
+def _end_shared_flight(key: str, flight: asyncio.Event) -> None:
+    # May be called again once the response is over (see _fetch_and_respond)
+    if not flight.is_set():
+        # Queued after the write-through of the entry, which waiters then find
+        _shared_cache.submit(_shared_cache.release, key)
+    _flights.release(key, flight)
+
+
+def _record_body_outcome(generation: int, success: Optional[bool]) -> None:
+    """Count how reading an upstream body went (see ``release_on_close``)."""
+    if success is None:
+        _breaker.abandon(generation)
+    else:
+        _breaker.record(success, generation)
+
+
+class _BodyTooLarge(Exception):
+    """The request body is larger than REQUEST_MAX_BODY_BYTES."""
+
+
+def _body_too_large() -> Response:
+    return Response(content="Request body too large", status_code=413)
+
+
+async def _limited_stream(chunks: AsyncIterator[bytes], limit: int) -> AsyncIterator[bytes]:
+    """Pass ``chunks`` through, raising ``_BodyTooLarge`` past ``limit`` bytes (0 = no limit)."""
+    size = 0
+    async for chunk in chunks:
+        size += len(chunk)
+        if limit and size > limit:
+            raise _BodyTooLarge()
+        yield chunk
+
+
+async def _request_body(request: Request) -> Union[bytes, AsyncIterator[bytes]]:
+    """Return the body to send upstream for a request that may have one.
+
+    Bodies up to REQUEST_BUFFER_MAX_BYTES are read first, so the request can
+    be sent again. Larger or chunked ones are streamed (through ``_upload_pool``,
+    as the curl transport would read them whole): each chunk is sent upstream
+    as it is received from the client.
+    """
+    limit = settings.REQUEST_MAX_BODY_BYTES
+    length = request.headers.get("content-length", "")
+    if length.isdigit():
+        if limit and int(length) > limit:
+            raise _BodyTooLarge()
+        if int(length) <= settings.REQUEST_BUFFER_MAX_BYTES:
+            return await request.body()
+    elif "transfer-encoding" not in request.headers:
+        # Neither a length nor chunked encoding: there is no body
+        return await request.body()
+    return _limited_stream(request.stream(), limit)
 
 
 async def proxy_request(request: Request, path: str) -> Response:
@@ -38,9 +1265,8 @@ async def proxy_request(request: Request, path: str) -> Response:
 
     qs = str(request.url.query)
     target_path = request.url.path
-    target_url = urljoin(settings.TARGET_ORIGIN, target_path)
-    if qs:
-        target_url = f"{target_url}?{qs}"
+    target_base = urljoin(settings.TARGET_ORIGIN, target_path)
+    target_url = f"{target_base}?{qs}" if qs else target_base
 
     incoming_url = str(request.url)
 
@@ -73,158 +1299,375 @@ async def proxy_request(request: Request, path: str) -> Response:
 
     incoming_host = req_host
 
-    cache_key = f"{method}:{incoming_url}"
+    # Client validators, answered with 304 from cached entries
+    conditionals = {name: request.headers[name] for name in _CONDITIONAL_HEADERS if name in request.headers}
 
-    if method == "GET":
-        cache_store = _static_cache if is_static_file(target_path, settings.STATIC_EXTENSIONS) else _html_cache
-        cached = cache_store.get(cache_key)
-        if cached:
-            data, headers, status = cached
-            headers = dict(headers)
-            headers["x-cache"] = "HIT"
-            return Response(content=data, status_code=status, headers=headers)
-
-    request_headers = dict(request.headers)
-    request_headers["host"] = settings.target_host
-    request_headers.pop("accept-encoding", None)
-    
-    # Filter out Cloudflare-specific cookies that should not be forwarded
-    if "cookie" in request_headers:
-        cookies = request_headers["cookie"].split("; ")
-        filtered_cookies = [
-            c for c in cookies 
-            if not any(c.startswith(f"{name}=") for name in ["__cf_bm", "_cfuvid", "cf_clearance"])
-        ]
-        if filtered_cookies:
-            request_headers["cookie"] = "; ".join(filtered_cookies)
-        else:
-            request_headers.pop("cookie", None)
-
-    # Sanitize headers using the dynamically derived origin/host for this request
     # We provide an origin-like string for header sanitization (scheme://host[:port]).
     my_origin_for_headers = f"{scheme}://{incoming_host}"
-    request_headers = sanitize_request_headers(request_headers, my_origin_for_headers, incoming_host, settings.TARGET_ORIGIN)
-
-    body: Optional[bytes] = None
-    if method not in ("GET", "HEAD"):
-        body = await request.body()
 
     # Choose impersonation profile based on incoming User-Agent
     ua = request.headers.get("user-agent", "")
     impersonate = "firefox" if "firefox" in ua.lower() else "chrome"
 
+    # Request headers are filled in below, only when the request is not a cache hit
+    keys = _key_builder()
+    base_key, render_key = _base_keys(keys, method, target_base, incoming_url.partition("?")[0], qs)
+    ctx = _ProxyContext(
+        method=method,
+        target_path=target_path,
+        target_url=target_url,
+        base_key=base_key,
+        render_key=render_key,
+        key_headers=request.headers,
+        vary=_vary.get(base_key),
+        impersonate=impersonate,
+        incoming_origin=incoming_origin,
+        incoming_host=incoming_host,
+        req_port=req_port,
+        my_origin_for_headers=my_origin_for_headers,
+        plan=get_plan(incoming_origin, incoming_host, req_port, my_origin_for_headers),
+        conditionals=conditionals,
+        accept_encoding=request.headers.get("accept-encoding", ""),
+        range=request.headers.get("range") if method == "GET" else None,
+        if_range=request.headers.get("if-range"),
+    )
+    _set_cache_keys(ctx, keys)
+
+    found = None
+    if method == "GET":
+        found = await _lookup_cache(ctx)
+        if found and not found[1]:
+            return await _cached_response(found[0], "HIT", ctx)
+
+    # Sanitize headers using the dynamically derived origin/host for this request
+    ctx.request_headers = ctx.plan.request_headers(request.headers)
+
+    on_done: Optional[Callable[[], None]] = None
+    stale = None
+    if found:
+        cached, staleness = found
+        # Stale-while-revalidate: answer from the expired copy right away and
+        # refresh it in the background.
+        if staleness <= settings.CACHE_STALE_WHILE_REVALIDATE:
+            _revalidate_in_background(_whole_object(ctx) if ctx.range else ctx, cached)
+            return await _cached_response(cached, "STALE", ctx)
+        if staleness <= settings.CACHE_STALE_IF_ERROR or _breaker.is_open:
+            stale = cached
+    elif method == "GET" and _peers is not None and not ctx.range:
+        # Ask the node owning the key, which fetches and caches it once for the cluster
+        response = await _lookup_peer(ctx)
+        if response is not None:
+            return response
+
+    if method == "GET" and not ctx.range and not _flights.is_pass(ctx.raw_key):
+        # Single-flight: only the first concurrent miss for a target URL goes
+        # upstream, the others wait for it to fill the cache and are then served
+        # from it (rendered for their own origin). Range requests are forwarded
+        # on their own: they do not fill the cache, and neither do URLs whose
+        # last response could not be stored (hit-for-pass).
+        if settings.COALESCE_TIMEOUT > 0:
+            leader, flight = _flights.join(ctx.raw_key, settings.COALESCE_TIMEOUT)
+            if leader:
+                on_done = partial(_flights.release, ctx.raw_key, flight)
+                # Across worker processes, the shared cache lease plays the same role
+                if _shared_cache is not None:
+                    if await _shared_cache.run(_shared_cache.lease, ctx.raw_key, settings.COALESCE_TIMEOUT):
+                        on_done = partial(_end_shared_flight, ctx.raw_key, flight)
+                    elif await _shared_cache.wait(ctx.raw_key, settings.COALESCE_TIMEOUT):
+                        found = await _lookup_cache(ctx)
+                        if found and not found[1]:
+                            on_done()
+                            return await _cached_response(found[0], "HIT", ctx)
+            elif await _flights.wait(flight, settings.COALESCE_TIMEOUT):
+                found = await _lookup_cache(ctx)
+                if found and not found[1]:
+                    return await _cached_response(found[0], "HIT", ctx)
+
+    body: Optional[Union[bytes, AsyncIterator[bytes]]] = None
+    if method not in ("GET", "HEAD"):
+        try:
+            body = await _request_body(request)
+        except _BodyTooLarge:
+            return _body_too_large()
+
     try:
-        async with _create_async_client(impersonate) as client:
-            upstream = await client.request(method=method, url=target_url, headers=request_headers, content=body)
+        response = await _fetch_and_respond(ctx, body, on_done, stale)
+    except BaseException:
+        if on_done is not None:
+            on_done()
+        raise
+    # Streaming responses call on_done themselves once the body has been sent
+    if on_done is not None and not isinstance(response, StreamingResponse):
+        on_done()
+    return response
+
+
+async def _upstream_error(
+    exc: Exception, ctx: _ProxyContext, stale: Optional[Union[CachedResponse, DiskEntry]]
+) -> Response:
+    """Answer an upstream failure with the expired cached copy if there is one, else 502."""
+    if stale is not None:
+        return await _cached_response(stale, "STALE", ctx)
+    return Response(content=f"Upstream fetch error: {exc}", status_code=502)
+
+
+async def _fetch_and_respond(
+    ctx: _ProxyContext,
+    body: Optional[Union[bytes, AsyncIterator[bytes]]],
+    on_done: Optional[Callable[[], None]] = None,
+    stale: Optional[Union[CachedResponse, DiskEntry]] = None,
+) -> Response:
+    """Fetch ``ctx.target_url`` upstream and build the (rewritten) response.
+
+    Static/binary responses are cached under ``ctx.raw_key``; text documents
+    (HTML, JSON, XML, JS, CSS...) are cached raw under ``ctx.raw_key`` and
+    rewritten under ``ctx.cache_key``, for as long as the upstream caching
+    headers allow (see ``policy.freshness``).
+    ``on_done`` is handed to streaming responses, which call it once the
+    stream has finished. ``stale`` is an expired cached copy: it is
+    revalidated with a conditional request when it has upstream validators and
+    is served instead of upstream errors.
+    """
+    method = ctx.method
+    target_path = ctx.target_path
+
+    request_headers = ctx.request_headers
+    revalidating = stale is not None and bool(stale.validators)
+    if revalidating:
+        # Conditional request with our stored validators instead of the client's
+        request_headers = {k: v for k, v in request_headers.items() if k not in _CONDITIONAL_HEADERS}
+        if "etag" in stale.validators:
+            request_headers["if-none-match"] = stale.validators["etag"]
+        if "last-modified" in stale.validators:
+            request_headers["if-modified-since"] = stale.validators["last-modified"]
+    rewritten_range = bool(ctx.range) and _may_be_rewritten(target_path)
+    if rewritten_range:
+        # Rewriting shifts byte offsets, so a slice of the upstream document
+        # cannot be rewritten: ask for all of it and cut the range locally
+        request_headers = {k: v for k, v in request_headers.items() if k not in _RANGE_HEADERS}
+
+    # Bound in-flight upstream requests; shed the excess instead of piling up
+    try:
+        await _limiter.acquire(ctx.impersonate)
+    except Overloaded:
+        if stale is not None:
+            return await _cached_response(stale, "STALE", ctx)
+        return Response(
+            content="Upstream is busy, retry later",
+            status_code=503,
+            headers={"retry-after": str(settings.UPSTREAM_RETRY_AFTER)},
+        )
+    release = partial(_limiter.release, ctx.impersonate)
+
+    # Fail fast while the origin is unhealthy, with any cached copy if there is
+    # one. Checked once the slot is held, so a half-open probe is always sent.
+    if not _breaker.allow():
+        release()
+        if stale is not None:
+            return await _cached_response(stale, "STALE", ctx)
+        return Response(
+            content="Upstream is unavailable, retry later",
+            status_code=503,
+            headers={"retry-after": str(max(1, math.ceil(_breaker.retry_after())))},
+        )
+    # Results of requests sent before the breaker changed state are ignored
+    generation = _breaker.generation
+
+    try:
+        pool = _client_pool if body is None or isinstance(body, bytes) else _upload_pool
+        client = pool.get(ctx.impersonate)
+        upstream_request = client.build_request(method=method, url=ctx.target_url, headers=request_headers, content=body)
+        started = time.perf_counter()
+        upstream = await client.send(upstream_request, stream=True)
+    except _BodyTooLarge:
+        # A streamed request body went past the limit: the client's fault, not the origin's
+        release()
+        _breaker.abandon(generation)
+        return _body_too_large()
     except Exception as exc:  # pragma: no cover - network error
-        return Response(content=f"Upstream fetch error: {exc}", status_code=502)
+        release()
+        _breaker.record(False, generation)
+        return await _upstream_error(exc, ctx, stale)
+    except BaseException:
+        # Cancelled (e.g. the client went away): nothing learnt about the origin
+        release()
+        _breaker.abandon(generation)
+        raise
+    # Errors, timeouts and 5xx answers count against the origin's health. Other
+    # answers count once their body has been read, as it may still fail (a
+    # reset or a read timeout).
+    outcome = None
+    if upstream.status_code >= 500:
+        _breaker.record(False, generation)
+    else:
+        outcome = partial(_record_body_outcome, generation)
+    # The slot is held until the upstream body has been read (or dropped)
+    release_on_close(upstream, release, outcome)
+
+    _observe_upstream_headers(upstream, started)
+
+    if stale is not None and revalidating and upstream.status_code == 304:
+        # Still valid upstream: keep the cached (already rewritten) body
+        await _close_upstream(upstream)
+        fresh = _response_freshness(ctx, upstream.headers, stale.headers.get("content-type", ""))
+        if fresh is not None:
+            _touch_cached(ctx, fresh)
+            if isinstance(stale, DiskEntry):
+                stale.date, stale.expires = fresh.date, fresh.expires
+        return await _cached_response(stale, "REVALIDATED", ctx)
+
+    if stale is not None and upstream.status_code >= 500:
+        # Stale-if-error: prefer the expired copy over an origin failure
+        await _close_upstream(upstream)
+        return await _cached_response(stale, "STALE", ctx)
+
+    validators = _upstream_validators(upstream)
+    raw_headers = dict(upstream.headers)
 
     # Sanitize response headers using the dynamically derived origin/host for this request
-    resp_headers = sanitize_response_headers(dict(upstream.headers), settings.TARGET_ORIGIN, settings.target_host, my_origin_for_headers, incoming_host)
+    resp_headers = ctx.plan.response_headers(raw_headers)
     content_type = resp_headers.get("content-type", "")
 
-    is_text = any(t in content_type.lower() for t in ("text", "json", "javascript", "xml", "html"))
-
-    if is_static_file(target_path, settings.STATIC_EXTENSIONS) or not is_text:
-        # static / binary -> cache server-side and on Cloudflare CDN
-        resp_headers["cache-control"] = "public, max-age=3600"
-        resp_headers.pop("pragma", None)
-        resp_headers.pop("expires", None)
-        
-        # Filter out Cloudflare cookies from set-cookie header
-        if "set-cookie" in resp_headers:
-            cookies = re.split(r',\s+(?=[^=\s]+=)', resp_headers["set-cookie"])
-            filtered_cookies = [
-                c for c in cookies
-                if not any(c.startswith(f"{name}=") for name in ["__cf_bm", "_cfuvid", "cf_clearance"])
-            ]
-            if filtered_cookies:
-                resp_headers["set-cookie"] = ", ".join(filtered_cookies)
-            else:
-                resp_headers.pop("set-cookie", None)
-        
-        resp_headers["x-cache"] = "MISS"
-        body_bytes = upstream.content
-
-        if 200 <= upstream.status_code < 300 and method == "GET":
-            _static_cache.put(cache_key, (body_bytes, resp_headers, upstream.status_code), settings.CACHE_TTL_STATIC)
+    # Cacheability and TTL follow the upstream caching headers (see policy.freshness)
+    # Partial (206) responses are never stored
+    fresh = None
+    ranged = upstream.status_code == 206
+    if 200 <= upstream.status_code < 300 and not ranged and method == "GET":
+        fresh = _response_freshness(ctx, raw_headers, content_type)
+        if fresh is not None and not _apply_vary(ctx, upstream):
+            fresh = None
+        if fresh is None and stale is not None:
+            _drop_cached(ctx)
+    cacheable = fresh is not None
+
+    if cacheable:
+        _prepare_cacheable_headers(resp_headers, fresh.date, fresh.expires)
+        # Later requests are served from the cache, which answers Range requests
+        resp_headers["accept-ranges"] = "bytes"
+    else:
+        _filter_set_cookie(resp_headers)
+    resp_headers["x-cache"] = "MISS"
+
+    static = is_static_file(target_path, settings.STATIC_EXTENSIONS) or not _is_text(content_type)
+    if method == "GET" and not ranged:
+        streamed = settings.STREAM_STATIC if static else settings.REWRITE_MODE == "stream"
+        if cacheable and (not streamed or _fits_stream_cache(upstream)):
+            _flights.mark_pass(ctx.raw_key, 0)
+        else:
+            # Nothing will be stored for coalesced misses to find: release them
+            # now rather than after the whole transfer, and let the next misses
+            # for this URL go upstream on their own (hit-for-pass)
+            _flights.mark_pass(ctx.raw_key, settings.COALESCE_PASS_TTL)
+            if on_done is not None:
+                on_done()
+                on_done = None
 
+    if static:
+        # static / binary -> cache server-side and on Cloudflare CDN.
+        # The body is the same for every incoming origin: cache it once with the
+        # upstream headers, which are sanitized per origin when served.
+        if ranged and settings.RANGE_FETCH_FULL:
+            _fetch_whole_in_background(ctx, upstream)
+        if settings.STREAM_STATIC:
+            # Forward bytes as they arrive; only small bodies are tee'd into the cache
+            store = None
+            if cacheable and _fits_stream_cache(upstream):
+                store = partial(
+                    _store_response,
+                    _static_cache,
+                    ctx.raw_key,
+                    raw_headers,
+                    upstream.status_code,
+                    fresh,
+                    validators,
+                    shared=True,
+                )
+            return _UpstreamStreamingResponse(
+                _tee_stream(upstream.aiter_bytes(), upstream, store),
+                upstream,
+                on_done,
+                status_code=upstream.status_code,
+                headers=resp_headers,
+            )
+
+        try:
+            body_bytes = await upstream.aread()
+        except Exception as exc:
+            return await _upstream_error(exc, ctx, stale)
+        finally:
+            await _close_upstream(upstream)
+
+        if cacheable:
+            _store_response(
+                _static_cache, ctx.raw_key, raw_headers, upstream.status_code, fresh, validators, body_bytes, shared=True
+            )
+
+        if rewritten_range:
+            partial_response = _ranged_response(body_bytes, upstream.status_code, resp_headers, ctx)
+            if partial_response is not None:
+                return partial_response
         return Response(content=body_bytes, status_code=upstream.status_code, headers=resp_headers)
 
+    if ranged:
+        # A text document behind a static-looking path was sliced upstream and
+        # cannot be rewritten: fetch (and rewrite) all of it instead
+        await _close_upstream(upstream)
+        return await _fetch_and_respond(_whole_object(ctx), body, on_done, stale)
+
+    rewriter = ctx.plan.rewriter
+    is_html = "html" in content_type.lower()
+
+    # The upstream validator describes the original body, not the rewritten one
+    resp_headers.pop("etag", None)
+
+    # Optionally inject inline JS into <head> or <body> based on INJECT_JS_LOCATION.
+    js_snippet = _js_snippet() if is_html else ""
+    inject_location = getattr(settings, "INJECT_JS_LOCATION", "body").lower()
+
+    if settings.REWRITE_MODE == "stream" and not rewritten_range:
+        # Rewrite chunks as they arrive; documents are tee'd into the cache when
+        # small enough. Range requests are buffered to be cut after rewriting.
+        injector = ScriptInjector(js_snippet, inject_location) if js_snippet else None
+        store = raw = None
+        if cacheable:
+            raw = _BodyBuffer()
+            store = partial(
+                _store_streamed_document, ctx, raw_headers, resp_headers, upstream.status_code, validators, fresh, raw
+            )
+        chunks = _rewrite_stream(upstream, rewriter, injector, raw)
+        return _UpstreamStreamingResponse(
+            _tee_stream(chunks, upstream, store),
+            upstream,
+            on_done,
+            status_code=upstream.status_code,
+            headers=resp_headers,
+        )
+
+    # Buffered fallback: read the whole document, rewrite it, then respond
+    try:
+        await upstream.aread()
+    except Exception as exc:  # pragma: no cover - network error
+        return await _upstream_error(exc, ctx, stale)
+    finally:
+        await _close_upstream(upstream)
+
     try:
         text = upstream.text
     except Exception:
         text = upstream.content.decode("utf-8", errors="replace")
+    raw_text = text
 
-    # Ensure target origin/host -> incoming origin/host replacement is always applied and overrides
-    # any user-specified replacement for the target. We filter out user-supplied replacements that
-    # reference the configured target to avoid them overriding the mandatory mapping, then append
-    # the mandatory mappings so they are applied last.
-    user_replacements = getattr(settings, "REPLACEMENTS", {}) or {}
-    filtered_replacements = {}
-    
-    # Filter out user replacements that target the configured target host/origin
-    for from_str, to_str in user_replacements.items():
-        # If the user tries to target the configured target host/origin, ignore it so we enforce
-        # replacement unconditionally.
-        if settings.target_host.lower() in from_str.lower() or settings.TARGET_ORIGIN.lower() in from_str.lower():
-            continue
-        filtered_replacements[from_str] = to_str
-
-    # Add mandatory mappings: replace full origin first, then fallback to host-only for cases
-    # where the content references just the hostname without scheme.
-    filtered_replacements[settings.TARGET_ORIGIN.rstrip("/")] = incoming_origin.rstrip("/")
-    filtered_replacements[settings.target_host] = f"{incoming_host}:{req_port}" if req_port else incoming_host
-
-    # Perform replacements using the filtered dict.
-    text = perform_text_replacements(text, filtered_replacements, incoming_host)
-
-    if "html" in content_type.lower():
-        # Optionally inject inline JS into <head> or <body> based on INJECT_JS_LOCATION.
-        if getattr(settings, "INJECT_JS", ""):
-            js_snippet = f"<script>{settings.INJECT_JS}</script>"
-            inject_location = getattr(settings, "INJECT_JS_LOCATION", "body").lower()
-
-            if inject_location == "head":
-                # Inject before closing </head> tag
-                if re.search(r"</head>", text, flags=re.IGNORECASE):
-                    text = re.sub(r"</head>", js_snippet + "</head>", text, flags=re.IGNORECASE)
-                elif re.search(r"<head[^>]*>", text, flags=re.IGNORECASE):
-                    # If no closing </head> but opening <head> exists, insert after it
-                    text = re.sub(r"(<head[^>]*>)", r"\1" + js_snippet, text, flags=re.IGNORECASE)
-                else:
-                    # Fallback: prepend to content
-                    text = js_snippet + text
-            else:
-                # Default: inject before closing </body> tag
-                if re.search(r"</body>", text, flags=re.IGNORECASE):
-                    text = re.sub(r"</body>", js_snippet + "</body>", text, flags=re.IGNORECASE)
-                else:
-                    text = text + js_snippet
-
-        resp_headers["cache-control"] = "public, max-age=3600"
-        resp_headers.pop("pragma", None)
-        resp_headers.pop("expires", None)
-        
-        # Filter out Cloudflare cookies from set-cookie header
-        if "set-cookie" in resp_headers:
-            # Split on ", " only when followed by a cookie name pattern (word=)
-            # This avoids splitting on commas within expires dates like "Tue, 30-Dec-25"
-            cookies = re.split(r',\s+(?=[^=\s]+=)', resp_headers["set-cookie"])
-            filtered_cookies = [
-                c for c in cookies
-                if not any(c.startswith(f"{name}=") for name in ["__cf_bm", "_cfuvid", "cf_clearance"])
-            ]
-            if filtered_cookies:
-                resp_headers["set-cookie"] = ", ".join(filtered_cookies)
-            else:
-                resp_headers.pop("set-cookie", None)
-        
-        resp_headers["x-cache"] = "MISS"
-        body_bytes = text.encode("utf-8")
-        if 200 <= upstream.status_code < 300 and method == "GET":
-            _html_cache.put(cache_key, (body_bytes, resp_headers, upstream.status_code), settings.CACHE_TTL_HTML)
-        return Response(content=body_bytes, status_code=upstream.status_code, headers=resp_headers)
+    # Perform replacements using the filtered rule set.
+    text = _rewrite_text(rewriter, text, js_snippet)
 
     body_bytes = text.encode("utf-8")
+    resp_headers["etag"] = compute_etag(body_bytes)
+    if cacheable:
+        _store_document(
+            ctx, raw_headers, resp_headers, upstream.status_code, validators, fresh, raw_text.encode("utf-8"), body_bytes
+        )
+    if rewritten_range:
+        partial_response = _ranged_response(body_bytes, upstream.status_code, resp_headers, ctx)
+        if partial_response is not None:
+            return partial_response
     return Response(content=body_bytes, status_code=upstream.status_code, headers=resp_headers)
@@ -0,0 +1,61 @@
+from __future__ import annotations
+from typing import Optional, Tuple
+
+
+class RangeNotSatisfiable(ValueError):
+    """The requested range lies outside the representation (answer 416)."""
+
+
+def parse_range(value: str, size: int) -> Optional[Tuple[int, int]]:
+    """Return the ``(start, end)`` span (end exclusive) of a ``Range`` header.
+
+    Only single ``bytes`` ranges are honoured; ``None`` means the header is
+    malformed or asks for several ranges, and the whole body is served.
+    Raises ``RangeNotSatisfiable`` when no byte of the range exists.
+    """
+    unit, _, spec = value.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    first, sep, last = spec.strip().partition("-")
+    if not sep or not (first or last):
+        return None
+    try:
+        start = int(first) if first else None
+        end = int(last) + 1 if last else size
+    except ValueError:
+        return None
+    if start is None:
+        # Suffix range: the last N bytes
+        length = end - 1
+        if length <= 0 or size == 0:
+            raise RangeNotSatisfiable(value)
+        return max(size - length, 0), size
+    if end <= start and last:
+        return None
+    if start >= size:
+        raise RangeNotSatisfiable(value)
+    return start, min(end, size)
+
+
+def if_range_matches(if_range: str, etag: Optional[str], last_modified: Optional[str]) -> bool:
+    """Whether an ``If-Range`` validator still matches the representation.
+
+    Entity tags must match strongly; dates must equal ``Last-Modified``.
+    """
+    if if_range.startswith("W/"):
+        return False
+    if if_range.startswith('"'):
+        return bool(etag) and not etag.startswith("W/") and etag == if_range
+    return bool(last_modified) and if_range == last_modified
+
+
+def content_range(start: int, end: int, size: int) -> str:
+    return f"bytes {start}-{end - 1}/{size}"
+
+
+def total_size(content_range_value: Optional[str]) -> Optional[int]:
+    """Return the complete length from a ``Content-Range`` header, if known."""
+    if not content_range_value:
+        return None
+    _, _, total = content_range_value.rpartition("/")
+    return int(total) if total.strip().isdigit() else None
@@ -0,0 +1,210 @@
+from __future__ import annotations
+import re
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+
+def _fold(text: str) -> str:
+    """Lowercase ``text`` without changing its length.
+
+    Characters whose lowercase form is longer (e.g. U+0130) are kept as they
+    are, so offsets into the folded text are offsets into ``text``.
+    """
+    lowered = text.lower()
+    if len(lowered) == len(text):
+        return lowered
+    return "".join(char if len(char.lower()) != 1 else char.lower() for char in text)
+
+
+def _trie_pattern(words: List[str]) -> str:
+    """Return a regex matching any of ``words``, factored on common prefixes.
+
+    At every node the continuations are tried before the word ending there, so
+    the pattern prefers the longest word at a given position, like an
+    alternation sorted longest first, but each character is examined once.
+    """
+    trie: Dict[str, dict] = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[""] = {}
+
+    def build(node: Dict[str, dict]) -> str:
+        branches = [re.escape(char) + build(child) for char, child in node.items() if char]
+        if not branches:
+            return ""
+        if len(branches) == 1 and "" not in node:
+            return branches[0]
+        return "(?:" + "|".join(branches) + ")" + ("?" if "" in node else "")
+
+    return build(trie)
+
+
+class Rewriter:
+    """Case-insensitive literal rewriter that applies every rule in one pass.
+
+    The rules are factored into a prefix trie and matched against the
+    lowercased text without ``re.IGNORECASE``, which keeps the regex engine on
+    its fast literal paths. At any position the longest matching rule wins and
+    ties go to the rule that was listed first. Replacements are inserted
+    literally and are never re-scanned, i.e. the output of one rule is not fed
+    into another.
+    """
+
+    def __init__(self, replacements: Dict[str, str], incoming_host: str = "") -> None:
+        self._targets: Dict[str, str] = {}
+        for from_str, to_str in replacements.items():
+            if not from_str or to_str is None:
+                continue
+            if to_str == "MY_HOST":
+                to_str = incoming_host
+            # The first rule listed wins among patterns that fold the same
+            self._targets.setdefault(_fold(from_str), to_str)
+
+        self.max_pattern_length = max((len(key) for key in self._targets), default=0)
+        self.pattern: Optional[re.Pattern[str]] = None
+        if self._targets:
+            self.pattern = re.compile(_trie_pattern(list(self._targets)))
+
+    def replacement(self, match: re.Match[str]) -> str:
+        """Return the replacement text for a match of ``pattern`` in folded text."""
+        return self._targets[match.group()]
+
+    def subn(self, text: str) -> Tuple[str, int]:
+        """Return ``text`` with every match replaced and the number of matches."""
+        if self.pattern is None:
+            return text, 0
+        targets = self._targets
+        out: List[str] = []
+        pos = 0
+        for match in self.pattern.finditer(_fold(text)):
+            out.append(text[pos:match.start()])
+            out.append(targets[match.group()])
+            pos = match.end()
+        if not out:
+            return text, 0
+        out.append(text[pos:])
+        return "".join(out), len(out) // 2
+
+    def rewrite(self, text: str) -> str:
+        return self.subn(text)[0]
+
+
+class StreamRewriter:
+    """Apply a ``Rewriter`` incrementally over chunks of text.
+
+    The last ``max_pattern_length - 1`` characters of every chunk are carried
+    over to the next one, so matches spanning chunk boundaries are replaced
+    exactly as a single pass over the whole document would replace them.
+    """
+
+    def __init__(self, rewriter: Rewriter) -> None:
+        self._rewriter = rewriter
+        self._carry = ""
+        self.matches = 0
+
+    def feed(self, text: str) -> str:
+        buf = self._carry + text
+        pattern = self._rewriter.pattern
+        if pattern is None:
+            self._carry = ""
+            return buf
+
+        # Any match starting before `cut` is final: no longer pattern could
+        # extend past the end of the buffer.
+        cut = len(buf) - (self._rewriter.max_pattern_length - 1)
+        out: List[str] = []
+        pos = 0
+        targets = self._rewriter._targets
+        for match in pattern.finditer(_fold(buf)):
+            if match.start() >= cut:
+                break
+            out.append(buf[pos:match.start()])
+            out.append(targets[match.group()])
+            pos = match.end()
+            self.matches += 1
+        keep = max(pos, cut)
+        out.append(buf[pos:keep])
+        self._carry = buf[keep:]
+        return "".join(out)
+
+    def flush(self) -> str:
+        buf, self._carry = self._carry, ""
+        if not buf:
+            return buf
+        result, count = self._rewriter.subn(buf)
+        self.matches += count
+        return result
+
+
+@lru_cache(maxsize=128)
+def _compile(rules: Tuple[Tuple[str, str], ...], incoming_host: str) -> Rewriter:
+    return Rewriter(dict(rules), incoming_host)
+
+
+def get_rewriter(replacements: Dict[str, str], incoming_host: str) -> Rewriter:
+    """Return a compiled (and memoized) rewriter for the given rule set."""
+    return _compile(tuple(replacements.items()), incoming_host)
+
+
+_HEAD_OPEN_RE = re.compile(r"<head[^>]*>", re.IGNORECASE)
+
+
+def inject_script(text: str, snippet: str, location: str) -> str:
+    """Insert ``snippet`` into a complete HTML document.
+
+    With ``location == "head"`` it goes before every ``</head>``, else after the
+    opening ``<head>`` tag, else at the start of the document. Otherwise it goes
+    before every ``</body>`` or is appended when there is none.
+    """
+    if location == "head":
+        tag = get_rewriter({"</head>": snippet + "</head>"}, "")
+        result, count = tag.subn(text)
+        if count:
+            return result
+        if _HEAD_OPEN_RE.search(text):
+            return _HEAD_OPEN_RE.sub(lambda m: m.group(0) + snippet, text)
+        return snippet + text
+
+    tag = get_rewriter({"</body>": snippet + "</body>"}, "")
+    result, count = tag.subn(text)
+    return result if count else text + snippet
+
+
+class ScriptInjector:
+    """Streaming counterpart of ``inject_script``.
+
+    In body mode output is passed through and the snippet is inserted as each
+    ``</body>`` streams past (or appended at the end). In head mode output is
+    held back until the first ``</head>`` is seen so the fallbacks of
+    ``inject_script`` can still be applied when the document has none.
+    """
+
+    def __init__(self, snippet: str, location: str) -> None:
+        self._snippet = snippet
+        self._head = location == "head"
+        closing = "</head>" if self._head else "</body>"
+        self._stream = StreamRewriter(get_rewriter({closing: snippet + closing}, ""))
+        self._held: Optional[List[str]] = []
+
+    def feed(self, text: str) -> str:
+        out = self._stream.feed(text)
+        if not self._head or self._held is None:
+            return out
+        if self._stream.matches:
+            held, self._held = self._held, None
+            return "".join(held) + out
+        self._held.append(out)
+        return ""
+
+    def flush(self) -> str:
+        out = self._stream.flush()
+        if not self._head:
+            return out if self._stream.matches else out + self._snippet
+        if self._held is None:
+            return out
+        held, self._held = "".join(self._held) + out, None
+        if self._stream.matches:
+            return held
+        return inject_script(held, self._snippet, "head")
@@ -0,0 +1,325 @@
+from __future__ import annotations
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable, Optional, Tuple
+
+from .cache import CachedResponse
+
+logger = logging.getLogger("replica.shared")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    meta TEXT NOT NULL,
+    body BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    date REAL NOT NULL,
+    expires REAL NOT NULL,
+    stale_until REAL NOT NULL,
+    accessed REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed);
+CREATE TABLE IF NOT EXISTS leases (
+    key TEXT PRIMARY KEY,
+    owner TEXT NOT NULL,
+    until REAL NOT NULL
+);
+-- Running totals of the entries table, kept by triggers so the byte budget
+-- never needs a scan of the whole table
+CREATE TABLE IF NOT EXISTS totals (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    bytes INTEGER NOT NULL,
+    entries INTEGER NOT NULL
+);
+CREATE TRIGGER IF NOT EXISTS entries_insert AFTER INSERT ON entries BEGIN
+    UPDATE totals SET bytes = bytes + NEW.size, entries = entries + 1;
+END;
+CREATE TRIGGER IF NOT EXISTS entries_delete AFTER DELETE ON entries BEGIN
+    UPDATE totals SET bytes = bytes - OLD.size, entries = entries - 1;
+END;
+CREATE TRIGGER IF NOT EXISTS entries_resize AFTER UPDATE OF size ON entries BEGIN
+    UPDATE totals SET bytes = bytes + NEW.size - OLD.size;
+END;
+INSERT OR IGNORE INTO totals (id, bytes, entries) SELECT 0, COALESCE(SUM(size), 0), COUNT(*) FROM entries;
+"""
+
+# Hits refresh an entry's LRU position at most this often (seconds), so reads
+# rarely need the write lock
+_ACCESS_RESOLUTION = 10.0
+# Least recently used entries are evicted this many at a time
+_EVICT_BATCH = 64
+
+
+class SharedCache:
+    """Cache shared by every worker process on a host, in an SQLite file.
+
+    Entries are ``CachedResponse`` values with wall-clock deadlines (so they
+    mean the same to every process); the least recently used ones are evicted
+    past ``max_bytes`` (0 disables the limit). Database errors (e.g. a lock
+    held too long by another process) count as misses rather than failing
+    requests.
+
+    ``lease``/``release`` coalesce misses across processes: only the process
+    holding the lease on a key fetches it, the others ``wait`` for the lease
+    to be released and then find the entry here.
+
+    The methods block on the database; from the event loop, ``run`` them on
+    (or ``submit`` writes nobody waits for to) the cache's own thread. Calls
+    run one at a time in order, so e.g. a write submitted before a
+    ``release`` is visible to the processes the release wakes up.
+    """
+
+    def __init__(self, path: str, max_bytes: int = 0, busy_timeout: float = 0.2) -> None:
+        self.path = path
+        self.max_bytes = max_bytes
+        self.busy_timeout = busy_timeout
+        # Identifies this process' leases
+        self.owner = f"{os.getpid()}-{uuid.uuid4().hex}"
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._conn: Optional[sqlite3.Connection] = None
+        self._pid = 0
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._executor_pid = 0
+        # Totals as of the last call that changed them (or the connection), so
+        # metrics scrapes never query the database from the event loop
+        self._bytes = 0
+        self._entries = 0
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+    def _db(self) -> sqlite3.Connection:
+        # Connections must not be shared with forked children. Within a process
+        # the event loop may run in different threads (e.g. under a test client).
+        if self._conn is None or self._pid != os.getpid():
+            conn = sqlite3.connect(
+                self.path, timeout=self.busy_timeout, isolation_level=None, check_same_thread=False
+            )
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(_SCHEMA)
+            self._read_totals(conn)
+            self._conn = conn
+            self._pid = os.getpid()
+            self.owner = f"{self._pid}-{uuid.uuid4().hex}"
+        return self._conn
+
+    def _pool(self) -> ThreadPoolExecutor:
+        # Threads do not survive a fork either
+        if self._executor is None or self._executor_pid != os.getpid():
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="replica-shared")
+            self._executor_pid = os.getpid()
+        return self._executor
+
+    async def run(self, method: Callable[..., Any], *args: Any) -> Any:
+        """Await ``method(*args)`` (one of this cache's methods) on the cache's thread."""
+        return await asyncio.get_running_loop().run_in_executor(self._pool(), partial(method, *args))
+
+    def submit(self, method: Callable[..., Any], *args: Any) -> None:
+        """Queue ``method(*args)`` on the cache's thread without waiting for it."""
+        self._pool().submit(method, *args)
+
+    def lookup(self, key: str, keep_expired: bool = False) -> Optional[Tuple[CachedResponse, float, float, float]]:
+        """Return ``(value, staleness, ttl, grace)`` for ``key``, fresh or within grace.
+
+        ``ttl`` is negative once stale. With ``keep_expired``, entries past
+        their grace period that were not swept yet are returned too.
+        """
+        try:
+            db = self._db()
+            row = db.execute(
+                "SELECT meta, body, date, expires, stale_until, accessed FROM entries WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            meta, body, date, expires, stale_until, accessed = row
+            now = time.time()
+            if now > stale_until and not keep_expired:
+                self.misses += 1
+                return None
+            if now - accessed > _ACCESS_RESOLUTION:
+                db.execute("UPDATE entries SET accessed = ? WHERE key = ?", (now, key))
+        except sqlite3.Error as exc:
+            logger.debug("Shared cache lookup of %s failed: %s", key, exc)
+            self.misses += 1
+            return None
+        data = json.loads(meta)
+        data["date"], data["expires"] = date, expires
+        bodies, offset = [], 0
+        body = memoryview(body)
+        for size in data["sizes"]:
+            bodies.append(bytes(body[offset : offset + size]))
+            offset += size
+        self.hits += 1
+        return CachedResponse.from_dict(data, bodies), max(0.0, now - expires), expires - now, stale_until - expires
+
+    def put(self, key: str, value: CachedResponse, ttl: float, grace: float = 0) -> None:
+        now = time.time()
+        bodies = value.bodies()
+        size = sum(len(body) for body in bodies)
+        if self.max_bytes and size > self.max_bytes:
+            return
+        data = value.to_dict()
+        del data["date"], data["expires"]
+        try:
+            db = self._db()
+            db.execute(
+                "INSERT INTO entries (key, meta, body, size, date, expires, stale_until, accessed)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT (key) DO UPDATE SET"
+                " meta = excluded.meta, body = excluded.body, size = excluded.size, date = excluded.date,"
+                " expires = excluded.expires, stale_until = excluded.stale_until, accessed = excluded.accessed",
+                (
+                    key,
+                    json.dumps(data, separators=(",", ":")),
+                    b"".join(bodies),
+                    size,
+                    value.date,
+                    now + ttl,
+                    now + ttl + max(grace, 0),
+                    now,
+                ),
+            )
+            if self.max_bytes:
+                self._evict(db)
+            self._read_totals(db)
+        except sqlite3.Error as exc:
+            logger.debug("Shared cache store of %s failed: %s", key, exc)
+
+    def _read_totals(self, db: sqlite3.Connection) -> None:
+        self._bytes, self._entries = db.execute("SELECT bytes, entries FROM totals").fetchone()
+
+    def _evict(self, db: sqlite3.Connection) -> None:
+        total = db.execute("SELECT bytes FROM totals").fetchone()[0]
+        while total > self.max_bytes:
+            rows = db.execute("SELECT key, size FROM entries ORDER BY accessed LIMIT ?", (_EVICT_BATCH,)).fetchall()
+            if not rows:
+                break
+            for key, size in rows:
+                db.execute("DELETE FROM entries WHERE key = ?", (key,))
+                self.evictions += 1
+                total -= size
+                if total <= self.max_bytes:
+                    break
+
+    def touch(self, key: str, ttl: float, grace: float = 0, date: Optional[float] = None) -> bool:
+        """Give an existing entry a fresh TTL (e.g. after revalidation)."""
+        now = time.time()
+        try:
+            cursor = self._db().execute(
+                "UPDATE entries SET date = COALESCE(?, date), expires = ?, stale_until = ?, accessed = ? WHERE key = ?",
+                (date, now + ttl, now + ttl + max(grace, 0), now, key),
+            )
+        except sqlite3.Error as exc:
+            logger.debug("Shared cache touch of %s failed: %s", key, exc)
+            return False
+        return cursor.rowcount > 0
+
+    def delete(self, key: str) -> None:
+        try:
+            db = self._db()
+            db.execute("DELETE FROM entries WHERE key = ?", (key,))
+            self._read_totals(db)
+        except sqlite3.Error as exc:
+            logger.debug("Shared cache delete of %s failed: %s", key, exc)
+
+    def lease(self, key: str, timeout: float) -> bool:
+        """Try to become the process fetching ``key`` for up to ``timeout`` seconds.
+
+        Leases left behind by a process that died (or stalled) past their
+        timeout are taken over.
+        """
+        now = time.time()
+        try:
+            cursor = self._db().execute(
+                "INSERT INTO leases (key, owner, until) VALUES (?, ?, ?)"
+                " ON CONFLICT (key) DO UPDATE SET owner = excluded.owner, until = excluded.until"
+                " WHERE leases.until < ? OR leases.owner = excluded.owner",
+                (key, self.owner, now + timeout, now),
+            )
+        except sqlite3.Error as exc:
+            # Without the database, fetch rather than wait
+            logger.debug("Shared cache lease of %s failed: %s", key, exc)
+            return True
+        return cursor.rowcount > 0
+
+    def release(self, key: str) -> None:
+        try:
+            self._db().execute("DELETE FROM leases WHERE key = ? AND owner = ?", (key, self.owner))
+        except sqlite3.Error as exc:
+            logger.debug("Shared cache release of %s failed: %s", key, exc)
+
+    def leased(self, key: str) -> bool:
+        """Whether another process currently holds the lease on ``key``."""
+        try:
+            row = self._db().execute("SELECT owner, until FROM leases WHERE key = ?", (key,)).fetchone()
+        except sqlite3.Error:
+            return False
+        return row is not None and row[0] != self.owner and row[1] >= time.time()
+
+    async def wait(self, key: str, timeout: float, interval: float = 0.025) -> bool:
+        """Wait for another process' lease on ``key`` to end; False on timeout."""
+        deadline = time.monotonic() + timeout
+        while await self.run(self.leased, key):
+            if time.monotonic() >= deadline:
+                return False
+            await asyncio.sleep(interval)
+        return True
+
+    def sweep(self) -> int:
+        """Drop entries past their grace period and abandoned leases."""
+        now = time.time()
+        try:
+            db = self._db()
+            removed = db.execute("DELETE FROM entries WHERE stale_until < ?", (now,)).rowcount
+            db.execute("DELETE FROM leases WHERE until < ?", (now,))
+            # Also picks up what the other processes stored
+            self._read_totals(db)
+        except sqlite3.Error as exc:
+            logger.debug("Shared cache sweep failed: %s", exc)
+            return 0
+        self.expirations += removed
+        return removed
+
+    async def run_sweeper(self, interval: float, paused: Optional[Callable[[], bool]] = None) -> None:
+        """Periodically sweep expired entries until cancelled (skipped while ``paused()``)."""
+        while True:
+            await asyncio.sleep(interval)
+            if paused is not None and paused():
+                continue
+            removed = await self.run(self.sweep)
+            if removed:
+                logger.debug("Swept %d expired shared cache entries", removed)
+
+    @property
+    def current_bytes(self) -> int:
+        """Bytes stored by every process, as of the last write or sweep here."""
+        return self._bytes
+
+    def close(self) -> None:
+        """Finish the queued calls and close the database."""
+        if self._executor is not None and self._executor_pid == os.getpid():
+            self._executor.shutdown(wait=True)
+        self._executor = None
+        if self._conn is not None and self._pid == os.getpid():
+            self._conn.close()
+        self._conn = None
+
+    def __len__(self) -> int:
+        """Entries stored by every process, as of the last write or sweep here."""
+        return self._entries
+
+    def __contains__(self, key: object) -> bool:
+        try:
+            return self._db().execute("SELECT 1 FROM entries WHERE key = ?", (key,)).fetchone() is not None
+        except sqlite3.Error:
+            return False
@@ -0,0 +1,175 @@
+from __future__ import annotations
+import asyncio
+import json
+import logging
+import os
+import struct
+import tempfile
+import time
+from typing import Any, Iterable, Iterator, List, Mapping, Tuple
+
+from .cache import Cache, CachedResponse
+from .cachekey import VaryIndex
+
+logger = logging.getLogger("replica.snapshot")
+
+# File layout: a header (magic, format version) followed by records, each a
+# length-prefixed JSON description and the bodies it lists, back to back.
+# Records are read one at a time, so a snapshot never has to fit in memory.
+SNAPSHOT_VERSION = 1
+_MAGIC = b"RPLCSNAP"
+_HEADER = struct.Struct(">8sH")
+_RECORD = struct.Struct(">IQ")  # metadata length, total body length
+
+# Record kind of the Vary index (other records name the cache they belong to)
+_VARY = "vary"
+
+# ``(cache name, key, value, ttl, grace)``; for Vary records the value is the
+# tuple of header names and ttl/grace are 0.
+SnapshotRecord = Tuple[str, str, Any, float, float]
+
+
+class SnapshotError(ValueError):
+    """The file is not a cache snapshot this version can read."""
+
+
+def write_snapshot(path: str, records: Iterable[SnapshotRecord]) -> int:
+    """Write ``records`` to ``path`` (atomically) and return how many were written."""
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix=".snapshot-")
+    written = 0
+    try:
+        with os.fdopen(fd, "wb") as fh:
+            fh.write(_HEADER.pack(_MAGIC, SNAPSHOT_VERSION))
+            now = time.time()
+            for name, key, value, ttl, grace in records:
+                if name == _VARY:
+                    meta = {"cache": name, "key": key, "names": list(value)}
+                    bodies: List[bytes] = []
+                else:
+                    bodies = value.bodies()
+                    meta = value.to_dict()
+                    meta.update(
+                        cache=name,
+                        key=key,
+                        # Wall clock: monotonic deadlines do not survive a restart
+                        fresh_until=now + ttl,
+                        stale_until=now + ttl + grace,
+                    )
+                encoded = json.dumps(meta, separators=(",", ":")).encode("utf-8")
+                fh.write(_RECORD.pack(len(encoded), sum(len(body) for body in bodies)))
+                fh.write(encoded)
+                for body in bodies:
+                    fh.write(body)
+                written += 1
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+    return written
+
+
+def read_snapshot(path: str) -> Iterator[SnapshotRecord]:
+    """Yield the records of a snapshot, skipping entries past their grace period.
+
+    Bodies of skipped entries are seeked over rather than read. A truncated
+    file ends the iteration at the last complete record.
+    """
+    with open(path, "rb") as fh:
+        header = fh.read(_HEADER.size)
+        if len(header) < _HEADER.size:
+            raise SnapshotError("truncated snapshot header")
+        magic, version = _HEADER.unpack(header)
+        if magic != _MAGIC:
+            raise SnapshotError("not a cache snapshot")
+        if version != SNAPSHOT_VERSION:
+            raise SnapshotError(f"unsupported snapshot version {version}")
+        now = time.time()
+        while True:
+            head = fh.read(_RECORD.size)
+            if len(head) < _RECORD.size:
+                return
+            meta_size, body_size = _RECORD.unpack(head)
+            encoded = fh.read(meta_size)
+            if len(encoded) < meta_size:
+                return
+            meta = json.loads(encoded)
+            if meta["cache"] == _VARY:
+                yield _VARY, meta["key"], tuple(meta["names"]), 0.0, 0.0
+                continue
+            if meta["stale_until"] <= now:
+                fh.seek(body_size, os.SEEK_CUR)
+                continue
+            bodies = [fh.read(size) for size in meta["sizes"]]
+            if sum(len(body) for body in bodies) < body_size:
+                return
+            value = CachedResponse.from_dict(meta, bodies)
+            ttl = meta["fresh_until"] - now
+            yield meta["cache"], meta["key"], value, ttl, meta["stale_until"] - meta["fresh_until"]
+
+
+def snapshot_records(caches: Mapping[str, Cache], vary: VaryIndex) -> List[SnapshotRecord]:
+    """Collect the live entries of ``caches`` (least recently used first) and
+    the Vary index, to be written outside the event loop."""
+    records: List[SnapshotRecord] = [(_VARY, key, names, 0.0, 0.0) for key, names in vary.items()]
+    for name, cache in caches.items():
+        records.extend(
+            (name, key, value, ttl, grace)
+            for key, value, ttl, grace in cache.entries()
+            if isinstance(value, CachedResponse)
+        )
+    return records
+
+
+async def save_snapshot(path: str, caches: Mapping[str, Cache], vary: VaryIndex) -> int:
+    """Write a snapshot of ``caches`` without blocking the event loop."""
+    return await asyncio.to_thread(write_snapshot, path, snapshot_records(caches, vary))
+
+
+def _take(records: Iterator[SnapshotRecord], count: int) -> List[SnapshotRecord]:
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) >= count:
+            break
+    return batch
+
+
+async def load_snapshot(path: str, caches: Mapping[str, Cache], vary: VaryIndex, batch: int = 256) -> int:
+    """Fill ``caches`` from a snapshot, reading it in a worker thread.
+
+    Entries cached meanwhile (by requests served while loading) are kept.
+    Returns the number of entries restored.
+    """
+    records = read_snapshot(path)
+    loaded = 0
+    while True:
+        chunk = await asyncio.to_thread(_take, records, batch)
+        if not chunk:
+            return loaded
+        for name, key, value, ttl, grace in chunk:
+            if name == _VARY:
+                if not vary.get(key):
+                    vary.set(key, value)
+                continue
+            cache = caches.get(name)
+            if cache is None or key in cache:
+                continue
+            cache.put(key, value, ttl, grace)
+            loaded += 1
+
+
+async def run_snapshots(path: str, interval: float, caches: Mapping[str, Cache], vary: VaryIndex) -> None:
+    """Write a snapshot every ``interval`` seconds until cancelled."""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            written = await save_snapshot(path, caches, vary)
+        except Exception as exc:
+            logger.warning("Cache snapshot to %s failed: %s", path, exc)
+            continue
+        logger.debug("Cache snapshot: %d records written to %s", written, path)
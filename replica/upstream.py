@@ -0,0 +1,326 @@
+from __future__ import annotations
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import httpx
+
+logger = logging.getLogger("replica.upstream")
+
+# Impersonation profiles selected by proxy_request from the incoming User-Agent.
+PROFILES = ("chrome", "firefox")
+
+
+class ClientPool:
+    """Long-lived upstream clients keyed by impersonation profile.
+
+    Each profile gets a single ``httpx.AsyncClient`` that is reused for every
+    request so connections (and TLS sessions) to the origin are kept alive.
+    Clients are created lazily on first use, or eagerly with ``start``.
+    """
+
+    def __init__(self, factory: Callable[[str], httpx.AsyncClient]) -> None:
+        self._factory = factory
+        self._clients: Dict[str, httpx.AsyncClient] = {}
+
+    def get(self, impersonate: str) -> httpx.AsyncClient:
+        client = self._clients.get(impersonate)
+        if client is None or client.is_closed:
+            client = self._factory(impersonate)
+            self._clients[impersonate] = client
+        return client
+
+    def start(self, profiles: Iterable[str] = PROFILES) -> None:
+        for profile in profiles:
+            self.get(profile)
+
+    async def aclose(self) -> None:
+        clients = list(self._clients.values())
+        self._clients.clear()
+        for client in clients:
+            try:
+                await client.aclose()
+            except Exception as exc:  # pragma: no cover - best effort on shutdown
+                logger.warning("Failed to close upstream client: %s", exc)
+
+    def __len__(self) -> int:
+        return len(self._clients)
+
+
+class Overloaded(Exception):
+    """Raised by ``UpstreamLimiter.acquire`` when a request is shed."""
+
+
+class UpstreamLimiter:
+    """Bound the number of in-flight upstream requests.
+
+    At most ``max_active`` requests run at once overall and at most
+    ``max_per_profile`` per impersonation profile (0 = unlimited). Requests
+    over the limit wait in a FIFO queue of ``max_queue`` entries for up to
+    ``queue_timeout`` seconds; when the queue is full or the wait times out,
+    ``acquire`` raises ``Overloaded`` so the caller can shed the request.
+    Every successful ``acquire`` must be paired with a ``release``.
+    """
+
+    def __init__(self, max_active: int = 0, max_per_profile: int = 0, max_queue: int = 0, queue_timeout: float = 0) -> None:
+        self.max_active = max_active
+        self.max_per_profile = max_per_profile
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self.active_by_profile: Dict[str, int] = {}
+        self._waiters: "deque[Tuple[str, asyncio.Future]]" = deque()
+        self.queued = 0
+        self.shed_queue_full = 0
+        self.shed_timeout = 0
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._waiters)
+
+    def _can_admit(self, profile: str) -> bool:
+        if self.max_active and self.active >= self.max_active:
+            return False
+        return not self.max_per_profile or self.active_by_profile.get(profile, 0) < self.max_per_profile
+
+    def _admit(self, profile: str) -> None:
+        self.active += 1
+        self.active_by_profile[profile] = self.active_by_profile.get(profile, 0) + 1
+
+    async def acquire(self, profile: str) -> None:
+        # Waiters are admitted on release, so those still queued are blocked
+        # and a request that fits now does not overtake an admissible one.
+        if self._can_admit(profile):
+            self._admit(profile)
+            return
+        if len(self._waiters) >= self.max_queue:
+            self.shed_queue_full += 1
+            raise Overloaded("upstream queue is full")
+
+        waiter = (profile, asyncio.get_running_loop().create_future())
+        self._waiters.append(waiter)
+        self.queued += 1
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter[1]), self.queue_timeout or None)
+        except asyncio.TimeoutError:
+            if waiter[1].done():
+                return  # admitted just as the wait timed out
+            self._waiters.remove(waiter)
+            self.shed_timeout += 1
+            raise Overloaded("timed out waiting for an upstream slot") from None
+        except asyncio.CancelledError:
+            if waiter[1].done():
+                self.release(profile)
+            else:
+                self._waiters.remove(waiter)
+            raise
+
+    def release(self, profile: str) -> None:
+        self.active -= 1
+        self.active_by_profile[profile] = self.active_by_profile.get(profile, 1) - 1
+        # Hand freed slots to the oldest waiters that fit
+        for waiter in list(self._waiters):
+            if not self._can_admit(waiter[0]):
+                if self.max_active and self.active >= self.max_active:
+                    break
+                continue
+            self._waiters.remove(waiter)
+            if not waiter[1].done():
+                self._admit(waiter[0])
+                waiter[1].set_result(None)
+
+
+class _ReleasingStream(httpx.AsyncByteStream):
+    """Response stream that releases an upstream slot once closed."""
+
+    def __init__(
+        self,
+        stream: httpx.AsyncByteStream,
+        release: Callable[[], None],
+        outcome: Optional[Callable[[Optional[bool]], None]] = None,
+    ) -> None:
+        self._stream = stream
+        self._release: Optional[Callable[[], None]] = release
+        self._outcome = outcome
+        # True before and after reading the whole body, None while it is being
+        # read (or when left part way through), False once reading failed
+        self._success: Optional[bool] = True
+
+    async def __aiter__(self):
+        self._success = None
+        try:
+            async for chunk in self._stream:
+                yield chunk
+        except Exception:
+            self._success = False
+            raise
+        self._success = True
+
+    async def aclose(self) -> None:
+        try:
+            await self._stream.aclose()
+        finally:
+            release, self._release = self._release, None
+            if release is not None:
+                release()
+                if self._outcome is not None:
+                    self._outcome(self._success)
+
+
+def release_on_close(
+    response: httpx.Response,
+    release: Callable[[], None],
+    outcome: Optional[Callable[[Optional[bool]], None]] = None,
+) -> None:
+    """Call ``release`` once ``response`` is closed (however it is closed).
+
+    ``outcome`` is then called with how reading the body went: ``True`` when
+    it was read to the end (or not at all), ``False`` when reading it failed
+    and ``None`` when it was closed part way through.
+    """
+    response.stream = _ReleasingStream(response.stream, release, outcome)
+
+
+class CircuitBreaker:
+    """Stop sending requests to an origin that keeps failing.
+
+    Outcomes are counted in one-second buckets over the last ``window``
+    seconds. Once at least ``min_requests`` were seen and the share of
+    failures (errors, timeouts, 5xx) reaches ``failure_rate``, the breaker
+    opens: ``allow`` refuses requests for ``open_seconds``. It then turns
+    half-open and lets ``half_open_probes`` requests through; the first
+    result closes it again (success) or re-opens it (failure). Every request
+    ``allow`` lets through must end with ``record`` or ``abandon``. A
+    ``failure_rate`` of 0 disables the breaker.
+
+    ``generation`` changes with every state change; passing the value read
+    right after ``allow`` to ``record``/``abandon`` makes late results of
+    requests let through in an earlier state (e.g. before it opened) ignored.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(
+        self,
+        failure_rate: float = 0.5,
+        min_requests: int = 20,
+        window: float = 30.0,
+        open_seconds: float = 15.0,
+        half_open_probes: int = 1,
+    ) -> None:
+        self.failure_rate = failure_rate
+        self.min_requests = min_requests
+        self.window = window
+        self.open_seconds = open_seconds
+        self.half_open_probes = half_open_probes
+        self._state = self.CLOSED
+        self._opened_at = 0.0
+        self._probes = 0
+        self._generation = 0
+        # [second, requests, failures] per second of the window
+        self._buckets: "deque[List[int]]" = deque()
+        self._requests = 0
+        self._failures = 0
+        self.opened = 0
+        self.rejected = 0
+
+    def _advance(self) -> None:
+        if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.open_seconds:
+            self._state = self.HALF_OPEN
+            self._probes = 0
+            self._generation += 1
+
+    @property
+    def state(self) -> str:
+        self._advance()
+        return self._state
+
+    @property
+    def generation(self) -> int:
+        self._advance()
+        return self._generation
+
+    @property
+    def is_open(self) -> bool:
+        """True while the origin is considered unhealthy (open or half-open)."""
+        return self.state != self.CLOSED
+
+    def retry_after(self) -> float:
+        """Seconds until the breaker lets a probe through."""
+        return max(0.0, self._opened_at + self.open_seconds - time.monotonic())
+
+    def allow(self) -> bool:
+        if not self.failure_rate:
+            return True
+        state = self.state
+        if state == self.CLOSED:
+            return True
+        if state == self.HALF_OPEN and self._probes < self.half_open_probes:
+            self._probes += 1
+            return True
+        self.rejected += 1
+        return False
+
+    def abandon(self, generation: Optional[int] = None) -> None:
+        """A request let through by ``allow`` ended without an outcome (e.g.
+        it was cancelled): hand its half-open probe back without counting it."""
+        if not self.failure_rate or self._stale(generation):
+            return
+        if self.state == self.HALF_OPEN and self._probes > 0:
+            self._probes -= 1
+
+    def record(self, success: bool, generation: Optional[int] = None) -> None:
+        if not self.failure_rate or self._stale(generation):
+            return
+        state = self.state
+        if state == self.HALF_OPEN:
+            if success:
+                self._close()
+            else:
+                self._open()
+            return
+        if state == self.OPEN:
+            return  # result of a request sent before the breaker opened
+
+        now = time.monotonic()
+        second = int(now)
+        while self._buckets and self._buckets[0][0] <= now - self.window:
+            _, requests, failures = self._buckets.popleft()
+            self._requests -= requests
+            self._failures -= failures
+        if not self._buckets or self._buckets[-1][0] != second:
+            self._buckets.append([second, 0, 0])
+        bucket = self._buckets[-1]
+        bucket[1] += 1
+        self._requests += 1
+        if not success:
+            bucket[2] += 1
+            self._failures += 1
+            if self._requests >= self.min_requests and self._failures >= self.failure_rate * self._requests:
+                self._open()
+
+    def _stale(self, generation: Optional[int]) -> bool:
+        return generation is not None and generation != self.generation
+
+    def _open(self) -> None:
+        if self._state != self.OPEN:
+            self.opened += 1
+            logger.warning("Upstream circuit breaker opened for %ss", self.open_seconds)
+        self._state = self.OPEN
+        self._opened_at = time.monotonic()
+        self._generation += 1
+        self._reset_window()
+
+    def _close(self) -> None:
+        logger.info("Upstream circuit breaker closed")
+        self._state = self.CLOSED
+        self._generation += 1
+        self._reset_window()
+
+    def _reset_window(self) -> None:
+        self._buckets.clear()
+        self._requests = self._failures = 0
@@ -1,23 +1,22 @@
 from __future__ import annotations
+import hashlib
 import re
-from typing import Dict, Iterable, List
+from email.utils import parsedate_to_datetime
+from functools import lru_cache
+from typing import Dict, Iterable, List, Mapping
 from urllib.parse import urlparse
 
+from .rewrite import Rewriter, get_rewriter
+
 
 def escape_regex(s: str) -> str:
     return re.escape(s)
 
 
 def perform_text_replacements(text: str, replacements: Dict[str, str], incoming_host: str) -> str:
-    result = text
-    for from_str, to_str in replacements.items():
-        if not from_str or to_str is None:
-            continue
-        if to_str == "MY_HOST":
-            to_str = incoming_host
-        pat = re.compile(escape_regex(from_str), re.IGNORECASE)
-        result = pat.sub(to_str, result)
-    return result
+    # All rules are applied in a single pass (longest match first); the
+    # compiled rewriter is memoized per distinct rule set.
+    return get_rewriter(replacements, incoming_host).rewrite(text)
 
 
 def is_static_file(path: str, static_extensions: List[str]) -> bool:
@@ -25,64 +24,133 @@ def is_static_file(path: str, static_extensions: List[str]) -> bool:
     return any(parsed_path.lower().endswith(ext) for ext in static_extensions)
 
 
+# Headers never forwarded upstream / passed back to clients, as one matcher each
+_REQUEST_DROP_RE = re.compile(r"^(?:cf-|cdn-loop$|x-forwarded-|x-real-ip$|via$|x-amzn-|x-request-id$)", re.IGNORECASE)
+_RESPONSE_DROP_RE = re.compile(r"^(?:cf-|cdn-loop$|x-forwarded-|via$)", re.IGNORECASE)
+# Response headers that break proxies (or no longer describe the body)
+_RESPONSE_STRIP_HEADERS = (
+    "content-security-policy",
+    "content-security-policy-report-only",
+    "clear-site-data",
+    "content-length",
+    "transfer-encoding",
+    "content-encoding",
+)
+
+# Cloudflare cookies that are neither forwarded upstream nor passed to clients
+_CF_COOKIE_RE = re.compile(r"(?:__cf_bm|_cfuvid|cf_clearance)=")
+# Split a folded Set-Cookie value on ", " only when followed by a cookie name
+# pattern (word=). This avoids splitting on commas within expires dates like
+# "Tue, 30-Dec-25".
+_SET_COOKIE_SPLIT_RE = re.compile(r",\s+(?=[^=\s]+=)")
+
+
+def filter_cookies(value: str, set_cookie: bool = False) -> str:
+    """Drop Cloudflare cookies from a Cookie (or folded Set-Cookie) value."""
+    if set_cookie:
+        cookies = _SET_COOKIE_SPLIT_RE.split(value)
+        sep = ", "
+    else:
+        cookies = value.split("; ")
+        sep = "; "
+    return sep.join(c for c in cookies if not _CF_COOKIE_RE.match(c))
+
+
+class HeaderRewriter:
+    """Drop headers and map an origin/host pair in header values.
+
+    Everything is compiled once: the drop matcher is a single regex and the
+    origin/host mapping is a single-pass ``Rewriter`` (origin first, as it is
+    the longer pattern).
+    """
+
+    __slots__ = ("_drop", "_values", "_strip", "_cookie_domain")
+
+    def __init__(
+        self,
+        drop: re.Pattern[str],
+        from_origin: str,
+        to_origin: str,
+        from_host: str,
+        to_host: str,
+        strip: Iterable[str] = (),
+        rewrite_cookie_domain: bool = False,
+    ) -> None:
+        self._drop = drop
+        self._values = Rewriter({from_origin: to_origin, from_host: to_host})
+        self._strip = tuple(strip)
+        self._cookie_domain = None
+        if rewrite_cookie_domain:
+            self._cookie_domain = (re.compile(f"Domain={escape_regex(from_host)}", re.IGNORECASE), f"Domain={to_host}")
+
+    def apply(self, headers: Mapping[str, str]) -> Dict[str, str]:
+        sanitized: Dict[str, str] = {}
+        for name, value in headers.items():
+            if self._drop.match(name):
+                continue
+            if isinstance(value, str):
+                value = self._values.rewrite(value)
+                if self._cookie_domain is not None and "Domain=" in value and name.lower() == "set-cookie":
+                    pattern, replacement = self._cookie_domain
+                    value = pattern.sub(replacement, value)
+            sanitized[name] = value
+        for name in self._strip:
+            sanitized.pop(name, None)
+        return sanitized
+
+
+@lru_cache(maxsize=128)
+def request_header_rewriter(my_origin: str, my_host: str, target_origin: str) -> HeaderRewriter:
+    target_host = target_origin.split("//")[-1].split("/")[0]
+    return HeaderRewriter(_REQUEST_DROP_RE, my_origin, target_origin, my_host, target_host)
+
+
+@lru_cache(maxsize=128)
+def response_header_rewriter(target_origin: str, target_host: str, my_origin: str, my_host: str) -> HeaderRewriter:
+    return HeaderRewriter(
+        _RESPONSE_DROP_RE, target_origin, my_origin, target_host, my_host, _RESPONSE_STRIP_HEADERS, rewrite_cookie_domain=True
+    )
+
+
 def sanitize_request_headers(headers: Dict[str, str], my_origin: str, my_host: str, target_origin: str) -> Dict[str, str]:
-    remove_patterns = [
-        re.compile(r"^cf-", re.IGNORECASE),
-        re.compile(r"^cdn-loop$", re.IGNORECASE),
-        re.compile(r"^x-forwarded-", re.IGNORECASE),
-        re.compile(r"^x-real-ip$", re.IGNORECASE),
-        re.compile(r"^via$", re.IGNORECASE),
-        re.compile(r"^x-amzn-", re.IGNORECASE),
-        re.compile(r"^x-request-id$", re.IGNORECASE),
-    ]
-
-    sanitized: Dict[str, str] = {}
-
-    my_origin_re = re.compile(escape_regex(my_origin), re.IGNORECASE)
-    my_host_re = re.compile(escape_regex(my_host), re.IGNORECASE)
-
-    for name, value in headers.items():
-        if any(p.match(name) for p in remove_patterns):
-            continue
-        if isinstance(value, str):
-            value = my_origin_re.sub(target_origin, value)
-            value = my_host_re.sub(target_origin.split("//")[-1].split("/")[0], value)
-        sanitized[name] = value
-    return sanitized
+    return request_header_rewriter(my_origin, my_host, target_origin).apply(headers)
 
 
 def sanitize_response_headers(headers: Dict[str, str], target_origin: str, target_host: str, my_origin: str, my_host: str) -> Dict[str, str]:
-    remove_patterns = [
-        re.compile(r"^cf-", re.IGNORECASE),
-        re.compile(r"^cdn-loop$", re.IGNORECASE),
-        re.compile(r"^x-forwarded-", re.IGNORECASE),
-        re.compile(r"^cf-ray$", re.IGNORECASE),
-        re.compile(r"^cf-visitor$", re.IGNORECASE),
-        re.compile(r"^cf-cache-status$", re.IGNORECASE),
-        re.compile(r"^via$", re.IGNORECASE),
-    ]
-
-    sanitized: Dict[str, str] = {}
-
-    target_origin_re = re.compile(escape_regex(target_origin), re.IGNORECASE)
-    target_host_re = re.compile(escape_regex(target_host), re.IGNORECASE)
-
-    for name, value in headers.items():
-        if any(p.match(name) for p in remove_patterns):
-            continue
-        if isinstance(value, str):
-            value = target_origin_re.sub(my_origin, value)
-            value = target_host_re.sub(my_host, value)
-            if name.lower() == "set-cookie" and "Domain=" in value:
-                value = re.sub(f"Domain={escape_regex(target_host)}", f"Domain={my_host}", value, flags=re.IGNORECASE)
-        sanitized[name] = value
-
-    # Remove or adjust headers that break proxies
-    sanitized.pop("content-security-policy", None)
-    sanitized.pop("content-security-policy-report-only", None)
-    sanitized.pop("clear-site-data", None)
-    sanitized.pop("content-length", None)
-    sanitized.pop("transfer-encoding", None)
-    sanitized.pop("content-encoding", None)
-
-    return sanitized
+    return response_header_rewriter(target_origin, target_host, my_origin, my_host).apply(headers)
+
+
+def compute_etag(body: bytes) -> str:
+    """Return a strong validator for ``body`` (stable across processes)."""
+    return '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+
+
+def _strip_weak(tag: str) -> str:
+    tag = tag.strip()
+    return tag[2:] if tag.startswith("W/") else tag
+
+
+def is_not_modified(request_headers: Mapping[str, str], response_headers: Mapping[str, str]) -> bool:
+    """Evaluate If-None-Match / If-Modified-Since against response validators.
+
+    If-None-Match takes precedence and uses weak comparison; If-Modified-Since
+    is only consulted when If-None-Match is absent.
+    """
+    if_none_match = request_headers.get("if-none-match")
+    if if_none_match:
+        etag = response_headers.get("etag")
+        if not etag:
+            return False
+        if if_none_match.strip() == "*":
+            return True
+        etag = _strip_weak(etag)
+        return any(_strip_weak(tag) == etag for tag in if_none_match.split(","))
+
+    if_modified_since = request_headers.get("if-modified-since")
+    last_modified = response_headers.get("last-modified")
+    if if_modified_since and last_modified:
+        try:
+            return parsedate_to_datetime(last_modified) <= parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+    return False
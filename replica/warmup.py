@@ -0,0 +1,115 @@
+from __future__ import annotations
+import asyncio
+import gzip
+import logging
+import xml.etree.ElementTree as ET
+from typing import List, Optional, Tuple
+from urllib.parse import urlparse
+
+import httpx
+
+from .config import settings
+
+logger = logging.getLogger("replica.warmup")
+
+
+def parse_sitemap(data: bytes) -> Tuple[List[str], List[str]]:
+    """Return ``(page_urls, sitemap_urls)`` listed by a sitemap or sitemap index."""
+    if data[:2] == b"\x1f\x8b":
+        data = gzip.decompress(data)
+    try:
+        root = ET.fromstring(data)
+    except ET.ParseError as exc:
+        logger.warning("Ignoring unparsable sitemap: %s", exc)
+        return [], []
+    pages: List[str] = []
+    sitemaps: List[str] = []
+    for element in root:
+        loc = next((child.text for child in element if child.tag.rsplit("}", 1)[-1] == "loc"), None)
+        if not loc or not loc.strip():
+            continue
+        kind = element.tag.rsplit("}", 1)[-1]
+        (sitemaps if kind == "sitemap" else pages).append(loc.strip())
+    return pages, sitemaps
+
+
+def _local_path(url: str, hosts: Tuple[str, ...]) -> Optional[str]:
+    """Return the path (and query) of ``url`` if it is served by this proxy."""
+    parsed = urlparse(url)
+    if parsed.netloc and parsed.netloc not in hosts:
+        return None
+    path = parsed.path or "/"
+    return f"{path}?{parsed.query}" if parsed.query else path
+
+
+async def collect_paths(client: httpx.AsyncClient) -> List[str]:
+    """Return the paths to warm: WARMUP_URLS followed by the WARMUP_SITEMAP pages.
+
+    Sitemaps are fetched through the proxy, so their URLs may name the target
+    or the warm-up origin; other hosts are skipped. Sitemap indexes are
+    followed one level deep.
+    """
+    hosts = (settings.target_host, urlparse(str(client.base_url)).netloc)
+    paths: List[str] = []
+    for url in settings.WARMUP_URLS:
+        path = _local_path(url, hosts)
+        if path is not None:
+            paths.append(path)
+
+    sitemaps = [settings.WARMUP_SITEMAP] if settings.WARMUP_SITEMAP else []
+    for _ in range(2):
+        nested: List[str] = []
+        for sitemap in sitemaps:
+            path = _local_path(sitemap, hosts)
+            if path is None:
+                continue
+            try:
+                response = await client.get(path)
+            except httpx.HTTPError as exc:
+                logger.warning("Failed to fetch sitemap %s: %s", path, exc)
+                continue
+            if response.status_code != 200:
+                logger.warning("Failed to fetch sitemap %s: HTTP %d", path, response.status_code)
+                continue
+            pages, more = parse_sitemap(response.content)
+            paths.extend(p for p in (_local_path(page, hosts) for page in pages) if p is not None)
+            nested.extend(more)
+        sitemaps = nested
+
+    # Keep the first occurrence of every path, up to WARMUP_MAX_URLS
+    unique = list(dict.fromkeys(paths))
+    if settings.WARMUP_MAX_URLS:
+        unique = unique[: settings.WARMUP_MAX_URLS]
+    return unique
+
+
+async def warm_up(app) -> Tuple[int, int]:
+    """Request every warm-up path through ``app`` so its caches are filled.
+
+    Requests go through the full proxy (as if made for WARMUP_ORIGIN), with at
+    most WARMUP_CONCURRENCY in flight. Returns ``(warmed, failed)``.
+    """
+    origin = settings.WARMUP_ORIGIN or settings._DEFAULT_ORIGIN
+    transport = httpx.ASGITransport(app=app)
+    warmed = failed = 0
+    async with httpx.AsyncClient(transport=transport, base_url=origin, timeout=settings.UPSTREAM_TIMEOUT) as client:
+        paths = await collect_paths(client)
+        queue = iter(paths)
+
+        async def worker() -> None:
+            nonlocal warmed, failed
+            for path in queue:
+                try:
+                    response = await client.get(path)
+                except Exception as exc:
+                    failed += 1
+                    logger.debug("Warm-up of %s failed: %s", path, exc)
+                    continue
+                if response.status_code < 400:
+                    warmed += 1
+                else:
+                    failed += 1
+
+        workers = max(1, min(settings.WARMUP_CONCURRENCY, len(paths)))
+        await asyncio.gather(*(worker() for _ in range(workers)))
+    return warmed, failed
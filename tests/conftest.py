@@ -16,12 +16,22 @@ from replica.main import app
 import pytest
 import httpx
 import replica.proxy as proxy_module
+from replica.cache import SingleFlight
+from replica.upstream import CircuitBreaker, ClientPool, UpstreamLimiter
 
 @pytest.fixture(autouse=True)
 def use_real_httpx_transport(monkeypatch):
     def _factory(impersonate: str):
         return httpx.AsyncClient(follow_redirects=True, timeout=30.0)
     monkeypatch.setattr(proxy_module, "_create_async_client", _factory)
+    # Fresh pool per test so clients are never shared across event loops
+    monkeypatch.setattr(proxy_module, "_client_pool", ClientPool(_factory))
+    monkeypatch.setattr(proxy_module, "_upload_pool", ClientPool(proxy_module._create_upload_client))
+    # Fresh limiter and circuit breaker so upstream failures in one test do not leak into others
+    monkeypatch.setattr(proxy_module, "_limiter", UpstreamLimiter(max_queue=0))
+    monkeypatch.setattr(proxy_module, "_breaker", CircuitBreaker(failure_rate=0))
+    # Hit-for-pass marks must not leak either
+    monkeypatch.setattr(proxy_module, "_flights", SingleFlight())
     yield
 
 @pytest.fixture
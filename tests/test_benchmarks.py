@@ -0,0 +1,21 @@
+from benchmarks.loadgen import percentile, summarize
+from benchmarks.origin import html_payload
+
+
+def test_percentile_nearest_rank():
+    samples = [float(i) for i in range(1, 101)]
+    assert percentile(samples, 50) == 50.0
+    assert percentile(samples, 99) == 99.0
+    assert percentile([], 99) == 0.0
+    assert percentile([3.0], 50) == 3.0
+
+
+def test_summarize_reports_rates_in_ms():
+    stats = summarize([0.001, 0.002, 0.003, 0.004], errors=1, elapsed=2.0)
+    assert stats == {"requests": 4, "errors": 1, "rps": 2.0, "p50_ms": 2.0, "p99_ms": 4.0}
+
+
+def test_html_payload_has_requested_density():
+    body = html_payload(4096, 3).decode()
+    assert body.count("<div>word") == 4
+    assert len(body) >= 4096
@@ -0,0 +1,172 @@
+import asyncio
+
+from replica.cache import BodyStore, Cache, CachedResponse
+
+
+def _resp(size: int):
+    return (b"x" * size, {"content-type": "text/plain"}, 200)
+
+
+def test_cache_get_put_roundtrip():
+    cache = Cache()
+    cache.put("k", _resp(3), 60)
+    assert cache.get("k") == _resp(3)
+    assert cache.current_bytes == 3
+
+
+def test_cache_evicts_least_recently_used_over_budget():
+    cache = Cache(max_bytes=10)
+    cache.put("a", _resp(4), 60)
+    cache.put("b", _resp(4), 60)
+    # Touch "a" so "b" becomes the least recently used entry
+    assert cache.get("a") is not None
+    cache.put("c", _resp(4), 60)
+
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+    assert cache.get("c") is not None
+    assert cache.current_bytes == 8
+    assert cache.evictions == 1
+
+
+def test_cache_rejects_objects_larger_than_budget():
+    cache = Cache(max_bytes=10)
+    cache.put("a", _resp(4), 60)
+    cache.put("huge", _resp(11), 60)
+    assert cache.get("huge") is None
+    assert cache.get("a") is not None
+
+
+def test_cache_sweep_drops_expired_entries():
+    cache = Cache()
+    cache.put("old", _resp(5), -1)
+    cache.put("fresh", _resp(5), 60)
+
+    assert cache.sweep() == 1
+    assert "old" not in cache
+    assert "fresh" in cache
+    assert cache.current_bytes == 5
+
+
+def test_cache_sweeper_task_runs_periodically():
+    cache = Cache()
+    cache.put("old", _resp(1), -1)
+
+    async def _run():
+        task = asyncio.create_task(cache.run_sweeper(0.01))
+        await asyncio.sleep(0.05)
+        task.cancel()
+
+    asyncio.run(_run())
+    assert len(cache) == 0
+
+
+def test_single_flight_coalesces_until_release():
+    from replica.cache import SingleFlight
+
+    flights = SingleFlight()
+
+    async def _run():
+        leader, event = flights.join("k", 5)
+        assert leader
+        follower, same = flights.join("k", 5)
+        assert not follower and same is event
+
+        waiter = asyncio.create_task(flights.wait(same, 5))
+        await asyncio.sleep(0)
+        flights.release("k", event)
+        assert await waiter is True
+        assert len(flights) == 0
+
+    asyncio.run(_run())
+    assert flights.leaders == 1
+    assert flights.coalesced == 1
+
+
+def test_single_flight_wait_times_out_and_abandoned_flight_is_taken_over():
+    from replica.cache import SingleFlight
+
+    flights = SingleFlight()
+
+    async def _run():
+        _, stale = flights.join("k", 5)
+        assert await flights.wait(stale, 0.01) is False
+        # A flight older than the timeout is taken over by the next caller
+        leader, fresh = flights.join("k", 0)
+        assert leader and fresh is not stale
+        # The abandoned leader finishing late must not end the new flight
+        flights.release("k", stale)
+        assert len(flights) == 1
+
+    asyncio.run(_run())
+    assert flights.timeouts == 1
+
+
+def test_cache_lookup_serves_stale_entries_within_grace():
+    cache = Cache()
+    cache.put("k", _resp(2), -1, grace=60)
+
+    assert cache.get("k") is None
+    value, staleness = cache.lookup("k")
+    assert value == _resp(2)
+    assert staleness >= 1
+    assert cache.sweep() == 0
+
+    cache.put("gone", _resp(2), -1, grace=0)
+    assert cache.lookup("gone") is None
+
+
+def test_cache_touch_restarts_ttl():
+    cache = Cache()
+    cache.put("k", _resp(1), -1, grace=60)
+    assert cache.get("k") is None
+    assert cache.touch("k", 60)
+    assert cache.get("k") == _resp(1)
+    assert not cache.touch("missing", 60)
+
+
+def test_identical_bodies_are_stored_once():
+    cache = Cache(max_bytes=20, bodies=BodyStore())
+    cache.put("a?v=1", CachedResponse(b"x" * 8, {}, 200), 60)
+    cache.put("a?v=2", CachedResponse(bytearray(b"x" * 8), {}, 200), 60)
+    assert cache.get("a?v=1").body is cache.get("a?v=2").body
+    assert cache.current_bytes == 8
+    assert cache.bodies.saved_bytes == 8
+
+    # Dropping one reference keeps the body for the other
+    cache.delete("a?v=1")
+    assert cache.current_bytes == 8
+    assert cache.get("a?v=2").body == b"x" * 8
+    cache.delete("a?v=2")
+    assert (cache.current_bytes, len(cache.bodies)) == (0, 0)
+
+
+def test_eviction_accounts_for_shared_bodies():
+    cache = Cache(max_bytes=20, bodies=BodyStore())
+    cache.put("a", CachedResponse(b"a" * 8, {}, 200), 60)
+    cache.put("a2", CachedResponse(b"a" * 8, {}, 200), 60)
+    cache.put("b", CachedResponse(b"b" * 8, {}, 200), 60)
+    assert cache.current_bytes == 16
+    # Evicting "a" frees nothing while "a2" shares its body, so "a2" goes too
+    cache.put("c", CachedResponse(b"c" * 8, {}, 200), 60)
+    assert "a" not in cache and "a2" not in cache
+    assert cache.evictions == 2
+    assert cache.current_bytes == 16
+
+
+def test_single_flight_passes_expire(monkeypatch):
+    from replica import cache
+    from replica.cache import SingleFlight
+
+    now = [100.0]
+    monkeypatch.setattr(cache.time, "monotonic", lambda: now[0])
+    flights = SingleFlight(max_passes=2)
+    flights.mark_pass("a", 10)
+    assert flights.is_pass("a") and not flights.is_pass("b")
+    flights.mark_pass("b", 10)
+    flights.mark_pass("c", 10)
+    assert not flights.is_pass("a")  # only max_passes keys are kept
+    flights.mark_pass("b", 0)
+    assert not flights.is_pass("b")
+    now[0] += 11
+    assert not flights.is_pass("c")
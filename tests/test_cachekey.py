@@ -0,0 +1,45 @@
+from replica.cachekey import CacheKeyBuilder, VaryIndex, parse_vary
+
+
+def test_query_is_sorted_and_tracking_params_dropped():
+    keys = CacheKeyBuilder(ignore_params=("utm_*", "fbclid"))
+    assert keys.normalize_query("b=2&utm_source=x&a=1&FBCLID=y&UTM_Medium=z") == "a=1&b=2"
+    assert keys.normalize_query("") == ""
+    # Repeated parameters keep their relative order
+    assert keys.normalize_query("t=2&a=0&t=1") == "a=0&t=2&t=1"
+    assert keys.url("https://x.test/p", "utm_source=x") == "https://x.test/p"
+    assert keys.url("https://x.test/p", "b=1&a=") == "https://x.test/p?a=&b=1"
+
+
+def test_allow_list_keeps_only_matching_params():
+    keys = CacheKeyBuilder(allow_params=("page", "q*"))
+    assert keys.normalize_query("session=1&q=x&page=2&qs=y") == "page=2&q=x&qs=y"
+
+
+def test_variant_folds_headers_profile_and_vary():
+    headers = {"accept-language": "de", "x-device": "mobile"}
+    assert CacheKeyBuilder().variant(headers, "chrome") == ""
+    keys = CacheKeyBuilder(key_headers=("X-Device",), include_profile=True)
+    assert keys.variant(headers, "firefox") == "|x-device=mobile|profile=firefox"
+    assert keys.variant(headers, "chrome", ("accept-language", "x-device")) == (
+        "|x-device=mobile|profile=chrome|accept-language=de"
+    )
+
+
+def test_parse_vary():
+    assert parse_vary(None) == ()
+    assert parse_vary("Accept-Encoding") == ()
+    assert parse_vary("User-Agent, accept-language, Accept-Language") == ("accept-language", "user-agent")
+    assert parse_vary("Accept-Language, *") is None
+
+
+def test_vary_index_is_bounded():
+    index = VaryIndex(max_entries=2)
+    index.set("a", ("x",))
+    index.set("b", ("y",))
+    index.get("a")
+    index.set("c", ("z",))
+    assert index.get("a") == ("x",)
+    assert index.get("b") == ()
+    index.set("a", ())
+    assert len(index) == 1
@@ -0,0 +1,59 @@
+import gzip
+
+from replica.cache import CachedResponse
+from replica.compression import decompress, encode_for_cache, negotiate
+
+
+def test_negotiate_prefers_client_q_then_server_order():
+    assert negotiate("gzip, br", ["br", "gzip"]) == "br"
+    assert negotiate("gzip;q=1.0, br;q=0.5", ["br", "gzip"]) == "gzip"
+    assert negotiate("*", ["zstd", "gzip"]) == "zstd"
+    assert negotiate("br;q=0, *;q=0.1", ["br", "gzip"]) == "gzip"
+
+
+def test_negotiate_falls_back_to_identity():
+    assert negotiate("", ["gzip"]) is None
+    assert negotiate("identity", ["gzip"]) is None
+    assert negotiate("gzip;q=0", ["gzip"]) is None
+
+
+def test_encode_for_cache_compresses_text_only():
+    data = b"<p>hello</p>" * 200
+    body, encoding, variants = encode_for_cache(data, "text/html", ["gzip"], 100)
+    assert encoding == "gzip" and variants == {}
+    assert gzip.decompress(body) == data
+    assert len(body) < len(data)
+
+    assert encode_for_cache(data, "image/png", ["gzip"], 100) == (data, "", {})
+    assert encode_for_cache(b"tiny", "text/html", ["gzip"], 100) == (b"tiny", "", {})
+    # Unavailable codings are skipped
+    assert encode_for_cache(data, "text/html", ["nope"], 100) == (data, "", {})
+
+
+def test_cached_response_decodes_on_demand():
+    data = b"body " * 500
+    body, encoding, variants = encode_for_cache(data, "text/css", ["gzip"], 0)
+    cached = CachedResponse(body, {}, 200, encoding=encoding, variants=variants)
+    assert cached.encoded("gzip") == body
+    assert cached.encoded(None) == data
+    assert decompress(data, "") == data
+    # Codings that were not stored are produced from the decompressed body
+    plain = CachedResponse(data, {}, 200)
+    assert gzip.decompress(plain.encoded("gzip")) == data
+
+
+def test_encode_for_cache_compresses_only_the_primary_coding(monkeypatch):
+    import replica.compression as compression
+
+    calls = []
+
+    def fake_compress(data, encoding):
+        calls.append(encoding)
+        return data[:10]
+
+    monkeypatch.setattr(compression, "SUPPORTED_ENCODINGS", ("br", "zstd", "gzip"))
+    monkeypatch.setattr(compression, "compress", fake_compress)
+    data = b"<p>hello</p>" * 200
+    body, encoding, variants = encode_for_cache(data, "text/html", ["br", "zstd", "gzip"], 0)
+    assert (body, encoding, variants) == (data[:10], "br", {})
+    assert calls == ["br"]
@@ -42,3 +42,13 @@ def test_validate_replacements_wrong_shape(monkeypatch):
     settings = Settings()
     errs = settings.validate()
     assert any("REPLACEMENTS must be a JSON object" in e for e in errs)
+
+
+def test_validate_peers_require_token(monkeypatch):
+    monkeypatch.setenv("TARGET_ORIGIN", "https://example.com")
+    monkeypatch.setenv("PEERS", "http://a:8000,http://b:8000")
+    monkeypatch.setenv("PEER_SELF", "http://a:8000")
+
+    assert any("PEER_TOKEN" in e for e in Settings().validate())
+    monkeypatch.setenv("PEER_TOKEN", "secret")
+    assert Settings().validate() == []
@@ -0,0 +1,149 @@
+import os
+
+from replica.cache import CachedResponse
+from replica.disk import DiskCache, DiskEntry
+
+
+def _value(body: bytes) -> CachedResponse:
+    return CachedResponse(body, {"content-type": "image/png", "etag": '"e"'}, 200, {"etag": '"up"'})
+
+
+def _object_count(directory) -> int:
+    return sum(len(files) for _, _, files in os.walk(os.path.join(directory, "objects")))
+
+
+def test_disk_cache_stores_and_serves_entries(tmp_path):
+    disk = DiskCache(str(tmp_path))
+    disk.put("k", _value(b"png-bytes"), 60)
+
+    entry, staleness = disk.lookup("k")
+    assert isinstance(entry, DiskEntry)
+    assert staleness == 0
+    assert entry.status == 200
+    assert entry.validators == {"etag": '"up"'}
+    with open(entry.path, "rb") as fh:
+        assert fh.read() == b"png-bytes"
+
+
+def test_disk_cache_is_content_addressed(tmp_path):
+    disk = DiskCache(str(tmp_path))
+    disk.put("a", _value(b"same"), 60)
+    disk.put("b", _value(b"same"), 60)
+    assert disk.current_bytes == 4
+    assert _object_count(tmp_path) == 1
+
+    disk.delete("a")
+    assert disk.get("b") is not None
+    disk.delete("b")
+    assert _object_count(tmp_path) == 0
+    assert disk.current_bytes == 0
+
+
+def test_disk_cache_evicts_least_recently_used(tmp_path):
+    disk = DiskCache(str(tmp_path), max_bytes=10)
+    disk.put("a", _value(b"aaaa"), 60)
+    disk.put("b", _value(b"bbbb"), 60)
+    disk.get("a")
+    disk.put("c", _value(b"cccc"), 60)
+
+    assert "b" not in disk
+    assert "a" in disk and "c" in disk
+    assert disk.evictions == 1
+    assert _object_count(tmp_path) == 2
+
+
+def test_disk_cache_index_survives_restart(tmp_path):
+    disk = DiskCache(str(tmp_path))
+    disk.put("keep", _value(b"keep"), 60)
+    disk.put("old", _value(b"old"), -1)
+    disk.save_index()
+
+    # An object not referenced by the index is cleaned up on load
+    orphan = os.path.join(str(tmp_path), "objects", "zz", "zz-orphan")
+    os.makedirs(os.path.dirname(orphan), exist_ok=True)
+    with open(orphan, "wb") as fh:
+        fh.write(b"x")
+
+    reloaded = DiskCache(str(tmp_path))
+    assert reloaded.get("keep") is not None
+    assert "old" not in reloaded
+    assert not os.path.exists(orphan)
+    assert reloaded.current_bytes == 4
+
+
+def test_disk_cache_aput_commits_after_the_write(tmp_path):
+    import asyncio
+    import time
+
+    disk = DiskCache(str(tmp_path))
+    write_blob = disk._write_blob
+
+    def _slow_write(path, body):
+        time.sleep(0.1)
+        write_blob(path, body)
+
+    async def _run():
+        disk._write_blob = _slow_write
+        task = asyncio.ensure_future(disk.aput("b", _value(b"same"), 60))
+        await asyncio.sleep(0.05)
+        assert "b" not in disk
+        # Another key with the same body comes and goes while the object is
+        # being written: the file must survive for "b"
+        disk._write_blob = write_blob
+        disk.put("a", _value(b"same"), 60)
+        disk.delete("a")
+        await task
+
+    asyncio.run(_run())
+    entry = disk.get("b")
+    assert entry is not None
+    with open(entry.path, "rb") as fh:
+        assert fh.read() == b"same"
+    assert disk.current_bytes == 4
+    assert _object_count(tmp_path) == 1
+
+
+def test_disk_cache_file_io_runs_off_the_event_loop(tmp_path, monkeypatch):
+    import asyncio
+    import threading
+
+    disk = DiskCache(str(tmp_path))
+    threads = []
+    unlink = os.unlink
+    write_index = disk._write_index
+    monkeypatch.setattr(os, "unlink", lambda path: threads.append(threading.current_thread()) or unlink(path))
+    monkeypatch.setattr(disk, "_write_index", lambda data: threads.append(threading.current_thread()) or write_index(data))
+
+    async def _run():
+        await disk.aput("gone", _value(b"old"), -1)
+        await disk.aput("kept", _value(b"new"), 60)
+        sweeper = asyncio.ensure_future(disk.run_sweeper(0.01))
+        await asyncio.sleep(0.1)
+        sweeper.cancel()
+        disk.delete("kept")
+        await disk.run(lambda: None)
+        return threading.current_thread()
+
+    loop_thread = asyncio.run(_run())
+    disk.close()
+    # The index was saved and both objects unlinked, all on the cache's thread
+    assert len(threads) >= 3
+    assert loop_thread not in threads
+    assert _object_count(tmp_path) == 0
+    assert DiskCache(str(tmp_path)).lookup("kept") is None
+
+
+def test_disk_cache_missing_objects_are_noticed_when_opened(tmp_path):
+    import asyncio
+
+    disk = DiskCache(str(tmp_path))
+    disk.put("a", _value(b"same"), 60)
+    disk.put("b", _value(b"same"), 60)
+    entry, _ = disk.lookup("a")
+    os.unlink(entry.path)
+
+    # Looking the key up does not touch the file system; opening it does
+    assert disk.lookup("a") is not None
+    assert asyncio.run(disk.astat(entry)) is None
+    assert "a" not in disk and "b" not in disk
+    assert disk.current_bytes == 0
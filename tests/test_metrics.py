@@ -0,0 +1,71 @@
+import respx
+from fastapi.testclient import TestClient
+
+from replica.config import settings
+from replica.main import app
+from replica.metrics import Counter, Histogram, Registry
+
+client = TestClient(app)
+TARGET = settings.TARGET_ORIGIN.rstrip("/")
+
+
+def test_histogram_and_counter_exposition():
+    registry = Registry()
+    hist = registry.register(Histogram("t_seconds", "Test.", (0.1, 1.0)))
+    counter = registry.register(Counter("t_total", "Test.", ("kind",)))
+    hist.observe(0.05)
+    hist.observe(0.5)
+    hist.observe(5)
+    bound = counter.labels("a")
+    assert counter.labels("a") is bound
+    bound.inc()
+    bound.inc(2)
+
+    text = registry.render()
+    assert 't_seconds_bucket{le="0.1"} 1' in text
+    assert 't_seconds_bucket{le="1.0"} 2' in text
+    assert 't_seconds_bucket{le="+Inf"} 3' in text
+    assert "t_seconds_count 3" in text
+    assert 't_total{kind="a"} 3' in text
+
+
+@respx.mock
+def test_metrics_endpoint_reports_requests_and_caches(monkeypatch):
+    monkeypatch.setattr(settings, "METRICS_ENABLED", True)
+    respx.get(f"{TARGET}/metered").respond(200, content="<html>hi</html>", headers={"content-type": "text/html"})
+
+    client.get("/metered")
+    client.get("/metered")
+
+    r = client.get(settings.METRICS_PATH)
+    assert r.status_code == 200
+    assert r.headers["content-type"].startswith("text/plain")
+    body = r.text
+    assert 'replica_requests_total{method="GET",status="200",cache="HIT"}' in body
+    assert 'replica_requests_total{method="GET",status="200",cache="MISS"}' in body
+    assert "replica_upstream_ttfb_seconds_count" in body
+    assert "replica_rewrite_seconds_count" in body
+    assert 'replica_cache_hit_ratio{cache="html"}' in body
+    assert "replica_upstream_queue_depth 0" in body
+    assert 'replica_upstream_shed_total{reason="queue_full"}' in body
+
+
+@respx.mock
+def test_metrics_path_is_proxied_when_disabled(monkeypatch):
+    monkeypatch.setattr(settings, "METRICS_ENABLED", False)
+    route = respx.get(f"{TARGET}{settings.METRICS_PATH}").respond(200, content="origin", headers={"content-type": "text/plain"})
+
+    r = client.get(settings.METRICS_PATH)
+    assert r.text == "origin"
+    assert route.called
+
+
+def test_request_methods_outside_the_standard_set_share_one_label(monkeypatch):
+    monkeypatch.setattr(settings, "METRICS_ENABLED", True)
+
+    for method in ("FOO1", "FOO2"):
+        client.request(method, "/odd-method")
+
+    body = client.get(settings.METRICS_PATH).text
+    assert 'replica_requests_total{method="other",status="405",cache="NONE"} 2' in body
+    assert "FOO1" not in body and "FOO2" not in body
@@ -0,0 +1,169 @@
+import json
+import os
+import socket
+import struct
+import subprocess
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+import pytest
+import respx
+from fastapi.testclient import TestClient
+
+from replica.peers import TOKEN_HEADER, PeerGroup, rendezvous_owner
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+
+def test_rendezvous_owner_is_stable_and_balanced():
+    peers = ["http://a:8000", "http://b:8000", "http://c:8000"]
+    keys = [f"GET:https://example.com/asset/{i}.js" for i in range(3000)]
+    owners = {key: rendezvous_owner(key, peers) for key in keys}
+    counts = [list(owners.values()).count(peer) for peer in peers]
+    assert min(counts) > 800
+
+    # Adding a node only moves keys to the new node
+    grown = peers + ["http://d:8000"]
+    moved = [key for key in keys if rendezvous_owner(key, grown) != owners[key]]
+    assert all(rendezvous_owner(key, grown) == "http://d:8000" for key in moved)
+    assert 500 < len(moved) < 1000
+
+
+def test_peer_group_owner_and_passes():
+    group = PeerGroup(["http://a:8000/", "http://b:8000"], "http://a:8000", pass_ttl=60, max_passes=2)
+    owned = [key for key in map(str, range(50)) if group.owner(key) is None]
+    assert owned and len(owned) < 50
+    assert {group.owner(key) for key in map(str, range(50)) if key not in owned} == {"http://b:8000"}
+    assert PeerGroup(["http://a:8000"], "http://a:8000").owner("k") is None
+
+    group.mark_pass("x")
+    group.mark_pass("y")
+    group.mark_pass("z")
+    assert not group.is_pass("x") and group.is_pass("y") and group.is_pass("z")
+
+
+class _Origin(BaseHTTPRequestHandler):
+    hits = []
+
+    def do_GET(self):
+        self.hits.append(self.path)
+        if self.path.startswith("/page"):
+            body, content_type = f"<html><a href='{self.headers['host']}'>page</a></html>".encode(), "text/html"
+        else:
+            body, content_type = b"asset:" + self.path.encode(), "application/octet-stream"
+        self.send_response(200)
+        self.send_header("content-type", content_type)
+        self.send_header("content-length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture
+def cluster():
+    """Three Replica nodes on localhost in front of one origin."""
+    origin = ThreadingHTTPServer(("127.0.0.1", 0), _Origin)
+    threading.Thread(target=origin.serve_forever, daemon=True).start()
+    nodes = [f"http://127.0.0.1:{_free_port()}" for _ in range(3)]
+    procs = []
+    for node in nodes:
+        env = dict(
+            os.environ,
+            PYTHONPATH=ROOT,
+            TARGET_ORIGIN=f"http://127.0.0.1:{origin.server_port}",
+            PEERS=",".join(nodes),
+            PEER_SELF=node,
+            PEER_TOKEN="secret",
+            PEER_HOT_TTL="0",
+        )
+        port = node.rsplit(":", 1)[1]
+        command = [sys.executable, "-m", "uvicorn", "replica.main:app", "--port", port, "--log-level", "warning"]
+        procs.append(subprocess.Popen(command, env=env, cwd=ROOT))
+    try:
+        for node in nodes:
+            for _ in range(100):
+                try:
+                    httpx.get(f"{node}/__ready", timeout=1)
+                    break
+                except httpx.HTTPError:
+                    time.sleep(0.1)
+        _Origin.hits.clear()
+        yield nodes
+    finally:
+        for proc in procs:
+            proc.terminate()
+        for proc in procs:
+            proc.wait(10)
+        origin.shutdown()
+
+
+def test_cluster_fetches_every_object_once(cluster):
+    paths = [f"/assets/{i}.bin" for i in range(6)] + ["/page"]
+    with httpx.Client() as client:
+        for path in paths:
+            for node in cluster:
+                r = client.get(node + path)
+                assert r.status_code == 200
+                if path == "/page":
+                    # Rendered for the node that was asked, not the owner
+                    assert node.split("//")[1] in r.text
+                else:
+                    assert r.content == b"asset:" + path.encode()
+        assert sorted(_Origin.hits) == sorted(paths)
+        # Every node answered some misses from a peer
+        caches = {client.get(node + paths[0]).headers["x-cache"] for node in cluster}
+        assert "PEER" in caches
+
+        # The internal endpoint requires the token
+        assert client.post(cluster[0] + "/__replica/peer", content=b"{}").status_code == 403
+
+
+@respx.mock
+def test_peer_request_derives_keys_from_url_and_headers(monkeypatch):
+    import replica.proxy as proxy_module
+    from replica.config import settings
+    from replica.main import app
+
+    node = "http://node-a:8000"
+    monkeypatch.setattr(settings, "PEERS", [node, "http://node-b:8000"])
+    monkeypatch.setattr(settings, "PEER_SELF", node)
+    monkeypatch.setattr(settings, "PEER_TOKEN", "secret")
+    monkeypatch.setattr(proxy_module, "_peers", PeerGroup(settings.PEERS, node))
+    target = settings.TARGET_ORIGIN
+    route = respx.get(f"{target}/peer/a.bin").mock(
+        return_value=httpx.Response(200, content=b"A", headers={"content-type": "application/octet-stream"})
+    )
+    forged = {
+        "url": f"{target}/peer/a.bin",
+        "profile": "chrome",
+        "base_key": f"GET:{target}/peer/b.bin",
+        "render_key": "GET:http://evil/peer/b.bin",
+        "key_headers": {},
+        "headers": {"x-injected": "1"},
+        "origin": ["http://evil", "evil", None, "http://evil"],
+    }
+    headers = {TOKEN_HEADER: "secret", "accept-language": "de"}
+    client = TestClient(app)
+
+    response = client.post(settings.PEER_PATH, content=json.dumps(forged), headers=headers)
+    assert response.status_code == 200
+    (size,) = struct.unpack_from(">I", response.content)
+    assert json.loads(response.content[4 : 4 + size])["key"].startswith(f"GET:{target}/peer/a.bin")
+    sent = route.calls.last.request.headers
+    assert sent["accept-language"] == "de"
+    assert "x-injected" not in sent and TOKEN_HEADER not in sent
+
+    off_origin = dict(forged, url="http://elsewhere.example/peer/a.bin")
+    assert client.post(settings.PEER_PATH, content=json.dumps(off_origin), headers=headers).status_code == 400
+    assert client.post(settings.PEER_PATH, content=json.dumps(forged)).status_code == 403
@@ -0,0 +1,24 @@
+from replica.config import settings
+from replica.plan import get_plan
+
+
+def test_plan_is_memoized_per_incoming_origin():
+    plan = get_plan("http://one.test", "one.test", None, "http://one.test")
+    assert get_plan("http://one.test", "one.test", None, "http://one.test") is plan
+    assert get_plan("http://two.test", "two.test", None, "http://two.test") is not plan
+
+
+def test_plan_enforces_mandatory_mappings(monkeypatch):
+    target = settings.TARGET_ORIGIN.rstrip("/")
+    monkeypatch.setattr(settings, "REPLACEMENTS", {settings.target_host: "evil.test", "foo": "bar"})
+    plan = get_plan("http://me.test:8080", "me.test", "8080", "http://me.test")
+    text = f"{target}/x {settings.target_host} foo"
+    assert plan.rewriter.rewrite(text) == "http://me.test:8080/x me.test:8080 bar"
+
+
+def test_plan_request_headers():
+    plan = get_plan("http://me.test", "me.test", None, "http://me.test")
+    out = plan.request_headers(
+        {"host": "me.test", "accept-encoding": "gzip", "cookie": "__cf_bm=1; sid=2", "x-real-ip": "1.2.3.4"}
+    )
+    assert out == {"host": settings.target_host, "cookie": "sid=2"}
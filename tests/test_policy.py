@@ -0,0 +1,54 @@
+import time
+from email.utils import formatdate
+
+from replica.config import settings
+from replica.policy import default_ttl, freshness, parse_cache_control
+
+
+def test_parse_cache_control():
+    assert parse_cache_control('public, Max-Age=60, s-maxage="120", no-transform') == {
+        "public": "",
+        "max-age": "60",
+        "s-maxage": "120",
+        "no-transform": "",
+    }
+    assert parse_cache_control(None) == {}
+
+
+def test_uncacheable_directives():
+    for value in ("no-store", "private, max-age=60", "no-cache", "max-age=0"):
+        assert freshness({"cache-control": value}, 300) is None
+    assert freshness({"cache-control": "max-age=60", "age": "60"}, 300) is None
+    assert freshness({"expires": "0"}, 300) is None
+    assert freshness({}, 0) is None
+
+
+def test_lifetime_precedence_and_age():
+    fresh = freshness({"cache-control": "max-age=60, s-maxage=120", "age": "20"}, 300)
+    assert fresh.expires - fresh.date == 120
+    assert 99 < fresh.ttl <= 100
+
+    assert 59 < freshness({"cache-control": "max-age=60"}, 300).ttl <= 60
+    assert 299 < freshness({}, 300).ttl <= 300
+
+    now = time.time()
+    headers = {"date": formatdate(now, usegmt=True), "expires": formatdate(now + 600, usegmt=True)}
+    assert 598 < freshness(headers, 300).ttl <= 600
+
+
+def test_credentialed_requests_need_explicit_permission():
+    assert freshness({"cache-control": "max-age=60"}, 300, authorized=True) is None
+    assert freshness({"cache-control": "public, max-age=60"}, 300, authorized=True) is not None
+
+
+def test_default_ttl_per_content_type(monkeypatch):
+    monkeypatch.setattr(settings, "CACHE_TTL_HTML", 300)
+    monkeypatch.setattr(settings, "CACHE_TTL_TEXT", 60)
+    monkeypatch.setattr(settings, "CACHE_TTL_STATIC", 86400)
+    monkeypatch.setattr(settings, "CACHE_TTL_TYPES", {"application/json": 5, "image/*": 7})
+    assert default_ttl("text/html; charset=utf-8", False) == 300
+    assert default_ttl("application/xml", False) == 60
+    assert default_ttl("text/css", True) == 86400
+    assert default_ttl("application/octet-stream", False) == 86400
+    assert default_ttl("application/json", False) == 5
+    assert default_ttl("image/png", True) == 7
@@ -4,6 +4,8 @@ from replica.main import app
 
 client = TestClient(app)
 
+import httpx
+import time
 import respx
 from httpx import Response as HTTPXResponse
 from replica.config import settings
@@ -94,3 +96,973 @@ def test_proxy_conflicting_replacement_overridden(monkeypatch):
     assert "testserver site" in r.text
 
 
+
+
+@respx.mock
+def test_static_response_is_streamed_and_cached():
+    payload = bytes(range(256)) * 64
+    route = respx.get(f"{TARGET}/stream/asset.bin").respond(200, content=payload, headers={"content-type": "application/octet-stream"})
+
+    r1 = client.get("/stream/asset.bin")
+    assert r1.status_code == 200
+    assert r1.content == payload
+    assert r1.headers.get("x-cache") == "MISS"
+
+    r2 = client.get("/stream/asset.bin")
+    assert r2.content == payload
+    assert r2.headers.get("x-cache") == "HIT"
+    assert route.call_count == 1
+
+
+@respx.mock
+def test_large_streamed_response_is_not_cached(monkeypatch):
+    monkeypatch.setattr(settings, "STREAM_CACHE_MAX_BYTES", 16)
+    payload = b"z" * 1024
+    route = respx.get(f"{TARGET}/stream/large.bin").respond(200, content=payload, headers={"content-type": "application/octet-stream"})
+
+    assert client.get("/stream/large.bin").content == payload
+    r2 = client.get("/stream/large.bin")
+    assert r2.content == payload
+    assert r2.headers.get("x-cache") == "MISS"
+    assert route.call_count == 2
+
+
+@respx.mock
+def test_static_response_buffered_when_streaming_disabled(monkeypatch):
+    monkeypatch.setattr(settings, "STREAM_STATIC", False)
+    respx.get(f"{TARGET}/buffered/img.png").respond(200, content=b"\x89PNG", headers={"content-type": "image/png"})
+
+    r = client.get("/buffered/img.png")
+    assert r.content == b"\x89PNG"
+    assert client.get("/buffered/img.png").headers.get("x-cache") == "HIT"
+
+
+@respx.mock
+def test_buffered_rewrite_mode(monkeypatch):
+    monkeypatch.setattr(settings, "REWRITE_MODE", "buffer")
+    monkeypatch.setattr(settings, "INJECT_JS", "window.__buffered = true;")
+    respx.get(f"{TARGET}/buffered/page").respond(200, content="<html><body>example.com</body></html>", headers={"content-type": "text/html"})
+
+    r = client.get("/buffered/page")
+    assert r.text == "<html><body>testserver<script>window.__buffered = true;</script></body></html>"
+    assert client.get("/buffered/page").headers.get("x-cache") == "HIT"
+
+
+@respx.mock
+def test_concurrent_misses_are_coalesced():
+    import asyncio
+    import httpx
+    import replica.proxy as proxy_module
+
+    async def _slow_origin(request):
+        await asyncio.sleep(0.05)
+        return HTTPXResponse(200, content="<html>stampede</html>", headers={"content-type": "text/html"})
+
+    route = respx.get(f"{TARGET}/stampede").mock(side_effect=_slow_origin)
+    coalesced_before = proxy_module._flights.coalesced
+
+    async def _run():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://testserver") as ac:
+            return await asyncio.gather(*(ac.get("/stampede") for _ in range(5)))
+
+    responses = asyncio.run(_run())
+    assert all(r.status_code == 200 and "stampede" in r.text for r in responses)
+    assert route.call_count == 1
+    assert sorted(r.headers["x-cache"] for r in responses) == ["HIT"] * 4 + ["MISS"]
+    assert proxy_module._flights.coalesced - coalesced_before == 4
+
+
+@respx.mock
+def test_stale_while_revalidate_serves_stale_and_refreshes(monkeypatch):
+    import asyncio
+    import httpx
+    import replica.proxy as proxy_module
+
+    monkeypatch.setattr(settings, "CACHE_TTL_HTML", -1)
+    route = respx.get(f"{TARGET}/swr").respond(200, content="<html>v1</html>", headers={"content-type": "text/html"})
+
+    async def _run():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://testserver") as ac:
+            r1 = await ac.get("/swr")
+            route.return_value = HTTPXResponse(200, content="<html>v2</html>", headers={"content-type": "text/html"})
+            r2 = await ac.get("/swr")
+            await asyncio.gather(*list(proxy_module._background_tasks))
+            assert route.call_count == 2
+            r3 = await ac.get("/swr")
+            await asyncio.gather(*list(proxy_module._background_tasks))
+            return r1, r2, r3
+
+    r1, r2, r3 = asyncio.run(_run())
+    assert (r1.headers["x-cache"], r1.text) == ("MISS", "<html>v1</html>")
+    assert (r2.headers["x-cache"], r2.text) == ("STALE", "<html>v1</html>")
+    assert (r3.headers["x-cache"], r3.text) == ("STALE", "<html>v2</html>")
+
+
+@respx.mock
+def test_stale_if_error_serves_expired_copy(monkeypatch):
+    monkeypatch.setattr(settings, "CACHE_TTL_HTML", -1)
+    monkeypatch.setattr(settings, "CACHE_STALE_WHILE_REVALIDATE", 0)
+    route = respx.get(f"{TARGET}/sie").respond(200, content="<html>good</html>", headers={"content-type": "text/html"})
+
+    assert client.get("/sie").headers["x-cache"] == "MISS"
+
+    route.return_value = HTTPXResponse(503, content="down")
+    r = client.get("/sie")
+    assert r.status_code == 200
+    assert r.text == "<html>good</html>"
+    assert r.headers["x-cache"] == "STALE"
+
+
+@respx.mock
+def test_cached_hit_answers_304_for_matching_validator():
+    respx.get(f"{TARGET}/etag/page").respond(200, content="<html>example.com etag</html>", headers={"content-type": "text/html", "etag": '"upstream"'})
+
+    client.get("/etag/page")
+    hit = client.get("/etag/page")
+    etag = hit.headers["etag"]
+    assert hit.headers["x-cache"] == "HIT"
+    # The validator describes the rewritten body, not the upstream one
+    assert etag != '"upstream"'
+
+    r = client.get("/etag/page", headers={"If-None-Match": etag})
+    assert r.status_code == 304
+    assert r.content == b""
+    assert r.headers["etag"] == etag
+
+    assert client.get("/etag/page", headers={"If-None-Match": '"other"'}).status_code == 200
+
+
+@respx.mock
+def test_expired_entry_is_revalidated_with_conditional_request(monkeypatch):
+    monkeypatch.setattr(settings, "CACHE_STALE_WHILE_REVALIDATE", 0)
+    monkeypatch.setattr(settings, "CACHE_TTL_HTML", -1)
+    seen = []
+
+    def _origin(request):
+        seen.append(request.headers.get("if-none-match"))
+        if request.headers.get("if-none-match") == '"v1"':
+            return HTTPXResponse(304)
+        return HTTPXResponse(200, content="<html>original</html>", headers={"content-type": "text/html", "etag": '"v1"'})
+
+    respx.get(f"{TARGET}/revalidate").mock(side_effect=_origin)
+
+    assert client.get("/revalidate").headers["x-cache"] == "MISS"
+
+    monkeypatch.setattr(settings, "CACHE_TTL_HTML", 300)
+    r = client.get("/revalidate")
+    assert r.status_code == 200
+    assert r.text == "<html>original</html>"
+    assert r.headers["x-cache"] == "REVALIDATED"
+    assert seen == [None, '"v1"']
+
+    # The 304 restarted the TTL, so the entry is fresh again
+    assert client.get("/revalidate").headers["x-cache"] == "HIT"
+
+
+@respx.mock
+def test_static_entries_demote_to_disk_and_promote_back(monkeypatch, tmp_path):
+    import asyncio
+    import replica.proxy as proxy_module
+    from replica.cache import Cache
+    from replica.disk import DiskCache
+
+    disk = DiskCache(str(tmp_path))
+    monkeypatch.setattr(proxy_module, "_disk_cache", disk)
+    monkeypatch.setattr(proxy_module, "_static_cache", Cache(max_bytes=6, on_evict=proxy_module._demote_to_disk))
+    monkeypatch.setattr(settings, "DISK_CACHE_PROMOTE_HITS", 2)
+    a = respx.get(f"{TARGET}/tier/a.png").respond(200, content=b"aaaa", headers={"content-type": "image/png"})
+    respx.get(f"{TARGET}/tier/b.png").respond(200, content=b"bbbb", headers={"content-type": "image/png"})
+    key = f"GET:{TARGET}/tier/a.png"
+
+    async def _run():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://testserver") as ac:
+            async def _get(path):
+                r = await ac.get(path)
+                await asyncio.gather(*proxy_module._background_tasks)
+                return r
+
+            await _get("/tier/a.png")
+            await _get("/tier/b.png")  # evicts a.png from memory to disk
+            assert key in disk
+
+            r = await _get("/tier/a.png")
+            assert (r.content, r.headers["x-cache"]) == (b"aaaa", "HIT")
+            assert key not in proxy_module._static_cache
+
+            # Second disk hit promotes the entry back into memory
+            r = await _get("/tier/a.png")
+            assert r.content == b"aaaa"
+            assert key in proxy_module._static_cache
+
+    asyncio.run(_run())
+    assert a.call_count == 1
+
+
+@respx.mock
+def test_disk_writes_do_not_block_the_event_loop(monkeypatch, tmp_path):
+    import asyncio
+    import replica.proxy as proxy_module
+    from replica.cache import Cache
+    from replica.disk import DiskCache
+
+    disk = DiskCache(str(tmp_path))
+    write_blob = disk._write_blob
+
+    def _slow_write(path, body):
+        time.sleep(0.3)
+        write_blob(path, body)
+
+    monkeypatch.setattr(disk, "_write_blob", _slow_write)
+    monkeypatch.setattr(proxy_module, "_disk_cache", disk)
+    monkeypatch.setattr(proxy_module, "_static_cache", Cache(max_bytes=6, on_evict=proxy_module._demote_to_disk))
+    respx.get(f"{TARGET}/slowdisk/a.png").respond(200, content=b"aaaa", headers={"content-type": "image/png"})
+    respx.get(f"{TARGET}/slowdisk/b.png").respond(200, content=b"bbbb", headers={"content-type": "image/png"})
+    key = f"GET:{TARGET}/slowdisk/a.png"
+
+    async def _run():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://testserver") as ac:
+            await ac.get("/slowdisk/a.png")
+            started = time.monotonic()
+            await ac.get("/slowdisk/b.png")  # spills a.png to disk in the background
+            elapsed = time.monotonic() - started
+            # The index entry is committed only once the file is written
+            assert key not in disk
+            await asyncio.gather(*proxy_module._background_tasks)
+            return elapsed
+
+    assert asyncio.run(_run()) < 0.2
+    assert key in disk
+
+
+@respx.mock
+def test_new_incoming_host_is_rendered_from_raw_copy():
+    route = respx.get(f"{TARGET}/hosts").respond(
+        200, content=f"<html><a href='{TARGET}/x'>link</a></html>", headers={"content-type": "text/html"}
+    )
+
+    r1 = client.get("/hosts", headers={"host": "one.test"})
+    assert r1.headers["x-cache"] == "MISS"
+    assert "http://one.test/x" in r1.text
+
+    # Another hostname is rendered from the cached raw document, not fetched again
+    r2 = client.get("/hosts", headers={"host": "two.test"})
+    assert r2.headers["x-cache"] == "HIT"
+    assert "http://two.test/x" in r2.text
+    assert "one.test" not in r2.text
+    assert "etag" in r2.headers
+    assert route.call_count == 1
+
+    # ...and its rendering is cached as well
+    assert client.get("/hosts", headers={"host": "two.test"}).text == r2.text
+
+
+@respx.mock
+def test_static_entries_are_shared_across_incoming_hosts():
+    route = respx.get(f"{TARGET}/shared/logo.png").respond(
+        200, content=b"png", headers={"content-type": "image/png", "link": f"<{TARGET}/shared/logo.png>"}
+    )
+
+    client.get("/shared/logo.png", headers={"host": "one.test"})
+    r = client.get("/shared/logo.png", headers={"host": "two.test"})
+    assert r.headers["x-cache"] == "HIT"
+    assert r.content == b"png"
+    # Headers are sanitized for the requesting origin
+    assert r.headers["link"] == "<http://two.test/shared/logo.png>"
+    assert route.call_count == 1
+
+
+@respx.mock
+def test_cached_text_is_stored_compressed_and_negotiated(monkeypatch):
+    import gzip
+    import replica.proxy as proxy_module
+
+    monkeypatch.setattr(settings, "CACHE_COMPRESSION", ["gzip"])
+    css = b"body { color: red; }\n" * 200
+    respx.get(f"{TARGET}/gz/site.css").respond(200, content=css, headers={"content-type": "text/css"})
+
+    client.get("/gz/site.css")
+    cached = proxy_module._static_cache.get(f"GET:{TARGET}/gz/site.css")
+    assert cached.encoding == "gzip"
+    assert len(cached.body) < len(css)
+
+    r = client.get("/gz/site.css", headers={"accept-encoding": "gzip"})
+    assert r.headers["x-cache"] == "HIT"
+    assert r.headers["content-encoding"] == "gzip"
+    assert "Accept-Encoding" in r.headers["vary"]
+    assert int(r.headers["content-length"]) == len(cached.body)
+    assert r.content == css  # decoded by the test client
+
+    r = client.get("/gz/site.css", headers={"accept-encoding": "identity"})
+    assert "content-encoding" not in r.headers
+    assert r.content == css
+    assert gzip.decompress(cached.body) == css
+
+
+@respx.mock
+def test_cache_key_ignores_param_order_and_tracking_params():
+    route = respx.get(f"{TARGET}/norm/app.js").respond(
+        200, content=b"js", headers={"content-type": "application/javascript"}
+    )
+
+    client.get("/norm/app.js?b=2&a=1&utm_source=mail")
+    r = client.get("/norm/app.js?a=1&b=2&fbclid=abc")
+    assert r.headers["x-cache"] == "HIT"
+    assert route.call_count == 1
+    # Upstream still received the query as sent
+    assert route.calls[0].request.url.params["utm_source"] == "mail"
+
+    assert client.get("/norm/app.js?a=1&b=3").headers["x-cache"] == "MISS"
+    assert route.call_count == 2
+
+
+@respx.mock
+def test_upstream_vary_splits_cache_entries():
+    def respond(request):
+        lang = request.headers.get("accept-language", "")
+        return HTTPXResponse(
+            200, content=f"lang={lang}".encode(), headers={"content-type": "image/png", "vary": "Accept-Language"}
+        )
+
+    route = respx.get(f"{TARGET}/vary/flag.png").mock(side_effect=respond)
+
+    assert client.get("/vary/flag.png", headers={"accept-language": "de"}).content == b"lang=de"
+    r = client.get("/vary/flag.png", headers={"accept-language": "fr"})
+    assert r.content == b"lang=fr"
+    assert route.call_count == 2
+
+    for lang in ("de", "fr"):
+        r = client.get("/vary/flag.png", headers={"accept-language": lang})
+        assert r.headers["x-cache"] == "HIT"
+        assert r.content == f"lang={lang}".encode()
+    assert route.call_count == 2
+
+
+@respx.mock
+def test_vary_star_is_not_cached():
+    route = respx.get(f"{TARGET}/vary/any.png").respond(
+        200, content=b"x", headers={"content-type": "image/png", "vary": "*"}
+    )
+    client.get("/vary/any.png")
+    assert client.get("/vary/any.png").headers["x-cache"] == "MISS"
+    assert route.call_count == 2
+
+
+@respx.mock
+def test_non_html_text_is_cached_and_rewritten():
+    route = respx.get(f"{TARGET}/api/config").respond(
+        200, content=f'{{"url": "{TARGET}/x"}}', headers={"content-type": "application/json"}
+    )
+
+    r1 = client.get("/api/config", headers={"host": "one.test"})
+    assert r1.headers["x-cache"] == "MISS"
+    r2 = client.get("/api/config", headers={"host": "one.test"})
+    assert r2.headers["x-cache"] == "HIT"
+    assert r2.json() == {"url": "http://one.test/x"}
+    # Rendered for another incoming host from the raw copy
+    assert client.get("/api/config", headers={"host": "two.test"}).json() == {"url": "http://two.test/x"}
+    assert route.call_count == 1
+
+
+@respx.mock
+def test_upstream_cache_control_is_honoured():
+    import replica.proxy as proxy_module
+
+    private = respx.get(f"{TARGET}/cc/private.png").respond(
+        200, content=b"p", headers={"content-type": "image/png", "cache-control": "private, max-age=60"}
+    )
+    client.get("/cc/private.png")
+    r = client.get("/cc/private.png")
+    assert r.headers["x-cache"] == "MISS"
+    assert r.headers["cache-control"] == "private, max-age=60"
+    assert private.call_count == 2
+
+    respx.get(f"{TARGET}/cc/short.png").respond(
+        200, content=b"s", headers={"content-type": "image/png", "cache-control": "max-age=120", "age": "20"}
+    )
+    r = client.get("/cc/short.png")
+    assert r.headers["cache-control"] == "public, max-age=120"
+    assert r.headers["age"] == "20"
+    r = client.get("/cc/short.png")
+    assert r.headers["x-cache"] == "HIT"
+    assert r.headers["cache-control"] == "public, max-age=120"
+    assert int(r.headers["age"]) >= 20
+    assert 0 < proxy_module._static_cache.expiry(f"GET:{TARGET}/cc/short.png")[0] <= 100
+
+
+@respx.mock
+def test_assets_of_html_pages_are_prefetched(monkeypatch):
+    import asyncio
+    import httpx
+    import replica.proxy as proxy_module
+
+    monkeypatch.setattr(settings, "PREFETCH_ASSETS", True)
+    page = '<html><link rel="stylesheet" href="/pf/site.css"><img src="/pf/logo.png"><img src="https://other.test/x.png"></html>'
+    respx.get(f"{TARGET}/pf/page").respond(200, content=page, headers={"content-type": "text/html"})
+    css = respx.get(f"{TARGET}/pf/site.css").respond(200, content=b"body{}", headers={"content-type": "text/css"})
+    logo = respx.get(f"{TARGET}/pf/logo.png").respond(200, content=b"png", headers={"content-type": "image/png"})
+
+    async def _run():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://testserver") as ac:
+            await ac.get("/pf/page")
+            while proxy_module._background_tasks:
+                await asyncio.gather(*list(proxy_module._background_tasks))
+            return await ac.get("/pf/site.css"), await ac.get("/pf/logo.png")
+
+    r_css, r_logo = asyncio.run(_run())
+    assert r_css.headers["x-cache"] == "HIT"
+    assert r_logo.headers["x-cache"] == "HIT"
+    assert (css.call_count, logo.call_count) == (1, 1)
+
+
+@respx.mock
+def test_requests_are_shed_when_upstream_is_saturated(monkeypatch):
+    import asyncio
+    import replica.proxy as proxy_module
+    from replica.upstream import UpstreamLimiter
+
+    respx.get(f"{TARGET}/busy/cached.png").respond(200, content=b"png", headers={"content-type": "image/png"})
+    route = respx.get(f"{TARGET}/busy/page").respond(200, content="<html></html>", headers={"content-type": "text/html"})
+    client.get("/busy/cached.png")
+
+    limiter = UpstreamLimiter(max_active=1, max_queue=0)
+    monkeypatch.setattr(proxy_module, "_limiter", limiter)
+    asyncio.run(limiter.acquire("chrome"))  # all slots taken
+
+    r = client.get("/busy/page")
+    assert r.status_code == 503
+    assert r.headers["retry-after"] == str(settings.UPSTREAM_RETRY_AFTER)
+    assert route.call_count == 0
+    assert limiter.shed_queue_full == 1
+    # Cache hits bypass the limiter
+    assert client.get("/busy/cached.png").headers["x-cache"] == "HIT"
+
+    limiter.release("chrome")
+    assert client.get("/busy/page").status_code == 200
+    assert limiter.active == 0
+
+
+@respx.mock
+def test_open_circuit_fails_fast_or_serves_expired_copies(monkeypatch):
+    import replica.proxy as proxy_module
+    from replica.upstream import CircuitBreaker
+
+    monkeypatch.setattr(settings, "CACHE_STALE_WHILE_REVALIDATE", 0)
+    monkeypatch.setattr(settings, "CACHE_STALE_IF_ERROR", 0)
+    breaker = CircuitBreaker(failure_rate=0.5, min_requests=3, window=60, open_seconds=60)
+    monkeypatch.setattr(proxy_module, "_breaker", breaker)
+
+    good = respx.get(f"{TARGET}/cb/logo.png").respond(
+        200, content=b"png", headers={"content-type": "image/png", "cache-control": "max-age=1"}
+    )
+    client.get("/cb/logo.png")
+    # Age the entry past its TTL and grace period
+    proxy_module._static_cache._store[f"GET:{TARGET}/cb/logo.png"].stale_until -= 10
+    proxy_module._static_cache._store[f"GET:{TARGET}/cb/logo.png"].expires -= 10
+
+    down = respx.get(f"{TARGET}/cb/page").respond(502)
+    client.get("/cb/page")
+    client.get("/cb/page")
+    assert breaker.is_open
+    assert down.call_count == 2
+
+    r = client.get("/cb/page")
+    assert r.status_code == 503
+    assert int(r.headers["retry-after"]) > 0
+    assert down.call_count == 2
+
+    # Expired (even past grace) copies are served instead of failing
+    r = client.get("/cb/logo.png")
+    assert (r.status_code, r.headers["x-cache"], r.content) == (200, "STALE", b"png")
+    assert good.call_count == 1
+
+
+@respx.mock
+def test_range_requests_are_served_from_cache():
+    data = bytes(range(256)) * 4
+    route = respx.get(f"{TARGET}/rg/blob.bin").respond(
+        200, content=data, headers={"content-type": "application/octet-stream", "etag": '"v1"'}
+    )
+    r = client.get("/rg/blob.bin")
+    assert r.headers["accept-ranges"] == "bytes"
+
+    r = client.get("/rg/blob.bin", headers={"range": "bytes=10-19"})
+    assert (r.status_code, r.headers["x-cache"]) == (206, "HIT")
+    assert r.headers["content-range"] == "bytes 10-19/1024"
+    assert r.content == data[10:20]
+
+    r = client.get("/rg/blob.bin", headers={"range": "bytes=-4"})
+    assert r.content == data[-4:]
+
+    # A changed representation (If-Range mismatch) is sent whole
+    r = client.get("/rg/blob.bin", headers={"range": "bytes=0-9", "if-range": '"v0"'})
+    assert (r.status_code, r.content) == (200, data)
+    r = client.get("/rg/blob.bin", headers={"range": "bytes=0-9", "if-range": '"v1"'})
+    assert (r.status_code, r.content) == (206, data[:10])
+
+    r = client.get("/rg/blob.bin", headers={"range": "bytes=5000-"})
+    assert r.status_code == 416
+    assert r.headers["content-range"] == "bytes */1024"
+    assert route.call_count == 1
+
+
+@respx.mock
+def test_ranged_miss_is_forwarded_and_whole_object_fetched(monkeypatch):
+    import asyncio
+    import httpx
+    import replica.proxy as proxy_module
+
+    data = b"0123456789" * 10
+    ranged = []
+
+    def upstream(request):
+        if "range" in request.headers:
+            ranged.append(request.headers["range"])
+            return HTTPXResponse(
+                206, content=data[:10], headers={"content-type": "video/mp4", "content-range": "bytes 0-9/100"}
+            )
+        return HTTPXResponse(200, content=data, headers={"content-type": "video/mp4"})
+
+    route = respx.get(f"{TARGET}/rg/clip.mp4").mock(side_effect=upstream)
+
+    async def _run():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://testserver") as ac:
+            first = await ac.get("/rg/clip.mp4", headers={"range": "bytes=0-9"})
+            while proxy_module._background_tasks:
+                await asyncio.gather(*list(proxy_module._background_tasks))
+            return first, await ac.get("/rg/clip.mp4", headers={"range": "bytes=20-29"})
+
+    first, second = asyncio.run(_run())
+    assert (first.status_code, first.headers["content-range"], first.content) == (206, "bytes 0-9/100", data[:10])
+    assert (second.status_code, second.headers["x-cache"], second.content) == (206, "HIT", data[20:30])
+    assert ranged == ["bytes=0-9"]
+    assert route.call_count == 2
+
+
+@pytest.mark.parametrize("mode", ["buffer", "stream"])
+@respx.mock
+def test_ranged_text_miss_fetches_whole_document(monkeypatch, mode):
+    monkeypatch.setattr(settings, "REWRITE_MODE", mode)
+
+    def upstream(request):
+        if "range" in request.headers:
+            return HTTPXResponse(206, content=b"<html>", headers={"content-type": "text/html", "content-range": "bytes 0-5/30"})
+        return HTTPXResponse(200, content=b"<html>whole document</html>", headers={"content-type": "text/html"})
+
+    route = respx.get(f"{TARGET}/rg/page-{mode}").mock(side_effect=upstream)
+    # The range is cut from the rewritten document, fetched whole in one request
+    r = client.get(f"/rg/page-{mode}", headers={"range": "bytes=6-10"})
+    assert (r.status_code, r.headers["x-cache"], r.content) == (206, "MISS", b"whole")
+    assert r.headers["content-range"].startswith("bytes 6-10/")
+    assert route.call_count == 1
+    assert "range" not in route.calls.last.request.headers
+    r = client.get(f"/rg/page-{mode}", headers={"range": "bytes=0-5"})
+    assert (r.status_code, r.headers["x-cache"], r.content) == (206, "HIT", b"<html>")
+    assert route.call_count == 1
+
+
+@respx.mock
+def test_static_bodies_are_deduplicated_across_urls():
+    import replica.proxy as proxy_module
+
+    font = b"\x00font" * 100
+    respx.get(f"{TARGET}/dd/font.woff2").respond(200, content=font, headers={"content-type": "font/woff2"})
+    before = proxy_module._static_cache.current_bytes
+    client.get("/dd/font.woff2?v=1")
+    client.get("/dd/font.woff2?v=2")
+    first = proxy_module._static_cache.peek(f"GET:{TARGET}/dd/font.woff2?v=1")
+    second = proxy_module._static_cache.peek(f"GET:{TARGET}/dd/font.woff2?v=2")
+    assert first.body is second.body
+    assert proxy_module._static_cache.current_bytes - before == len(font)
+    assert client.get("/dd/font.woff2?v=2").content == font
+
+
+@respx.mock
+def test_shared_cache_serves_other_workers(monkeypatch, tmp_path):
+    import replica.proxy as proxy_module
+    from replica.cache import Cache
+    from replica.shared import SharedCache
+
+    monkeypatch.setattr(proxy_module, "_shared_cache", SharedCache(str(tmp_path / "shared.db")))
+    route = respx.get(f"{TARGET}/sh/app.wasm").respond(200, content=b"wasm", headers={"content-type": "application/wasm"})
+    page = respx.get(f"{TARGET}/sh/page").respond(200, content="<html>example.com</html>", headers={"content-type": "text/html"})
+    client.get("/sh/app.wasm")
+    client.get("/sh/page")
+
+    # Another worker: empty process-local caches, same shared file
+    for name in ("_static_cache", "_raw_cache", "_html_cache"):
+        monkeypatch.setattr(proxy_module, name, Cache())
+    r = client.get("/sh/app.wasm")
+    assert (r.headers["x-cache"], r.content) == ("HIT", b"wasm")
+    r = client.get("/sh/page")
+    assert r.headers["x-cache"] == "HIT"
+    assert (route.call_count, page.call_count) == (1, 1)
+    # The entry was copied into this worker's memory
+    assert f"GET:{TARGET}/sh/app.wasm" in proxy_module._static_cache
+
+
+def test_local_memory_tiers_are_small_with_a_shared_cache(monkeypatch):
+    import replica.proxy as proxy_module
+
+    monkeypatch.setattr(settings, "SHARED_CACHE_LOCAL_BYTES", 1000)
+    monkeypatch.setattr(settings, "SHARED_CACHE_PATH", "")
+    assert proxy_module._local_budget(5000) == 5000
+    monkeypatch.setattr(settings, "SHARED_CACHE_PATH", "/tmp/shared.db")
+    assert proxy_module._local_budget(5000) == 1000
+    assert proxy_module._local_budget(500) == 500
+    assert proxy_module._local_budget(0) == 1000  # unlimited
+    monkeypatch.setattr(settings, "SHARED_CACHE_LOCAL_BYTES", 0)
+    assert proxy_module._local_budget(5000) == 5000
+
+
+@respx.mock
+def test_misses_wait_for_the_worker_fetching_them(monkeypatch, tmp_path):
+    import asyncio
+    import replica.proxy as proxy_module
+    from replica.cache import CachedResponse
+    from replica.shared import SharedCache
+
+    path = str(tmp_path / "shared.db")
+    monkeypatch.setattr(proxy_module, "_shared_cache", SharedCache(path))
+    route = respx.get(f"{TARGET}/sh/slow.bin").respond(200, content=b"upstream")
+    key = f"GET:{TARGET}/sh/slow.bin"
+    other = SharedCache(path)
+    assert other.lease(key, 5)
+
+    async def _other_worker():
+        await asyncio.sleep(0.1)
+        other.put(f"static:{key}", CachedResponse(b"from other worker", {}, 200, shared=True), 60)
+        other.release(key)
+
+    async def _run():
+        import httpx
+
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://testserver") as ac:
+            r, _ = await asyncio.gather(ac.get("/sh/slow.bin"), _other_worker())
+            return r
+
+    r = asyncio.run(_run())
+    assert (r.headers["x-cache"], r.content) == ("HIT", b"from other worker")
+    assert route.call_count == 0
+
+
+@respx.mock
+def test_small_request_bodies_are_buffered(monkeypatch):
+    import replica.proxy as proxy_module
+
+    streamed = []
+    original = proxy_module._limited_stream
+    monkeypatch.setattr(proxy_module, "_limited_stream", lambda *args: streamed.append(1) or original(*args))
+    route = respx.post(f"{TARGET}/upload/small").respond(200, content=b"ok")
+    r = client.post("/upload/small", content=b"a=1&b=2")
+    assert r.status_code == 200
+    assert route.calls.last.request.content == b"a=1&b=2"
+    assert route.calls.last.request.headers["content-length"] == "7"
+    assert not streamed
+
+
+@respx.mock
+def test_large_request_bodies_are_streamed(monkeypatch):
+    import replica.proxy as proxy_module
+
+    monkeypatch.setattr(settings, "REQUEST_BUFFER_MAX_BYTES", 16)
+    streamed = []
+    original = proxy_module._limited_stream
+    monkeypatch.setattr(proxy_module, "_limited_stream", lambda *args: streamed.append(1) or original(*args))
+    route = respx.put(f"{TARGET}/upload/large").respond(201)
+    payload = bytes(range(256)) * 64
+    r = client.put("/upload/large", content=payload)
+    assert r.status_code == 201
+    assert route.calls.last.request.content == payload
+    assert streamed
+
+    # Chunked bodies (no Content-Length) are streamed too
+    r = client.put("/upload/large", content=iter([b"part1-", b"part2"]))
+    assert r.status_code == 201
+    assert route.calls.last.request.content == b"part1-part2"
+    assert len(streamed) == 2
+
+
+def test_streamed_request_bodies_reach_the_origin_as_they_arrive(monkeypatch):
+    import asyncio
+    import threading
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    import replica.proxy as proxy_module
+    from replica.upstream import ClientPool
+
+    first_chunk = threading.Event()
+
+    class Origin(BaseHTTPRequestHandler):
+        def do_PUT(self):
+            length = int(self.headers["content-length"])
+            received = self.rfile.read(6)
+            first_chunk.set()
+            received += self.rfile.read(length - len(received))
+            self.send_response(200)
+            self.send_header("content-length", str(len(received)))
+            self.end_headers()
+            self.wfile.write(received)
+
+        def log_message(self, *args):
+            pass
+
+    origin = ThreadingHTTPServer(("127.0.0.1", 0), Origin)
+    threading.Thread(target=origin.serve_forever, daemon=True).start()
+    monkeypatch.setattr(settings, "TARGET_ORIGIN", f"http://127.0.0.1:{origin.server_port}")
+    monkeypatch.setattr(settings, "REQUEST_BUFFER_MAX_BYTES", 4)
+    # The curl transport (which reads request bodies whole) for everything else
+    curl_clients = ClientPool(lambda impersonate: httpx.AsyncClient(transport=proxy_module._PooledCurlTransport()))
+    monkeypatch.setattr(proxy_module, "_client_pool", curl_clients)
+    seen_before_end = []
+
+    async def body():
+        yield b"part1-"
+        # The rest is only sent once the origin got the first part
+        seen_before_end.append(await asyncio.to_thread(first_chunk.wait, 5))
+        yield b"part2"
+
+    async def _run():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://testserver") as ac:
+            return await ac.put("/upload/stream", content=body(), headers={"content-length": "11"})
+
+    try:
+        r = asyncio.run(_run())
+    finally:
+        origin.shutdown()
+    assert r.status_code == 200
+    assert r.content == b"part1-part2"
+    assert seen_before_end == [True]
+
+
+@respx.mock
+def test_request_bodies_over_the_limit_are_refused(monkeypatch):
+    monkeypatch.setattr(settings, "REQUEST_MAX_BODY_BYTES", 100)
+    monkeypatch.setattr(settings, "REQUEST_BUFFER_MAX_BYTES", 16)
+    route = respx.post(f"{TARGET}/upload/limited").respond(200)
+    # Refused from the Content-Length, before reading the body
+    r = client.post("/upload/limited", content=b"x" * 101)
+    assert r.status_code == 413
+    # Chunked bodies are refused once they grow past the limit
+    r = client.post("/upload/limited", content=iter([b"x" * 60, b"x" * 60]))
+    assert r.status_code == 413
+    assert route.call_count == 0
+    r = client.post("/upload/limited", content=b"x" * 100)
+    assert r.status_code == 200
+
+
+class _BrokenStream(httpx.AsyncByteStream):
+    """Upstream body failing after its first chunk."""
+
+    async def __aiter__(self):
+        yield b"partial"
+        raise httpx.ReadError("connection reset")
+
+
+@respx.mock
+def test_upstream_read_error_mid_body_is_a_bad_gateway(monkeypatch):
+    monkeypatch.setattr(settings, "STREAM_STATIC", False)
+    respx.get(f"{TARGET}/broken/file.bin").mock(
+        return_value=HTTPXResponse(200, headers={"content-type": "application/octet-stream"}, stream=_BrokenStream())
+    )
+    r = client.get("/broken/file.bin")
+    assert r.status_code == 502
+    assert "connection reset" in r.text
+
+
+@respx.mock
+@pytest.mark.parametrize("stream_static", [False, True])
+def test_upstream_body_errors_count_against_the_origin(monkeypatch, stream_static):
+    import replica.proxy as proxy_module
+    from replica.upstream import CircuitBreaker
+
+    monkeypatch.setattr(settings, "STREAM_STATIC", stream_static)
+    breaker = CircuitBreaker(failure_rate=0.5, min_requests=2)
+    monkeypatch.setattr(proxy_module, "_breaker", breaker)
+    respx.get(f"{TARGET}/health/ok.bin").respond(200, content=b"ok", headers={"cache-control": "no-store"})
+    respx.get(f"{TARGET}/health/broken.bin").mock(
+        return_value=HTTPXResponse(200, headers={"content-type": "application/octet-stream"}, stream=_BrokenStream())
+    )
+    assert client.get("/health/ok.bin").status_code == 200
+    assert breaker.state == "closed"
+    # The headers were fine, the body was not: one failure out of two requests
+    try:
+        client.get("/health/broken.bin")
+    except httpx.ReadError:
+        pass  # the response had started already
+    assert breaker.state == "open"
+
+
+@respx.mock
+@pytest.mark.parametrize("leave", ["disconnect", "send-error", "cancel"])
+def test_streams_are_cleaned_up_when_the_client_leaves_before_the_body(monkeypatch, leave):
+    import asyncio
+    import replica.proxy as proxy_module
+    from replica.upstream import UpstreamLimiter
+
+    monkeypatch.setattr(proxy_module, "_limiter", UpstreamLimiter(max_active=2, max_queue=0))
+    route = respx.get(f"{TARGET}/gone/file.bin").respond(
+        200, content=b"x" * 1000, headers={"cache-control": "no-store"}
+    )
+
+    async def _receive():
+        return {"type": "http.disconnect"}
+
+    async def _send(message):
+        if message["type"] != "http.response.start":
+            return
+        if leave == "send-error":
+            # Under ASGI 2.4 a vanished client shows up as a failing send
+            raise OSError("client went away")
+        if leave == "cancel":
+            await asyncio.Event().wait()
+
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0", "spec_version": "2.3" if leave == "disconnect" else "2.4"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": "/gone/file.bin",
+        "raw_path": b"/gone/file.bin",
+        "query_string": b"",
+        "root_path": "",
+        "headers": [(b"host", b"testserver")],
+        "client": ("127.0.0.1", 1234),
+        "server": ("testserver", 80),
+    }
+
+    async def _run():
+        for _ in range(3):
+            task = asyncio.ensure_future(app(scope, _receive, _send))
+            await asyncio.sleep(0.05)
+            task.cancel()
+            try:
+                await task
+            except BaseException:
+                pass
+
+    asyncio.run(_run())
+    assert route.call_count == 3
+    assert proxy_module._limiter.active == 0
+    assert not proxy_module._flights._flights
+    # Later misses still get an upstream slot
+    r = client.get("/gone/file.bin")
+    assert r.status_code == 200
+
+
+@respx.mock
+def test_half_open_probe_survives_shed_and_cancelled_requests(monkeypatch):
+    import asyncio
+    import replica.proxy as proxy_module
+    from replica.upstream import CircuitBreaker, UpstreamLimiter
+
+    limiter = UpstreamLimiter(max_active=1, max_queue=0)
+    breaker = CircuitBreaker(failure_rate=0.5, min_requests=1, window=60, open_seconds=0.05)
+    monkeypatch.setattr(proxy_module, "_limiter", limiter)
+    monkeypatch.setattr(proxy_module, "_breaker", breaker)
+    monkeypatch.setattr(settings, "COALESCE_TIMEOUT", 0)
+
+    sent = []
+
+    async def _slow(request):
+        sent.append(request)
+        await asyncio.sleep(10)
+
+    respx.get(f"{TARGET}/probe/slow").mock(side_effect=_slow)
+    ok = respx.get(f"{TARGET}/probe/ok").respond(200, content=b"ok", headers={"cache-control": "no-store"})
+
+    breaker.record(False)
+    assert breaker.state == "open"
+    time.sleep(0.06)
+    assert breaker.state == "half_open"
+
+    # Shed by the limiter: the probe is not used up
+    asyncio.run(limiter.acquire("chrome"))
+    r = client.get("/probe/ok", headers={"user-agent": "Mozilla/5.0 Chrome/120"})
+    assert r.text == "Upstream is busy, retry later"
+    limiter.release("chrome")
+    assert breaker.state == "half_open"
+
+    # A probe cancelled by a client going away is neither a failure nor lost
+    async def _cancelled():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://testserver") as ac:
+            task = asyncio.ensure_future(ac.get("/probe/slow"))
+            await asyncio.sleep(0.05)
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
+    asyncio.run(_cancelled())
+    assert len(sent) == 1
+    assert (breaker.state, breaker.opened, limiter.active) == ("half_open", 1, 0)
+
+    r = client.get("/probe/ok")
+    assert (r.status_code, r.content) == (200, b"ok")
+    assert breaker.state == "closed"
+    assert ok.call_count == 1
+
+
+@respx.mock
+def test_uncacheable_misses_release_waiters_and_skip_coalescing():
+    import asyncio
+    import replica.proxy as proxy_module
+
+    class _SlowBody(httpx.AsyncByteStream):
+        async def __aiter__(self):
+            yield b"first "
+            await asyncio.sleep(0.3)
+            yield b"last"
+
+    async def _origin(request):
+        await asyncio.sleep(0.1)
+        return HTTPXResponse(
+            200, headers={"content-type": "application/octet-stream", "cache-control": "no-store"}, stream=_SlowBody()
+        )
+
+    route = respx.get(f"{TARGET}/pass/file.bin").mock(side_effect=_origin)
+
+    async def _run():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://testserver") as ac:
+            started = time.monotonic()
+            responses = await asyncio.gather(ac.get("/pass/file.bin"), ac.get("/pass/file.bin"))
+            return responses, time.monotonic() - started
+
+    (a, b), elapsed = asyncio.run(_run())
+    assert a.content == b.content == b"first last"
+    assert route.call_count == 2
+    # The follower went upstream as soon as the leader saw the headers, not
+    # after its whole (slow) transfer
+    assert proxy_module._flights.coalesced == 1
+    assert elapsed < 0.65
+
+    # Hit-for-pass: the next misses do not wait for each other at all
+    assert proxy_module._flights.is_pass(f"GET:{TARGET}/pass/file.bin")
+    asyncio.run(_run())
+    assert proxy_module._flights.coalesced == 1
+    assert route.call_count == 4
+
+
+def test_resources_reflect_the_current_proxy_state(monkeypatch):
+    import replica.proxy as proxy_module
+    from replica.proxy import resources
+    from replica.upstream import ClientPool
+
+    pool = ClientPool(lambda impersonate: None)
+    monkeypatch.setattr(proxy_module, "_client_pool", pool)
+    state = resources()
+    assert state.client_pool is pool
+    assert state.static_cache is proxy_module._static_cache
+    assert state.breaker is proxy_module._breaker
+    assert state.vary is proxy_module._vary
@@ -0,0 +1,46 @@
+import pytest
+
+from replica.ranges import RangeNotSatisfiable, content_range, if_range_matches, parse_range, total_size
+
+
+@pytest.mark.parametrize(
+    "value, expected",
+    [
+        ("bytes=0-9", (0, 10)),
+        ("bytes=90-", (90, 100)),
+        ("bytes=-10", (90, 100)),
+        ("bytes=-500", (0, 100)),
+        ("bytes=95-500", (95, 100)),
+        ("bytes = 5-5", (5, 6)),
+    ],
+)
+def test_parse_single_range(value, expected):
+    assert parse_range(value, 100) == expected
+
+
+@pytest.mark.parametrize("value", ["items=0-9", "bytes=0-1,5-6", "bytes=5-2", "bytes=a-b", "bytes=-", "bytes=10"])
+def test_unsupported_or_malformed_ranges_are_ignored(value):
+    assert parse_range(value, 100) is None
+
+
+@pytest.mark.parametrize("value", ["bytes=100-", "bytes=200-300", "bytes=-0"])
+def test_unsatisfiable_ranges(value):
+    with pytest.raises(RangeNotSatisfiable):
+        parse_range(value, 100)
+
+
+def test_if_range():
+    assert if_range_matches('"abc"', '"abc"', None)
+    assert not if_range_matches('"abc"', '"def"', None)
+    assert not if_range_matches('W/"abc"', 'W/"abc"', None)
+    assert not if_range_matches('"abc"', 'W/"abc"', None)
+    date = "Wed, 21 Oct 2015 07:28:00 GMT"
+    assert if_range_matches(date, None, date)
+    assert not if_range_matches(date, '"abc"', "Thu, 22 Oct 2015 07:28:00 GMT")
+
+
+def test_content_range_headers():
+    assert content_range(0, 10, 100) == "bytes 0-9/100"
+    assert total_size("bytes 0-9/100") == 100
+    assert total_size("bytes 0-9/*") is None
+    assert total_size(None) is None
@@ -0,0 +1,153 @@
+import re
+import time
+
+import pytest
+
+from benchmarks.origin import ORIGIN, html_payload
+from benchmarks.run import replacement_rules
+from replica.rewrite import Rewriter, get_rewriter
+from replica.utils import perform_text_replacements
+
+
+def test_rewriter_is_case_insensitive_and_maps_my_host():
+    rw = Rewriter({"Example": "MY_HOST"}, "proxy.local")
+    assert rw.rewrite("EXAMPLE and example") == "proxy.local and proxy.local"
+
+
+def test_rewriter_prefers_longest_match():
+    rw = Rewriter({"example.com": "host", "https://example.com": "https://proxy"})
+    assert rw.rewrite("https://example.com/a example.com") == "https://proxy/a host"
+
+
+def test_rewriter_first_rule_wins_for_equal_patterns():
+    rw = Rewriter({"Foo": "first", "foo": "second"})
+    assert rw.rewrite("foo FOO") == "first first"
+
+
+def test_rewriter_single_pass_does_not_chain_rules():
+    rw = Rewriter({"a": "b", "b": "c"})
+    assert rw.rewrite("ab") == "bc"
+
+
+def test_rewriter_inserts_replacements_literally():
+    rw = Rewriter({"x": r"\1 $&"})
+    assert rw.rewrite("x") == r"\1 $&"
+
+
+def test_get_rewriter_is_memoized():
+    rules = {"a": "b"}
+    assert get_rewriter(rules, "h") is get_rewriter(dict(rules), "h")
+    assert perform_text_replacements("aaa", rules, "h") == "bbb"
+
+
+def _feed_in_chunks(stream, text, size):
+    out = [stream.feed(text[i:i + size]) for i in range(0, len(text), size)]
+    return "".join(out) + stream.flush()
+
+
+def test_stream_rewriter_matches_across_chunk_boundaries():
+    from replica.rewrite import StreamRewriter
+
+    rw = Rewriter({"https://example.com": "http://proxy", "example.com": "proxy", "ex": "XX"})
+    text = "see https://example.com/x and EXAMPLE.COM or ex " * 20
+    expected = rw.rewrite(text)
+    for size in (1, 2, 3, 7, 19, 64, len(text)):
+        assert _feed_in_chunks(StreamRewriter(rw), text, size) == expected
+
+
+def test_script_injector_streams_body_and_head():
+    from replica.rewrite import ScriptInjector, inject_script
+
+    snippet = "<script>x</script>"
+    docs = [
+        "<html><head><title>t</title></head><body>page</BODY></html>",
+        "<html><head data-a='1'><title>t</title><body>no close</body>",
+        "just text",
+    ]
+    for doc in docs:
+        for location in ("head", "body"):
+            expected = inject_script(doc, snippet, location)
+            for size in (1, 5, len(doc)):
+                assert _feed_in_chunks(ScriptInjector(snippet, location), doc, size) == expected
+
+
+def test_rewriter_keeps_offsets_when_lowercasing_changes_length():
+    rw = Rewriter({"Istanbul": "city", "İzmir": "port", "x": "y"})
+    assert len("İ".lower()) != 1
+    assert rw.rewrite("İ ISTANBUL x İZMIR") == "İ city y port"
+
+
+def _per_rule_passes(text, rules):
+    # The original implementation: one case-insensitive pass per rule
+    for from_str, to_str in rules.items():
+        text = re.compile(re.escape(from_str), re.IGNORECASE).sub(lambda _m: to_str, text)
+    return text
+
+
+def _best_of(runs, fn):
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+@pytest.mark.parametrize("count", [0, 16, 64])
+def test_rewriter_is_no_slower_than_per_rule_passes(count):
+    text = html_payload(65536, 16).decode()
+    rules = {ORIGIN: "http://proxy.local", **replacement_rules(count)}
+    rw = Rewriter(rules)
+    assert rw.rewrite(text) == _per_rule_passes(text, rules)
+
+    baseline = _best_of(20, lambda: _per_rule_passes(text, rules))
+    assert _best_of(20, lambda: rw.rewrite(text)) <= baseline
+
+
+
+async def _chunks(body, size):
+    for i in range(0, len(body), size):
+        yield body[i:i + size]
+
+
+@pytest.mark.parametrize("count", [0, 16, 64])
+def test_streamed_rewrite_is_no_slower_than_per_rule_passes(count):
+    import asyncio
+
+    import httpx
+
+    from replica.proxy import _rewrite_stream
+
+    body = html_payload(65536, 16)
+    text = body.decode()
+    rules = {ORIGIN: "http://proxy.local", **replacement_rules(count)}
+    rw = Rewriter(rules)
+
+    def upstream():
+        return httpx.Response(200, headers={"content-type": "text/html"}, content=_chunks(body, 4096))
+
+    async def streamed():
+        return b"".join([chunk async for chunk in _rewrite_stream(upstream(), rw, None)])
+
+    async def buffered():
+        # What the original proxy did: read the whole body, then one pass per rule
+        response = upstream()
+        await response.aread()
+        return _per_rule_passes(response.text, rules).encode()
+
+    async def best_of(runs, fn):
+        timings = []
+        for _ in range(runs):
+            started = time.perf_counter()
+            await fn()
+            timings.append(time.perf_counter() - started)
+        return min(timings)
+
+    async def _run():
+        assert await streamed() == await buffered()
+        # Interleaved, so both see the same machine load
+        timings = [(await best_of(5, streamed), await best_of(5, buffered)) for _ in range(4)]
+        return min(t[0] for t in timings), min(t[1] for t in timings)
+
+    streamed_time, baseline = asyncio.run(_run())
+    assert streamed_time <= baseline
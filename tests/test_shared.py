@@ -0,0 +1,174 @@
+import asyncio
+import subprocess
+import sys
+import textwrap
+import time
+
+from replica.cache import CachedResponse
+from replica.shared import SharedCache
+
+
+def _value(body: bytes = b"body") -> CachedResponse:
+    return CachedResponse(body, {"content-type": "image/png"}, 200, {"etag": '"v1"'}, True, "gzip", {"br": b"br"})
+
+
+def test_entries_are_visible_to_other_processes(tmp_path):
+    path = str(tmp_path / "shared.db")
+    SharedCache(path).put("static:k", _value(), 60, 30)
+
+    # A second handle on the same file stands in for another worker process
+    other = SharedCache(path)
+    value, staleness, ttl, grace = other.lookup("static:k")
+    assert (value.body, value.encoding, value.variants) == (b"body", "gzip", {"br": b"br"})
+    assert (value.headers, value.validators, value.shared) == ({"content-type": "image/png"}, {"etag": '"v1"'}, True)
+    assert staleness == 0 and 55 < ttl <= 60 and abs(grace - 30) < 0.01
+    assert other.lookup("static:missing") is None
+    assert (other.hits, other.misses) == (1, 1)
+
+
+def test_expired_entries_are_misses_until_swept(tmp_path):
+    cache = SharedCache(str(tmp_path / "shared.db"))
+    cache.put("stale", _value(), -5, 10)
+    cache.put("gone", _value(), -5, 1)
+    assert cache.lookup("stale")[1] >= 5
+    assert cache.lookup("gone") is None
+    assert cache.lookup("gone", keep_expired=True) is not None
+    assert cache.sweep() == 1
+    assert "gone" not in cache and "stale" in cache
+
+
+def test_touch_and_delete(tmp_path):
+    cache = SharedCache(str(tmp_path / "shared.db"))
+    cache.put("k", _value(), -5, 10)
+    assert cache.touch("k", 60, 0, date=123.0)
+    value, staleness, ttl, _ = cache.lookup("k")
+    assert (staleness, value.date) == (0, 123.0) and ttl > 55
+    cache.delete("k")
+    assert not cache.touch("k", 60)
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = SharedCache(str(tmp_path / "shared.db"), max_bytes=25)
+    cache.put("a", _value(b"a" * 8), 60)
+    time.sleep(0.01)
+    cache.put("b", _value(b"b" * 8), 60)
+    time.sleep(0.01)
+    cache.put("c", _value(b"c" * 8), 60)
+    assert "a" not in cache and "b" in cache and "c" in cache
+    assert cache.current_bytes == 20 and cache.evictions == 1
+
+
+def test_leases_coalesce_misses_across_processes(tmp_path):
+    path = str(tmp_path / "shared.db")
+    ours = SharedCache(path)
+    script = textwrap.dedent(
+        f"""
+        import sys, time
+        from replica.cache import CachedResponse
+        from replica.shared import SharedCache
+        cache = SharedCache({path!r})
+        assert cache.lease("k", 30)
+        print("leased", flush=True)
+        time.sleep(0.3)
+        cache.put("static:k", CachedResponse(b"fetched", {{}}, 200), 60)
+        cache.release("k")
+        """
+    )
+    proc = subprocess.Popen([sys.executable, "-c", script], stdout=subprocess.PIPE, text=True)
+    try:
+        assert proc.stdout.readline().strip() == "leased"
+        assert not ours.lease("k", 30)
+        assert asyncio.run(ours.wait("k", 5))
+        assert ours.lookup("static:k")[0].body == b"fetched"
+        assert ours.lease("k", 30)
+    finally:
+        proc.wait(10)
+
+
+def test_abandoned_leases_are_taken_over(tmp_path):
+    path = str(tmp_path / "shared.db")
+    first, second = SharedCache(path), SharedCache(path)
+    assert first.lease("k", 0.05)
+    assert not second.lease("k", 1)
+    assert not asyncio.run(second.wait("k", 0.01))
+    time.sleep(0.06)
+    assert second.lease("k", 1)
+    # The previous holder no longer releases the new lease
+    first.release("k")
+    assert first.leased("k")
+
+
+def test_totals_are_kept_without_scanning(tmp_path):
+    cache = SharedCache(str(tmp_path / "shared.db"))
+    cache.put("a", _value(b"a" * 8), 60)
+    cache.put("b", _value(b"b" * 8), -5, 1)
+    assert (len(cache), cache.current_bytes) == (2, 20)
+    cache.put("a", _value(b"a" * 4), 60)  # replaced in place
+    assert (len(cache), cache.current_bytes) == (2, 16)
+    cache.delete("a")
+    assert (len(cache), cache.current_bytes) == (1, 10)
+    cache.sweep()
+    assert (len(cache), cache.current_bytes) == (0, 0)
+    cache.close()
+
+    # Files written before the totals existed get them computed once
+    import sqlite3
+
+    path = str(tmp_path / "old.db")
+    SharedCache(path).put("k", _value(b"k" * 8), 60)
+    db = sqlite3.connect(path)
+    db.execute("DROP TABLE totals")
+    db.commit()
+    db.close()
+    reopened = SharedCache(path)
+    assert reopened.lookup("k") is not None
+    assert reopened.current_bytes == 10
+
+
+def test_database_calls_run_off_the_event_loop(tmp_path):
+    import sqlite3
+
+    path = str(tmp_path / "shared.db")
+    cache = SharedCache(path, busy_timeout=0.3)
+    cache.put("warm", _value(), 60)
+    # Another process holds the write lock
+    blocker = sqlite3.connect(path, isolation_level=None)
+    blocker.execute("BEGIN IMMEDIATE")
+
+    async def _run():
+        ticks = 0
+
+        async def _ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        ticker = asyncio.ensure_future(_ticker())
+        cache.submit(cache.put, "k", _value(b"queued"), 60)
+        await cache.run(cache.delete, "warm")
+        ticker.cancel()
+        return ticks
+
+    try:
+        assert asyncio.run(_run()) >= 10
+    finally:
+        blocker.execute("ROLLBACK")
+        blocker.close()
+    # Calls run in order: the queued write went first (and gave up on the lock)
+    cache.submit(cache.put, "k", _value(b"queued"), 60)
+    assert asyncio.run(cache.run(cache.lookup, "k"))[0].body == b"queued"
+    cache.close()
+
+
+def test_totals_are_reported_without_the_database(tmp_path):
+    cache = SharedCache(str(tmp_path / "shared.db"))
+    cache.put("a", _value(b"a" * 8), 60)
+    cache.put("b", _value(b"b" * 8), 60)
+
+    def _no_database():
+        raise AssertionError("metrics must not query the database")
+
+    cache._db = _no_database
+    # What a metrics scrape on the event loop reads
+    assert (len(cache), cache.current_bytes) == (2, 20)
@@ -0,0 +1,81 @@
+import asyncio
+import struct
+
+import pytest
+
+from replica.cache import BodyStore, Cache, CachedResponse
+from replica.cachekey import VaryIndex
+from replica.snapshot import SnapshotError, load_snapshot, read_snapshot, save_snapshot, write_snapshot
+
+
+def _caches():
+    return {"static": Cache(bodies=BodyStore()), "html": Cache()}
+
+
+def test_snapshot_roundtrip(tmp_path):
+    path = str(tmp_path / "cache.snap")
+    caches = _caches()
+    vary = VaryIndex()
+    vary.set("GET:https://example.com/api", ("accept-language",))
+    caches["static"].put(
+        "GET:https://example.com/logo.png",
+        CachedResponse(b"png", {"content-type": "image/png"}, 200, {"etag": '"v1"'}, shared=True),
+        60,
+        30,
+    )
+    caches["html"].put(
+        "GET:http://testserver/",
+        CachedResponse(b"gz", {"content-type": "text/html"}, 200, encoding="gzip", variants={"br": b"br"}),
+        60,
+    )
+    caches["html"].put("GET:http://testserver/gone", CachedResponse(b"old", {}, 200), -10)
+
+    assert asyncio.run(save_snapshot(path, caches, vary)) == 3
+
+    restored = _caches()
+    restored_vary = VaryIndex()
+    assert asyncio.run(load_snapshot(path, restored, restored_vary)) == 2
+    assert restored_vary.get("GET:https://example.com/api") == ("accept-language",)
+
+    logo = restored["static"].get("GET:https://example.com/logo.png")
+    assert (logo.body, logo.status, logo.validators, logo.shared) == (b"png", 200, {"etag": '"v1"'}, True)
+    ttl, grace = restored["static"].expiry("GET:https://example.com/logo.png")
+    assert 55 < ttl <= 60 and grace == pytest.approx(30)
+
+    page = restored["html"].get("GET:http://testserver/")
+    assert (page.body, page.encoding, page.variants) == (b"gz", "gzip", {"br": b"br"})
+    assert "GET:http://testserver/gone" not in restored["html"]
+
+
+def test_expired_entries_are_skipped(tmp_path):
+    path = str(tmp_path / "cache.snap")
+    value = CachedResponse(b"x" * 100, {}, 200)
+    write_snapshot(path, [("static", "stale", value, -20, 10), ("static", "fresh", value, 20, 0)])
+    assert [record[1] for record in read_snapshot(path)] == ["fresh"]
+
+
+def test_loading_keeps_entries_cached_meanwhile(tmp_path):
+    path = str(tmp_path / "cache.snap")
+    write_snapshot(path, [("static", "k", CachedResponse(b"old", {}, 200), 60, 0)])
+    caches = _caches()
+    caches["static"].put("k", CachedResponse(b"new", {}, 200), 60)
+    assert asyncio.run(load_snapshot(path, caches, VaryIndex(), batch=1)) == 0
+    assert caches["static"].get("k").body == b"new"
+
+
+def test_truncated_snapshot_stops_at_last_complete_record(tmp_path):
+    path = tmp_path / "cache.snap"
+    value = CachedResponse(b"body", {}, 200)
+    write_snapshot(str(path), [("static", "a", value, 60, 0), ("static", "b", value, 60, 0)])
+    path.write_bytes(path.read_bytes()[:-2])
+    assert [record[1] for record in read_snapshot(str(path))] == ["a"]
+
+
+def test_unknown_versions_are_rejected(tmp_path):
+    path = tmp_path / "cache.snap"
+    path.write_bytes(struct.pack(">8sH", b"RPLCSNAP", 99))
+    with pytest.raises(SnapshotError):
+        list(read_snapshot(str(path)))
+    path.write_bytes(b"garbage!!!")
+    with pytest.raises(SnapshotError):
+        list(read_snapshot(str(path)))
@@ -33,7 +33,7 @@ def test_create_client_uses_curl_transport_when_available(monkeypatch):
     import importlib
     
     monkeypatch.setattr("httpx_curl_cffi.AsyncCurlTransport", DummyTransport)
-    monkeypatch.setattr("httpx_curl_cffi.CurlOpt", type("O", (), {"FRESH_CONNECT": "fresh"}))
+    monkeypatch.setattr("httpx_curl_cffi.CurlOpt", type("O", (), {"FRESH_CONNECT": "fresh", "MAXAGE_CONN": "maxage"}))
     
     # Reload to pick up monkeypatched imports
     importlib.reload(proxy_module)
@@ -43,3 +43,188 @@ def test_create_client_uses_curl_transport_when_available(monkeypatch):
     # Ensure our DummyTransport constructor was called with the impersonation profile
     assert getattr(DummyTransport, "last", None) is not None
     assert DummyTransport.last["kwargs"]["impersonate"] == "firefox"
+
+
+def test_create_client_does_not_force_fresh_connections(monkeypatch):
+    import importlib
+
+    monkeypatch.setattr("httpx_curl_cffi.AsyncCurlTransport", DummyTransport)
+    monkeypatch.setattr("httpx_curl_cffi.CurlOpt", type("O", (), {"FRESH_CONNECT": "fresh", "MAXAGE_CONN": "maxage"}))
+    importlib.reload(proxy_module)
+
+    proxy_module._create_async_client("chrome")
+
+    kwargs = DummyTransport.last["kwargs"]
+    assert "fresh" not in kwargs["curl_options"]
+    assert kwargs["curl_options"]["maxage"] == int(proxy_module.settings.UPSTREAM_KEEPALIVE_EXPIRY)
+    assert kwargs["max_connections"] == proxy_module.settings.UPSTREAM_MAX_CONNECTIONS
+
+
+def test_client_pool_reuses_client_per_profile():
+    from replica.upstream import ClientPool
+
+    created = []
+
+    def _factory(impersonate):
+        client = DummyClient()
+        client.is_closed = False
+        created.append(impersonate)
+        return client
+
+    pool = ClientPool(_factory)
+    assert pool.get("chrome") is pool.get("chrome")
+    assert pool.get("firefox") is not pool.get("chrome")
+    assert created == ["chrome", "firefox"]
+
+
+def test_upstream_limiter_queues_and_sheds():
+    import asyncio
+    from replica.upstream import Overloaded, UpstreamLimiter
+
+    async def _run():
+        limiter = UpstreamLimiter(max_active=1, max_queue=1, queue_timeout=0.05)
+        await limiter.acquire("chrome")
+
+        # Queued until the slot is released
+        waiter = asyncio.create_task(limiter.acquire("chrome"))
+        await asyncio.sleep(0)
+        assert limiter.queue_depth == 1
+        # Queue full: shed right away
+        try:
+            await limiter.acquire("firefox")
+        except Overloaded:
+            pass
+        else:
+            raise AssertionError("expected Overloaded")
+        limiter.release("chrome")
+        await waiter
+        assert (limiter.active, limiter.queue_depth) == (1, 0)
+
+        # Nobody releases: the queued request times out
+        try:
+            await limiter.acquire("chrome")
+        except Overloaded:
+            pass
+        else:
+            raise AssertionError("expected Overloaded")
+        return limiter
+
+    limiter = asyncio.run(_run())
+    assert (limiter.queued, limiter.shed_queue_full, limiter.shed_timeout) == (2, 1, 1)
+
+
+def test_upstream_limiter_per_profile_limit():
+    import asyncio
+    from replica.upstream import UpstreamLimiter
+
+    async def _run():
+        limiter = UpstreamLimiter(max_active=3, max_per_profile=1, max_queue=5, queue_timeout=1)
+        await limiter.acquire("chrome")
+        blocked = asyncio.create_task(limiter.acquire("chrome"))
+        await asyncio.sleep(0)
+        # Another profile is not held up by the queued chrome request
+        await asyncio.wait_for(limiter.acquire("firefox"), 0.1)
+        assert limiter.queue_depth == 1
+        limiter.release("chrome")
+        await blocked
+        return limiter.active_by_profile
+
+    assert asyncio.run(_run()) == {"chrome": 1, "firefox": 1}
+
+
+def test_release_on_close_releases_once():
+    import asyncio
+    import httpx
+    from replica.upstream import release_on_close
+
+    released = []
+
+    async def _run():
+        response = httpx.Response(200, stream=httpx.ByteStream(b"body"))
+        release_on_close(response, lambda: released.append(1))
+        assert await response.aread() == b"body"
+        await response.aclose()
+
+    asyncio.run(_run())
+    assert released == [1]
+
+
+def test_circuit_breaker_opens_probes_and_closes(monkeypatch):
+    from replica import upstream
+    from replica.upstream import CircuitBreaker
+
+    now = [1000.0]
+    monkeypatch.setattr(upstream.time, "monotonic", lambda: now[0])
+    breaker = CircuitBreaker(failure_rate=0.5, min_requests=4, window=10, open_seconds=5, half_open_probes=1)
+
+    for ok in (True, True, False):
+        breaker.record(ok)
+    assert breaker.state == "closed"
+    breaker.record(False)  # 2 of 4 failed
+    assert breaker.state == "open"
+    assert not breaker.allow()
+    assert breaker.rejected == 1
+    assert breaker.retry_after() == 5
+
+    now[0] += 5
+    assert breaker.state == "half_open"
+    assert breaker.allow()
+    assert not breaker.allow()  # only one probe at a time
+    breaker.abandon()  # e.g. cancelled: the probe is handed back
+    assert breaker.state == "half_open"
+    assert breaker.allow()
+    breaker.record(False)
+    assert breaker.state == "open"
+    assert breaker.opened == 2
+
+    now[0] += 5
+    assert breaker.allow()
+    breaker.record(True)
+    assert breaker.state == "closed"
+    assert breaker.allow()
+
+    # Old outcomes leave the window
+    for _ in range(3):
+        breaker.record(False)
+    now[0] += 11
+    breaker.record(False)
+    assert breaker.state == "closed"
+
+
+def test_circuit_breaker_ignores_results_from_earlier_states(monkeypatch):
+    from replica import upstream
+    from replica.upstream import CircuitBreaker
+
+    now = [1000.0]
+    monkeypatch.setattr(upstream.time, "monotonic", lambda: now[0])
+    breaker = CircuitBreaker(failure_rate=0.5, min_requests=1, window=10, open_seconds=5, half_open_probes=1)
+
+    assert breaker.allow()
+    slow = breaker.generation  # sent while closed, answered much later
+    breaker.record(False)
+    assert breaker.state == "open"
+    now[0] += 5
+    assert breaker.allow()
+    probe = breaker.generation
+    assert probe != slow
+
+    # The late result neither closes nor re-opens the half-open breaker
+    breaker.record(True, slow)
+    breaker.record(False, slow)
+    breaker.abandon(slow)
+    assert breaker.state == "half_open"
+    assert not breaker.allow()
+    breaker.record(True, probe)
+    assert breaker.state == "closed"
+
+
+def test_create_client_uses_separate_connect_and_read_timeouts(monkeypatch):
+    import importlib
+
+    monkeypatch.setattr("httpx_curl_cffi.AsyncCurlTransport", DummyTransport)
+    monkeypatch.setattr(proxy_module.settings, "UPSTREAM_CONNECT_TIMEOUT", 2.0)
+    monkeypatch.setattr(proxy_module.settings, "UPSTREAM_READ_TIMEOUT", 7.0)
+    importlib.reload(proxy_module)
+
+    client = proxy_module._create_async_client("chrome")
+    assert (client.timeout.connect, client.timeout.read) == (2.0, 7.0)
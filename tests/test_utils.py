@@ -0,0 +1,51 @@
+from replica.utils import (
+    compute_etag,
+    filter_cookies,
+    is_not_modified,
+    sanitize_request_headers,
+    sanitize_response_headers,
+)
+
+
+def test_is_not_modified_if_none_match_uses_weak_comparison():
+    headers = {"etag": '"abc"'}
+    assert is_not_modified({"if-none-match": 'W/"abc"'}, headers)
+    assert is_not_modified({"if-none-match": '"x", "abc"'}, headers)
+    assert is_not_modified({"if-none-match": "*"}, headers)
+    assert not is_not_modified({"if-none-match": '"x"'}, headers)
+
+
+def test_is_not_modified_if_modified_since():
+    headers = {"last-modified": "Tue, 01 Sep 2026 10:00:00 GMT"}
+    assert is_not_modified({"if-modified-since": "Tue, 01 Sep 2026 10:00:00 GMT"}, headers)
+    assert not is_not_modified({"if-modified-since": "Mon, 31 Aug 2026 10:00:00 GMT"}, headers)
+    assert not is_not_modified({"if-modified-since": "garbage"}, headers)
+
+
+def test_compute_etag_is_stable():
+    assert compute_etag(b"body") == compute_etag(b"body")
+    assert compute_etag(b"body") != compute_etag(b"other")
+
+
+def test_sanitize_request_headers_drops_and_maps_to_target():
+    headers = {"CF-Ray": "1", "x-forwarded-for": "1.2.3.4", "referer": "http://me.test/page", "origin": "http://me.test"}
+    out = sanitize_request_headers(headers, "http://me.test", "me.test", "https://example.com")
+    assert out == {"referer": "https://example.com/page", "origin": "https://example.com"}
+
+
+def test_sanitize_response_headers_maps_to_incoming_origin():
+    headers = {
+        "location": "https://example.com/next",
+        "set-cookie": "a=1; Domain=EXAMPLE.com",
+        "via": "1.1 cdn",
+        "content-length": "10",
+    }
+    out = sanitize_response_headers(headers, "https://example.com", "example.com", "http://me.test", "me.test")
+    assert out == {"location": "http://me.test/next", "set-cookie": "a=1; Domain=me.test"}
+
+
+def test_filter_cookies_drops_cloudflare_cookies():
+    assert filter_cookies("a=1; __cf_bm=x; b=2") == "a=1; b=2"
+    assert filter_cookies("cf_clearance=x") == ""
+    folded = "a=1; Expires=Tue, 30-Dec-25 10:00:00 GMT, _cfuvid=y; Path=/, b=2"
+    assert filter_cookies(folded, set_cookie=True) == "a=1; Expires=Tue, 30-Dec-25 10:00:00 GMT, b=2"
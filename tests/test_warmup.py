@@ -0,0 +1,65 @@
+import asyncio
+import gzip
+
+import respx
+from fastapi.testclient import TestClient
+
+from replica.config import settings
+from replica.main import app
+from replica.prefetch import extract_assets
+from replica.warmup import parse_sitemap, warm_up
+
+TARGET = settings.TARGET_ORIGIN.rstrip("/")
+
+SITEMAP = f"""<?xml version="1.0" encoding="UTF-8"?>
+<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">
+  <url><loc>{TARGET}/warm/a</loc></url>
+  <url><loc>{TARGET}/warm/b?x=1</loc></url>
+  <url><loc>https://elsewhere.test/c</loc></url>
+</urlset>"""
+
+
+def test_parse_sitemap_and_index():
+    pages, sitemaps = parse_sitemap(gzip.compress(SITEMAP.encode()))
+    assert pages == [f"{TARGET}/warm/a", f"{TARGET}/warm/b?x=1", "https://elsewhere.test/c"]
+    assert sitemaps == []
+
+    index = b"""<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">
+      <sitemap><loc>https://x.test/s1.xml</loc></sitemap></sitemapindex>"""
+    assert parse_sitemap(index) == ([], ["https://x.test/s1.xml"])
+    assert parse_sitemap(b"not xml") == ([], [])
+
+
+def test_extract_assets_keeps_same_origin_subresources():
+    html = """
+      <link rel="stylesheet" href="/css/site.css"><link rel=canonical href="/page">
+      <link rel="icon" href='favicon.ico'>
+      <script src="https://cdn.test/lib.js"></script><script src="/js/app.js#x"></script>
+      <img alt="x" src="img/logo.png"><img src="data:image/png;base64,AA"><img src="/css/site.css">
+    """
+    assert extract_assets(html, "https://origin.test/docs/index.html") == [
+        "https://origin.test/css/site.css",
+        "https://origin.test/docs/favicon.ico",
+        "https://origin.test/js/app.js",
+        "https://origin.test/docs/img/logo.png",
+    ]
+    assert len(extract_assets(html, "https://origin.test/docs/", limit=2)) == 2
+
+
+@respx.mock
+def test_warm_up_fills_caches_from_urls_and_sitemap(monkeypatch):
+    monkeypatch.setattr(settings, "WARMUP_URLS", ["/warm/logo.png"])
+    monkeypatch.setattr(settings, "WARMUP_SITEMAP", "/sitemap.xml")
+    respx.get(f"{TARGET}/sitemap.xml").respond(200, content=SITEMAP, headers={"content-type": "application/xml"})
+    pages = {
+        "a": respx.get(f"{TARGET}/warm/a").respond(200, content="<html>a</html>", headers={"content-type": "text/html"}),
+        "b": respx.get(f"{TARGET}/warm/b?x=1").respond(200, content="<html>b</html>", headers={"content-type": "text/html"}),
+        "logo": respx.get(f"{TARGET}/warm/logo.png").respond(200, content=b"png", headers={"content-type": "image/png"}),
+    }
+
+    assert asyncio.run(warm_up(app)) == (3, 0)
+
+    client = TestClient(app)
+    for path in ("/warm/a", "/warm/b?x=1", "/warm/logo.png"):
+        assert client.get(path).headers["x-cache"] == "HIT"
+    assert all(route.call_count == 1 for route in pages.values())